@@ -0,0 +1,187 @@
+import argparse
+import fcntl
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+# Cuadros de amortización en columnas de ancho fijo, un fichero binario por columna.
+# Las filas de cada cliente son contiguas y el índice guarda dónde empiezan y cuántas son.
+# Solo se añade al final: simular de nuevo a un cliente añade otra versión y el índice
+# apunta a la última; lo ya escrito no se reescribe nunca.
+RUTA_ALMACEN = os.getenv("ALMACEN_AMORTIZACION",
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), "amortizacion"))
+
+COLUMNAS = {
+    "mes": np.dtype("<i4"),
+    "fecha": np.dtype("<i4"),  # días desde 1970-01-01
+    "cuota": np.dtype("<f4"),
+    "interes": np.dtype("<f4"),
+    "amortizacion": np.dtype("<f4"),
+    "saldo": np.dtype("<f4")
+}
+
+INDICE = np.dtype([("cliente", "<i8"), ("tipo", "<i1"), ("inicio", "<i8"), ("filas", "<i4"),
+                   ("tasa", "<f4"), ("importe", "<f4"), ("guardado", "<f8")])
+
+TIPOS = {"variable": 0, "fijo": 1}
+
+
+class AlmacenAmortizacion:
+    """
+    Almacén columnar de cuadros de amortización sobre numpy.memmap.
+    `leer` devuelve vistas de los ficheros mapeados en memoria (sin copiar las filas);
+    las escrituras son append y las serializa un flock, así que varios procesos
+    pueden añadir a la vez y los lectores nunca ven filas a medio escribir
+    (una entrada solo existe cuando su registro está en el índice).
+    """
+
+    def __init__(self, carpeta: str = RUTA_ALMACEN):
+        self.carpeta = carpeta
+        self._lock = threading.Lock()
+        self._mapas = {}          # columna -> memmap del fichero entero
+        self._tamano_indice = -1  # bytes del índice ya cargados
+        self._claves = np.empty(0, dtype=np.int64)
+        self._entradas = np.empty(0, dtype=INDICE)
+
+    def _ruta(self, nombre: str) -> str:
+        return os.path.join(self.carpeta, nombre)
+
+    # -------------------------------
+    # Escritura
+    # -------------------------------
+    @contextmanager
+    def _escritor(self):
+        os.makedirs(self.carpeta, exist_ok=True)
+        with open(self._ruta("indice.bin"), "ab") as indice:
+            fcntl.flock(indice, fcntl.LOCK_EX)
+            try:
+                yield indice
+            finally:
+                fcntl.flock(indice, fcntl.LOCK_UN)
+
+    def _filas_validas(self) -> int:
+        """
+        Filas de las columnas que cubre el índice (lo que haya detrás es de una escritura interrumpida).
+        Los registros solo se añaden y `inicio` siempre crece: basta con leer el último completo.
+        """
+        ruta = self._ruta("indice.bin")
+        registros = os.path.getsize(ruta) // INDICE.itemsize
+        if registros == 0:
+            return 0
+        ultimo = np.fromfile(ruta, dtype=INDICE, count=1, offset=(registros - 1) * INDICE.itemsize)[0]
+        return int(ultimo["inicio"]) + int(ultimo["filas"])
+
+    def guardar_lote(self, cuadros: list):
+        """
+        Añade varios cuadros de una vez: `cuadros` son tuplas (cliente, tipo, tasa, importe, columnas),
+        con `columnas` como las devuelve calcular_amortizacion.
+        """
+        if not cuadros:
+            return
+        with self._escritor() as indice:
+            inicio = self._filas_validas()
+            registros = np.zeros(len(cuadros), dtype=INDICE)
+            datos = {c: [] for c in COLUMNAS}
+            ahora = time.time()
+            for i, (cliente, tipo, tasa, importe, columnas) in enumerate(cuadros):
+                filas = len(columnas["mes"])
+                registros[i] = (cliente, TIPOS[tipo], inicio, filas, tasa, importe, ahora)
+                inicio += filas
+                datos["mes"].append(columnas["mes"])
+                datos["fecha"].append(np.asarray(columnas["fecha"], dtype="datetime64[D]").astype(np.int64))
+                for c in ("cuota", "interes", "amortizacion", "saldo"):
+                    datos[c].append(columnas[c])
+
+            inicio_lote = int(registros["inicio"][0])
+            for columna, dtype in COLUMNAS.items():
+                with open(self._ruta(f"{columna}.bin"), "ab") as f:
+                    # Descarta la cola de una escritura interrumpida antes de añadir
+                    if f.tell() != inicio_lote * dtype.itemsize:
+                        f.truncate(inicio_lote * dtype.itemsize)
+                    f.write(np.concatenate(datos[columna]).astype(dtype, copy=False).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            # El registro en el índice es lo que hace visibles las filas
+            indice.write(registros.tobytes())
+            indice.flush()
+            os.fsync(indice.fileno())
+
+    def guardar(self, cliente: int, tipo: str, tasa: float, importe: float, columnas: dict):
+        self.guardar_lote([(cliente, tipo, tasa, importe, columnas)])
+
+    # -------------------------------
+    # Lectura
+    # -------------------------------
+    def _actualizar_indice(self):
+        ruta = self._ruta("indice.bin")
+        tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        if tamano == self._tamano_indice:
+            return
+        entradas = np.fromfile(ruta, dtype=INDICE, count=tamano // INDICE.itemsize) if tamano else \
+            np.empty(0, dtype=INDICE)
+        claves = entradas["cliente"] * 2 + entradas["tipo"]
+        # La última versión de cada (cliente, tipo): np.unique sobre el índice invertido
+        claves_unicas, posiciones = np.unique(claves[::-1], return_index=True)
+        self._claves = claves_unicas
+        self._entradas = entradas[len(entradas) - 1 - posiciones]
+        self._tamano_indice = tamano
+
+    def _mapa(self, columna: str, filas_necesarias: int) -> np.memmap:
+        mapa = self._mapas.get(columna)
+        if mapa is None or len(mapa) < filas_necesarias:
+            # El fichero ha crecido desde que se mapeó: se vuelve a mapear (las vistas antiguas siguen valiendo)
+            mapa = np.memmap(self._ruta(f"{columna}.bin"), dtype=COLUMNAS[columna], mode="r")
+            self._mapas[columna] = mapa
+        return mapa
+
+    def entrada(self, cliente: int, tipo: str = "variable"):
+        """Registro del índice (inicio, filas, tasa, importe...) o None si el cliente no tiene cuadro"""
+        with self._lock:
+            self._actualizar_indice()
+            clave = cliente * 2 + TIPOS[tipo]
+            posicion = np.searchsorted(self._claves, clave)
+            if posicion == len(self._claves) or self._claves[posicion] != clave:
+                return None
+            return self._entradas[posicion]
+
+    def leer(self, cliente: int, tipo: str = "variable") -> dict:
+        """Columnas del cuadro del cliente como vistas de solo lectura sobre los ficheros mapeados"""
+        entrada = self.entrada(cliente, tipo)
+        if entrada is None:
+            raise KeyError(f"Sin cuadro de amortización {tipo} para el cliente {cliente}")
+        inicio, filas = int(entrada["inicio"]), int(entrada["filas"])
+        with self._lock:
+            return {c: self._mapa(c, inicio + filas)[inicio:inicio + filas] for c in COLUMNAS}
+
+    def leer_dataframe(self, cliente: int, tipo: str = "variable") -> pd.DataFrame:
+        """Copia del cuadro como DataFrame, con las fechas como datetime64"""
+        columnas = self.leer(cliente, tipo)
+        return pd.DataFrame(dict(columnas, fecha=np.asarray(columnas["fecha"]).astype("datetime64[D]")))
+
+    def clientes(self) -> np.ndarray:
+        with self._lock:
+            self._actualizar_indice()
+            return np.unique(self._claves // 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consulta el almacén de cuadros de amortización")
+    parser.add_argument("cliente", type=int, nargs="?", help="rowid del cliente (sin él, un resumen del almacén)")
+    parser.add_argument("--tipo", choices=list(TIPOS), default="variable")
+    parser.add_argument("--carpeta", default=RUTA_ALMACEN)
+    args = parser.parse_args()
+
+    almacen = AlmacenAmortizacion(args.carpeta)
+    if args.cliente is None:
+        clientes = almacen.clientes()
+        filas = almacen._filas_validas() if os.path.exists(almacen._ruta("indice.bin")) else 0
+        print(f"{len(clientes)} clientes, {filas} filas en {args.carpeta}")
+        return
+    print(almacen.leer_dataframe(args.cliente, args.tipo).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
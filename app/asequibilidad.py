@@ -0,0 +1,163 @@
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from calculo_hipoteca import (EURIBOR_ACTUAL, TASA_FIJA, RATIO_ENDEUDAMIENTO, CUOTA_MAXIMA_MINIMA, cuota_maxima,
+                              diferencial_por_riesgo)
+from escenarios import PLAZOS_ANOS
+
+# Rejilla de la tabla de factores de anualidad: tipos de 0 a 15% en puntos básicos y plazos de 1 a 480 meses
+TASA_MAXIMA_PB = 1500
+MESES_MAXIMOS = 480
+
+_tabla = None
+_lock = threading.Lock()
+
+
+def tabla_factores() -> np.ndarray:
+    """
+    Factor de anualidad a(r, n) = (1 - (1+r)^-n) / r para cada tipo (fila, en pb) y plazo
+    (columna, meses - 1): el importe que se amortiza pagando 1 € al mes.
+    Se calcula una vez por proceso (unos 6 MB).
+    """
+    global _tabla
+    if _tabla is None:
+        with _lock:
+            if _tabla is None:
+                r = np.arange(TASA_MAXIMA_PB + 1)[:, None] / 10000 / 12
+                n = np.arange(1, MESES_MAXIMOS + 1)[None, :]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    factores = -np.expm1(-n * np.log1p(r)) / r
+                factores[0] = n[0]
+                factores.setflags(write=False)
+                _tabla = factores
+    return _tabla
+
+
+def factor_anualidad(tasa_anual, meses) -> np.ndarray:
+    """
+    Factor de anualidad para tipos (en %) y plazos (en meses), con broadcasting.
+    Los que caen en la rejilla (pb enteros, 1 a 480 meses) se leen de la tabla;
+    el resto se calcula con la fórmula.
+    """
+    if np.isscalar(tasa_anual) and np.isscalar(meses):
+        pb = round(tasa_anual * 100)
+        if abs(pb - tasa_anual * 100) < 1e-6 and 0 <= pb <= TASA_MAXIMA_PB and 1 <= meses <= MESES_MAXIMOS:
+            return tabla_factores()[pb, int(meses) - 1]
+    tasa_anual, meses = np.broadcast_arrays(np.asarray(tasa_anual, dtype=float), np.asarray(meses, dtype=np.int64))
+    pb = np.rint(tasa_anual * 100)
+    en_tabla = (np.abs(pb - tasa_anual * 100) < 1e-6) & (pb >= 0) & (pb <= TASA_MAXIMA_PB) \
+        & (meses >= 1) & (meses <= MESES_MAXIMOS)
+    if en_tabla.all():
+        return tabla_factores()[pb.astype(np.int64), meses - 1]
+    r = tasa_anual / 100 / 12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factores = np.where(r == 0, meses, -np.expm1(-meses * np.log1p(r)) / r)
+    factores[en_tabla] = tabla_factores()[pb[en_tabla].astype(np.int64), meses[en_tabla] - 1]
+    return factores
+
+
+# -------------------------------
+# Inversas de la anualidad
+# -------------------------------
+def importe_maximo(cuota_max, tasa_anual, anos) -> np.ndarray:
+    """Mayor importe que se amortiza con `cuota_max` al mes, a ese tipo y plazo"""
+    return np.asarray(cuota_max, dtype=float) * factor_anualidad(tasa_anual, np.asarray(anos) * 12)
+
+
+def precio_maximo(cuota_max, tasa_anual, anos, entrada=0.0) -> np.ndarray:
+    """Precio de vivienda más alto asumible: importe máximo más la entrada"""
+    return importe_maximo(cuota_max, tasa_anual, anos) + np.asarray(entrada, dtype=float)
+
+
+def cuota_necesaria(importe, tasa_anual, anos) -> np.ndarray:
+    """Cuota mensual de un importe (igual que cuotas_mensuales, pero leyendo la tabla)"""
+    return np.asarray(importe, dtype=float) / factor_anualidad(tasa_anual, np.asarray(anos) * 12)
+
+
+def ingresos_minimos(importe, tasa_anual, anos, gastos=0.0) -> np.ndarray:
+    """
+    Ingresos netos mensuales mínimos para financiar `importe`: inversa de
+    cuota_max = max(CUOTA_MAXIMA_MINIMA, RATIO_ENDEUDAMIENTO · (ingresos - gastos)).
+    Si la cuota necesaria no pasa del mínimo, cuota_maxima la cubre con cualquier ingreso: 0.
+    """
+    cuota = cuota_necesaria(importe, tasa_anual, anos)
+    ingresos = cuota / RATIO_ENDEUDAMIENTO + np.asarray(gastos, dtype=float)
+    return np.where(cuota <= CUOTA_MAXIMA_MINIMA, 0.0, ingresos)
+
+
+def comprobar_inversas(gastos=(0.0, 900.0)) -> float:
+    """
+    Ida y vuelta con cuota_maxima en toda la rejilla: con los ingresos mínimos la cuota máxima
+    cubre justo la cuota necesaria (o la supera por el mínimo de CUOTA_MAXIMA_MINIMA).
+    Devuelve el mayor error relativo y falla si pasa de 1e-9.
+    """
+    importes = np.array([5000.0, 10000.0, 150000.0, 400000.0])[:, None, None, None]
+    tasas = np.array([0.0, 2.25, 3.5, 15.0])[None, :, None, None]
+    plazos = np.array([5, 30, 40])[None, None, :, None]
+    gastos = np.asarray(gastos, dtype=float)[None, None, None, :]
+    cuota = cuota_necesaria(importes, tasas, plazos)
+    cuota_max = cuota_maxima(ingresos_minimos(importes, tasas, plazos, gastos), gastos)
+    error = np.abs(cuota_max - np.maximum(cuota, CUOTA_MAXIMA_MINIMA)) / cuota
+    if error.max() > 1e-9:
+        raise ArithmeticError(f"ingresos_minimos no es la inversa de cuota_maxima (error relativo {error.max():.2e})")
+    return float(error.max())
+
+
+# -------------------------------
+# Curva de un cliente
+# -------------------------------
+def asequibilidad_cliente(ingresos: float, gastos: float, entrada: float = 0.0, plazos=None, tasas=None) -> dict:
+    """
+    Curva de asequibilidad de un cliente en una sola operación vectorizada: importe y precio
+    máximos para cada tipo (filas) y plazo en años (columnas). Por defecto, los tipos son el
+    variable que le corresponde por riesgo y el fijo.
+    """
+    plazos = PLAZOS_ANOS if plazos is None else np.atleast_1d(np.asarray(plazos, dtype=np.int64))
+    if tasas is None:
+        tasas = np.array([EURIBOR_ACTUAL + float(diferencial_por_riesgo(ingresos, gastos)), TASA_FIJA])
+    tasas = np.atleast_1d(np.asarray(tasas, dtype=float))
+    cuota_max = float(cuota_maxima(ingresos, gastos))
+    importes = importe_maximo(cuota_max, tasas[:, None], plazos[None, :])
+    return {
+        "tasas": tasas,
+        "plazos": plazos,
+        "cuota_max": cuota_max,
+        "importe_maximo": importes,
+        "precio_maximo": importes + entrada
+    }
+
+
+def curva_a_dataframe(curva: dict) -> pd.DataFrame:
+    tasas, plazos = np.meshgrid(curva["tasas"], curva["plazos"], indexing="ij")
+    return pd.DataFrame({
+        "tasa": tasas.ravel(),
+        "plazo": plazos.ravel(),
+        "cuota_max": curva["cuota_max"],
+        "importe_maximo": curva["importe_maximo"].ravel().round(2),
+        "precio_maximo": curva["precio_maximo"].ravel().round(2)
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precio máximo asumible por un cliente según tipo y plazo")
+    parser.add_argument("--ingresos", type=float, required=True, help="Ingresos netos mensuales")
+    parser.add_argument("--gastos", type=float, default=0.0, help="Gastos mensuales estimados")
+    parser.add_argument("--entrada", type=float, default=0.0)
+    parser.add_argument("--importe", type=float, default=None, help="Muestra también los ingresos mínimos para este importe")
+    parser.add_argument("--comprobar", action="store_true", help="Comprueba ingresos_minimos contra cuota_maxima")
+    args = parser.parse_args()
+
+    if args.comprobar:
+        print(f"Ida y vuelta con cuota_maxima: error relativo máximo {comprobar_inversas():.2e}")
+
+    curva = asequibilidad_cliente(args.ingresos, args.gastos, args.entrada)
+    print(curva_a_dataframe(curva).to_string(index=False))
+    if args.importe is not None:
+        minimos = ingresos_minimos(args.importe, curva["tasas"][:, None], curva["plazos"][None, :], args.gastos)
+        print(f"\nIngresos mínimos para {args.importe:.0f} € (filas: tipos {curva['tasas']}, columnas: plazos):")
+        print(pd.DataFrame(minimos.round(2), index=curva["tasas"], columns=curva["plazos"]).to_string())
+
+
+if __name__ == "__main__":
+    main()
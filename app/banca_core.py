@@ -0,0 +1,97 @@
+import json
+import os
+import sqlite3
+import threading
+import metricas
+
+# Sustituto local del core bancario: una ficha por cliente, buscada por DNI/NIE.
+# BANCA_CORE_DB cambia la base de datos; si está vacía se carga BANCA_CORE_EJEMPLO.
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RUTA_BANCA = os.getenv("BANCA_CORE_DB", os.path.join(DIRECTORIO, "banca_core.db"))
+RUTA_EJEMPLO = os.getenv("BANCA_CORE_EJEMPLO", os.path.join(DIRECTORIO, "..", "data", "banca_core_ejemplo.jsonl"))
+
+COLUMNAS = ["dni", "full_name", "birth_date", "phone", "email", "domiciled_payroll"]
+
+
+def normalizar_dni(dni) -> str:
+    return str(dni).strip().upper().replace("-", "").replace(" ", "")
+
+
+class BancaCore:
+    """
+    Fichas de clientes del banco en SQLite. El DNI es la clave primaria de una tabla
+    WITHOUT ROWID, así que cada búsqueda es una sola lectura del índice.
+    Cada hilo reutiliza su propia conexión, como en RepositorioClientes.
+    """
+
+    def __init__(self, ruta: str = RUTA_BANCA, ejemplo: str = RUTA_EJEMPLO):
+        self.ruta = ruta
+        self.ejemplo = ejemplo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._preparada = False
+
+    def conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if not self._preparada:
+                with self._lock:
+                    if not self._preparada:
+                        self._preparar(conn)
+                        self._preparada = True
+            self._local.conn = conn
+        return conn
+
+    def _preparar(self, conn: sqlite3.Connection):
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS clientes_banco (
+                    dni TEXT PRIMARY KEY, full_name TEXT, birth_date TEXT,
+                    phone TEXT, email TEXT, domiciled_payroll REAL
+                ) WITHOUT ROWID""")
+        vacia = conn.execute("SELECT 1 FROM clientes_banco LIMIT 1").fetchone() is None
+        if vacia and self.ejemplo and os.path.exists(self.ejemplo):
+            with open(self.ejemplo, "r", encoding="utf-8") as f:
+                self._importar(conn, [json.loads(linea) for linea in f if linea.strip()])
+
+    @staticmethod
+    def _importar(conn: sqlite3.Connection, fichas: list):
+        filas = [tuple(normalizar_dni(f["dni"]) if c == "dni" else f.get(c) for c in COLUMNAS) for f in fichas]
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO clientes_banco ({', '.join(COLUMNAS)}) "
+                             f"VALUES ({', '.join(['?'] * len(COLUMNAS))})", filas)
+
+    def importar(self, fichas: list):
+        """Da de alta (o reemplaza) fichas {dni, full_name, birth_date, phone, email, domiciled_payroll}"""
+        self._importar(self.conexion(), fichas)
+
+    @metricas.medido("banca_core_consulta")
+    def buscar(self, dni: str):
+        """
+        Ficha del cliente con las claves de pre_fill_if_client_data de slots_basicos.json
+        ('contact' agrupa teléfono y email), o None si no es cliente.
+        """
+        c = self.conexion().cursor()
+        c.row_factory = sqlite3.Row
+        fila = c.execute("SELECT * FROM clientes_banco WHERE dni = ?", (normalizar_dni(dni),)).fetchone()
+        metricas.contador("banca_core_consultas_total", resultado="encontrado" if fila else "no_encontrado")
+        if fila is None:
+            return None
+        return {
+            "dni": fila["dni"],
+            "full_name": fila["full_name"],
+            "birth_date": fila["birth_date"],
+            "contact": [fila["phone"], fila["email"]],
+            "domiciled_payroll": fila["domiciled_payroll"]
+        }
+
+    def cerrar(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+banca_core = BancaCore()
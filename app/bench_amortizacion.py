@@ -0,0 +1,58 @@
+import timeit
+from datetime import date
+import numpy as np
+import pandas as pd
+from calculo_hipoteca import cuota_mensual, generar_tabla_amortizacion
+
+
+def generar_tabla_amortizacion_bucle(P: float, annual_rate_percent: float, years: int, start_date: date = None) -> pd.DataFrame:
+    """Versión anterior (mes a mes) de la tabla de amortización, usada como referencia"""
+    if start_date is None:
+        start_date = date.today()
+    r = annual_rate_percent / 100.0 / 12.0
+    n = years * 12
+    cuota = cuota_mensual(P, annual_rate_percent, years)
+    saldo = P
+    rows = []
+    for i in range(1, n + 1):
+        interes = saldo * r
+        amortizacion = cuota - interes
+        saldo_nuevo = max(0.0, saldo - amortizacion)
+        fecha = start_date + pd.Timedelta(days=30 * i)
+        rows.append({
+            "mes": i,
+            "fecha": fecha.isoformat(),
+            "cuota": round(cuota, 2),
+            "interes": round(interes, 2),
+            "amortizacion": round(amortizacion, 2),
+            "saldo": round(saldo_nuevo, 2)
+        })
+        saldo = saldo_nuevo
+        if saldo <= 0:
+            break
+    return pd.DataFrame(rows)
+
+
+def main(repeticiones: int = 20):
+    inicio = date(2025, 1, 1)
+    casos = [(150000, 3.5, 15), (240000, 2.5, 30), (400000, 4.0, 40), (90000, 0.0, 10)]
+
+    print(f"{'importe':>10} {'tasa':>6} {'años':>5} {'bucle (ms)':>11} {'numpy (ms)':>11} {'speedup':>8} {'max dif':>8}")
+    for P, tasa, anos in casos:
+        referencia = generar_tabla_amortizacion_bucle(P, tasa, anos, inicio)
+        nueva = generar_tabla_amortizacion(P, tasa, anos, inicio)
+
+        # Misma forma, mismas fechas y diferencias de céntimos como mucho
+        assert list(referencia.columns) == list(nueva.columns)
+        assert len(referencia) == len(nueva)
+        assert (referencia["fecha"] == nueva["fecha"]).all()
+        columnas = ["cuota", "interes", "amortizacion", "saldo"]
+        max_dif = np.abs(referencia[columnas].to_numpy() - nueva[columnas].to_numpy()).max()
+
+        t_bucle = min(timeit.repeat(lambda: generar_tabla_amortizacion_bucle(P, tasa, anos, inicio), number=1, repeat=repeticiones))
+        t_numpy = min(timeit.repeat(lambda: generar_tabla_amortizacion(P, tasa, anos, inicio), number=1, repeat=repeticiones))
+        print(f"{P:>10} {tasa:>6.2f} {anos:>5} {t_bucle * 1000:>11.3f} {t_numpy * 1000:>11.3f} {t_bucle / t_numpy:>7.1f}x {max_dif:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
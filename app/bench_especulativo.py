@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "validacion_etiquetada.jsonl")
+
+
+def cargar_prompts(ruta: str = DATOS, limite: int = 20) -> list:
+    """(slot, mensajes) de validación: los mismos prompts que validar_con_modelo"""
+    from slot_loader import cargar_esquema
+    from validations import construir_prompt
+    esquema = cargar_esquema()
+    with open(ruta, "r", encoding="utf-8") as f:
+        casos = [json.loads(linea) for linea in f if linea.strip()][:limite]
+    return [(esquema.por_nombre[c["slot"]], [{"role": "user", "content": construir_prompt(esquema.por_nombre[c["slot"]],
+                                                                                            c["respuesta"])}])
+            for c in casos]
+
+
+def contar_pasadas(modelo, contador: Counter, nombre: str):
+    """Cuenta las llamadas a forward de un modelo (pasadas de verificación o de borrador)"""
+    return modelo.register_forward_pre_hook(lambda *_: contador.update([nombre]))
+
+
+def generar(model, tokenizer, mensajes, max_new_tokens: int, restriccion: dict = None, asistida: bool = False) -> list:
+    import torch
+    from inferencia import ids_prompt, pad_token_id, opciones_restriccion, recortar_parada, opciones_borrador
+    ids = ids_prompt(tokenizer, mensajes)
+    # Las opciones del borrador se piden en cada llamada, como en inferencia, para medir también su coste
+    borrador = opciones_borrador(bool(restriccion)) if asistida else {}
+    input_ids = torch.tensor([ids], device=model.device)
+    opciones = {}
+    if restriccion:
+        opciones = opciones_restriccion(tokenizer, len(ids), restriccion.get("parada"), restriccion.get("permitidos"))
+    with torch.no_grad():
+        salida = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False,
+                                max_new_tokens=max_new_tokens, pad_token_id=pad_token_id(tokenizer),
+                                **opciones, **borrador)
+    nuevos = salida[0, len(ids):].tolist()
+    if borrador and restriccion:
+        nuevos = recortar_parada(tokenizer, nuevos, restriccion.get("parada"))
+    return nuevos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate normal frente a generación asistida con MODELO_BORRADOR")
+    parser.add_argument("--prompts", type=int, default=20, help="Casos de validacion_etiquetada.jsonl")
+    parser.add_argument("--tokens", type=int, default=48, help="max_new_tokens sin restricciones")
+    parser.add_argument("--restringida", action="store_true",
+                        help="Con el presupuesto y la parada de cada slot (como validar_con_modelo)")
+    args = parser.parse_args()
+
+    from model_loader import obtener_modelo, obtener_borrador, opciones_asistidas, informe_carga, MODELO_BORRADOR
+    from validations import opciones_generacion
+    if not MODELO_BORRADOR:
+        raise SystemExit("Define MODELO_BORRADOR con el modelo borrador (p. ej. Qwen/Qwen2.5-0.5B-Instruct)")
+    model, tokenizer = obtener_modelo()
+    borrador, _ = obtener_borrador()
+    print(informe_carga())
+    if "assistant_tokenizer" in opciones_asistidas():
+        print("Tokenizers distintos: generación asistida entre vocabularios")
+
+    prompts = cargar_prompts(limite=args.prompts)
+    # Calentamiento de los dos caminos
+    generar(model, tokenizer, prompts[0][1], 4)
+    generar(model, tokenizer, prompts[0][1], 4, asistida=True)
+
+    pasadas = Counter()
+    ganchos = [contar_pasadas(model, pasadas, "principal"), contar_pasadas(borrador, pasadas, "borrador")]
+    tiempos = {"normal": 0.0, "asistida": 0.0}
+    tokens = {"normal": 0, "asistida": 0}
+    distintas = 0
+    try:
+        for slot, mensajes in prompts:
+            opciones = opciones_generacion(slot) if args.restringida else {"max_new_tokens": args.tokens}
+            max_new_tokens = opciones.pop("max_new_tokens")
+            restriccion = opciones or None
+
+            pasadas["principal"] = 0
+            t = time.perf_counter()
+            normal = generar(model, tokenizer, mensajes, max_new_tokens, restriccion)
+            tiempos["normal"] += time.perf_counter() - t
+            tokens["normal"] += len(normal)
+            pasadas["principal_normal"] += pasadas.pop("principal", 0)
+
+            t = time.perf_counter()
+            nueva = generar(model, tokenizer, mensajes, max_new_tokens, restriccion, asistida=True)
+            tiempos["asistida"] += time.perf_counter() - t
+            tokens["asistida"] += len(nueva)
+            pasadas["principal_asistida"] += pasadas.pop("principal", 0)
+            if nueva != normal:
+                distintas += 1
+                print(f"Salida distinta en {slot['name']}: {tokenizer.decode(normal)!r} != {tokenizer.decode(nueva)!r}")
+    finally:
+        for gancho in ganchos:
+            gancho.remove()
+
+    # Cada pasada del principal en modo asistido acepta n tokens del borrador y añade uno propio
+    aceptados = tokens["asistida"] - pasadas["principal_asistida"]
+    propuestos = pasadas["borrador"]
+    print(f"{len(prompts)} prompts, {tokens['normal']} tokens generados, salidas distintas: {distintas}")
+    print(f"{'modo':>9} {'tokens/s':>9} {'pasadas principal':>18} {'tokens/pasada':>14}")
+    for modo in ("normal", "asistida"):
+        print(f"{modo:>9} {tokens[modo] / tiempos[modo]:>9.1f} {pasadas[f'principal_{modo}']:>18} "
+              f"{tokens[modo] / max(pasadas[f'principal_{modo}'], 1):>14.2f}")
+    print(f"Tokens del borrador aceptados: {aceptados}/{propuestos} ({aceptados / max(propuestos, 1):.0%})")
+    print(f"Aceleración: {tiempos['normal'] / tiempos['asistida']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import metricas
+
+# Base de datos de la caché: junto a este módulo salvo que se indique otra con CACHE_LLM_DB
+RUTA_CACHE = os.getenv("CACHE_LLM_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_llm.db"))
+
+
+def normalizar_entrada(slot, texto: str) -> str:
+    """
+    Normaliza la respuesta del cliente para usarla como clave de caché.
+    En textos libres (nombres, contacto) se respetan mayúsculas y tildes porque
+    el LLM las copia en su respuesta; en el resto basta con minúsculas.
+    """
+    texto = " ".join(str(texto).split()).strip(" .")
+    if slot.get("type") in ("string", "contact"):
+        return texto
+    return texto.casefold()
+
+
+class CacheLLM:
+    """
+    Caché de respuestas del LLM en dos niveles: LRU en memoria y SQLite en disco.
+    Las entradas caducan a los `ttl` segundos y el disco se limita a `max_disco` entradas
+    (se eliminan las menos usadas recientemente). La clave incluye la versión del prompt,
+    así que al cambiar la plantilla de un slot sus entradas antiguas dejan de usarse y se borran.
+    """
+
+    def __init__(self, ruta: str = RUTA_CACHE, max_memoria: int = 2048, max_disco: int = 100_000,
+                 ttl: float = 30 * 24 * 3600, activa: bool = True):
+        self.ruta = ruta
+        self.max_memoria = max_memoria
+        self.max_disco = max_disco
+        self.ttl = ttl
+        self.activa = activa
+        self._memoria = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._versiones_limpias = set()
+        self._escrituras = 0
+        self.hits_memoria = 0
+        self.hits_disco = 0
+        self.misses = 0
+
+    # -------------------------------
+    # Claves y conexión
+    # -------------------------------
+    @staticmethod
+    def clave(slot_name: str, entrada: str, modelo: str, version: str) -> str:
+        return hashlib.sha256("\x1f".join([slot_name, entrada, modelo, version]).encode("utf-8")).hexdigest()
+
+    def _conexion(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.ruta, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_llm (
+                    clave TEXT PRIMARY KEY, slot TEXT, version TEXT, valor TEXT,
+                    creado REAL, usado REAL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_llm_usado ON cache_llm (usado)")
+            self._conn.commit()
+        return self._conn
+
+    # -------------------------------
+    # Lectura / escritura
+    # -------------------------------
+    def obtener(self, clave: str):
+        """Devuelve la respuesta guardada o None si no está (o ha caducado)"""
+        if not self.activa:
+            return None
+        ahora = time.time()
+        with self._lock:
+            entrada = self._memoria.get(clave)
+            if entrada is not None and ahora - entrada[1] < self.ttl:
+                self._memoria.move_to_end(clave)
+                self.hits_memoria += 1
+                metricas.contador("cache_llm_consultas_total", resultado="memoria")
+                return entrada[0]
+            self._memoria.pop(clave, None)
+
+            conn = self._conexion()
+            fila = conn.execute("SELECT valor, creado FROM cache_llm WHERE clave = ?", (clave,)).fetchone()
+            if fila is None or ahora - fila[1] >= self.ttl:
+                if fila is not None:
+                    conn.execute("DELETE FROM cache_llm WHERE clave = ?", (clave,))
+                    conn.commit()
+                self.misses += 1
+                metricas.contador("cache_llm_consultas_total", resultado="fallo")
+                return None
+            conn.execute("UPDATE cache_llm SET usado = ? WHERE clave = ?", (ahora, clave))
+            conn.commit()
+            self._guardar_memoria(clave, fila[0], fila[1])
+            self.hits_disco += 1
+            metricas.contador("cache_llm_consultas_total", resultado="disco")
+            return fila[0]
+
+    def guardar(self, clave: str, valor: str, slot_name: str, version: str):
+        if not self.activa:
+            return
+        ahora = time.time()
+        with self._lock:
+            conn = self._conexion()
+            if (slot_name, version) not in self._versiones_limpias:
+                # Entradas de versiones anteriores del prompt de este slot
+                conn.execute("DELETE FROM cache_llm WHERE slot = ? AND version != ?", (slot_name, version))
+                self._versiones_limpias.add((slot_name, version))
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_llm VALUES (?, ?, ?, ?, ?, ?)",
+                (clave, slot_name, version, valor, ahora, ahora)
+            )
+            self._escrituras += 1
+            if self._escrituras % 100 == 0:
+                self._desalojar(conn, ahora)
+            conn.commit()
+            self._guardar_memoria(clave, valor, ahora)
+
+    def _guardar_memoria(self, clave, valor, creado):
+        self._memoria[clave] = (valor, creado)
+        self._memoria.move_to_end(clave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def _desalojar(self, conn, ahora):
+        conn.execute("DELETE FROM cache_llm WHERE creado <= ?", (ahora - self.ttl,))
+        total = conn.execute("SELECT COUNT(*) FROM cache_llm").fetchone()[0]
+        if total > self.max_disco:
+            conn.execute(
+                "DELETE FROM cache_llm WHERE clave IN (SELECT clave FROM cache_llm ORDER BY usado LIMIT ?)",
+                (total - self.max_disco,)
+            )
+
+    def limpiar(self):
+        with self._lock:
+            self._memoria.clear()
+            self._conexion().execute("DELETE FROM cache_llm")
+            self._conn.commit()
+
+    # -------------------------------
+    # Estadísticas
+    # -------------------------------
+    def estadisticas(self) -> dict:
+        consultas = self.hits_memoria + self.hits_disco + self.misses
+        return {
+            "hits_memoria": self.hits_memoria,
+            "hits_disco": self.hits_disco,
+            "misses": self.misses,
+            "tasa_acierto": (self.hits_memoria + self.hits_disco) / consultas if consultas else 0.0,
+            "entradas_memoria": len(self._memoria)
+        }
+
+
+cache_llm = CacheLLM(
+    ruta=RUTA_CACHE,
+    activa=os.getenv("CACHE_LLM", "1") != "0"
+)
@@ -1,126 +1,261 @@
 import sqlite3
 from datetime import date
+import numpy as np
 import pandas as pd
 import re
 import math
+from repositorio import clientes, buscar_por_dni, buscar_por_sesion, ultimo_cliente
+import metricas
 
-def calculo_hipotecario():
+EURIBOR_ACTUAL = 2.0
+TASA_FIJA = 3.5
+RATIO_ENDEUDAMIENTO = 0.33  # parte de los ingresos netos disponibles que puede ir a la cuota
+CUOTA_MAXIMA_MINIMA = 100.0
+
+# -------------------------------
+# Funciones de hipoteca
+# -------------------------------
+def cuota_mensual(P: float, annual_rate_percent: float, years: int) -> float:
+    if annual_rate_percent == 0:
+        return P / (years * 12)
+    r = annual_rate_percent / 100.0 / 12.0
+    n = years * 12
+    numerator = P * r * (1 + r) ** n
+    denominator = (1 + r) ** n - 1
+    return numerator / denominator
+
+def saldos_pendientes(P: float, r: float, cuota: float, meses) -> np.ndarray:
     """
-    Calcula la hipoteca para el último cliente añadido en la base de datos.
-    Determina automáticamente el plazo según ingresos, gastos, importe a financiar y tipo de interés.
-    Devuelve cuotas variables y fijas y tablas de amortización.
+    Saldo pendiente tras cada mes de `meses` (fórmula cerrada de la anualidad):
+    B_k = P·(1+r)^k − cuota·((1+r)^k − 1)/r
     """
+    meses = np.asarray(meses, dtype=float)
+    if r == 0:
+        saldos = P - cuota * meses
+    else:
+        factor = np.power(1.0 + r, meses)
+        saldos = P * factor - cuota * (factor - 1.0) / r
+    return np.maximum(saldos, 0.0)
 
-    # -------------------------------
-    # Funciones internas de hipoteca
-    # -------------------------------
-    def cuota_mensual(P: float, annual_rate_percent: float, years: int) -> float:
-        if annual_rate_percent == 0:
-            return P / (years * 12)
-        r = annual_rate_percent / 100.0 / 12.0
-        n = years * 12
-        numerator = P * r * (1 + r) ** n
-        denominator = (1 + r) ** n - 1
-        return numerator / denominator
-
-    def generar_tabla_amortizacion(P: float, annual_rate_percent: float, years: int, start_date: date = None) -> pd.DataFrame:
-        if start_date is None:
-            start_date = date.today()
-        r = annual_rate_percent / 100.0 / 12.0
-        n = years * 12
-        cuota = cuota_mensual(P, annual_rate_percent, years)
-        saldo = P
-        rows = []
-        for i in range(1, n + 1):
-            interes = saldo * r
-            amortizacion = cuota - interes
-            saldo_nuevo = max(0.0, saldo - amortizacion)
-            fecha = start_date + pd.Timedelta(days=30 * i)
-            rows.append({
-                "mes": i,
-                "fecha": fecha.isoformat(),
-                "cuota": round(cuota, 2),
-                "interes": round(interes, 2),
-                "amortizacion": round(amortizacion, 2),
-                "saldo": round(saldo_nuevo, 2)
-            })
-            saldo = saldo_nuevo
-            if saldo <= 0:
-                break
-        return pd.DataFrame(rows)
-
-    def parse_float(valor, default=0.0):
-        """Convierte a float limpiando texto, símbolos y comas"""
-        if valor is None:
-            return default
-        if isinstance(valor, (int, float)):
-            return float(valor)
-        s = str(valor)
-        match = re.search(r"[\d,.]+", s)
-        if not match:
-            return default
-        num_str = match.group(0).replace(",", "")
-        try:
-            return float(num_str)
-        except ValueError:
-            return default
-
-    def calcular_plazo(P: float, C_max: float, tasa_anual: float) -> int:
-        """Calcula el plazo en años según importe, cuota máxima y tasa anual"""
-        if C_max <= 0:
-            return 1
-        if tasa_anual == 0:
-            n_meses = P / C_max
+def calcular_amortizacion(P: float, annual_rate_percent: float, years: int, start_date: date = None) -> dict:
+    """
+    Calcula el cuadro de amortización completo como arrays de NumPy,
+    sin recorrer los meses uno a uno. Devuelve un dict columna -> array.
+    """
+    if start_date is None:
+        start_date = date.today()
+    r = annual_rate_percent / 100.0 / 12.0
+    n = years * 12
+    cuota = cuota_mensual(P, annual_rate_percent, years)
+
+    meses = np.arange(1, n + 1, dtype=np.int64)
+    saldos = saldos_pendientes(P, r, cuota, np.arange(0, n + 1))
+    interes = saldos[:-1] * r
+    amortizacion = cuota - interes
+    fechas = np.datetime64(start_date, "D") + 30 * meses
+
+    return {
+        "mes": meses,
+        "fecha": fechas,
+        "cuota": np.full(n, cuota),
+        "interes": interes,
+        "amortizacion": amortizacion,
+        "saldo": saldos[1:]
+    }
+
+def generar_tabla_amortizacion(P: float, annual_rate_percent: float, years: int, start_date: date = None) -> pd.DataFrame:
+    """Tabla de amortización mensual con las columnas mes, fecha, cuota, interes, amortizacion y saldo"""
+    columnas = calcular_amortizacion(P, annual_rate_percent, years, start_date)
+    return pd.DataFrame({
+        "mes": columnas["mes"],
+        "fecha": np.datetime_as_string(columnas["fecha"], unit="D"),
+        "cuota": np.round(columnas["cuota"], 2),
+        "interes": np.round(columnas["interes"], 2),
+        "amortizacion": np.round(columnas["amortizacion"], 2),
+        "saldo": np.round(columnas["saldo"], 2)
+    })
+
+@metricas.medido("resumen_anual")
+def resumen_anual(P: float, annual_rate_percent: float, years: int, start_date: date = None) -> pd.DataFrame:
+    """
+    Resumen por año natural (cuota, interes, amortizacion y saldo a fin de año)
+    calculado con la fórmula cerrada: solo se evalúa el saldo en el último mes de cada año,
+    sin generar la tabla mensual.
+    """
+    if start_date is None:
+        start_date = date.today()
+    r = annual_rate_percent / 100.0 / 12.0
+    n = years * 12
+    cuota = cuota_mensual(P, annual_rate_percent, years)
+
+    # Cada cuota vence 30 días después de la anterior
+    inicio = np.datetime64(start_date, "D")
+    anos = np.arange((inicio + 30).astype("datetime64[Y]"), (inicio + 30 * n).astype("datetime64[Y]") + 1)
+    fin_de_ano = (anos + 1).astype("datetime64[D]") - 1
+    ultimo_mes = np.minimum((fin_de_ano - inicio).astype(np.int64) // 30, n)
+    meses_en_ano = np.diff(ultimo_mes, prepend=0)
+
+    saldos = saldos_pendientes(P, r, cuota, np.concatenate(([0], ultimo_mes)))
+    amortizacion = saldos[:-1] - saldos[1:]
+    pagado = cuota * meses_en_ano
+
+    return pd.DataFrame({
+        "año": anos.astype(np.int64) + 1970,
+        "cuota": pagado,
+        "interes": pagado - amortizacion,
+        "amortizacion": amortizacion,
+        "saldo": saldos[1:]
+    })
+
+class ResultadoHipoteca(dict):
+    """
+    Resultado de calculo_hipotecario. Las tablas mensuales ('tabla_variable', 'tabla_fija')
+    y los resúmenes anuales que falten no se generan hasta que alguien los pide.
+    """
+    _PEREZOSOS = {
+        "tabla_variable": (generar_tabla_amortizacion, "tasa_variable", "plazo_variable"),
+        "tabla_fija": (generar_tabla_amortizacion, "tasa_fija", "plazo_fijo"),
+        "resumen_variable": (resumen_anual, "tasa_variable", "plazo_variable"),
+        "resumen_fijo": (resumen_anual, "tasa_fija", "plazo_fijo")
+    }
+
+    def __missing__(self, clave):
+        if clave not in self._PEREZOSOS:
+            raise KeyError(clave)
+        funcion, tasa, plazo = self._PEREZOSOS[clave]
+        valor = funcion(self["importe_financiar"], self[tasa], self[plazo], self["fecha_inicio"])
+        self[clave] = valor
+        return valor
+
+def parse_float(valor, default=0.0):
+    """Convierte a float limpiando texto, símbolos y comas"""
+    if valor is None:
+        return default
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    s = str(valor)
+    match = re.search(r"[\d,.]+", s)
+    if not match:
+        return default
+    num_str = match.group(0).replace(",", "")
+    try:
+        return float(num_str)
+    except ValueError:
+        return default
+
+def calcular_plazo(P: float, C_max: float, tasa_anual: float) -> int:
+    """Calcula el plazo en años según importe, cuota máxima y tasa anual"""
+    if C_max <= 0:
+        return 1
+    if tasa_anual == 0:
+        n_meses = P / C_max
+    else:
+        r = tasa_anual / 100 / 12
+        if C_max <= P * r:
+            n_meses = 1
         else:
-            r = tasa_anual / 100 / 12
-            if C_max <= P * r:
-                n_meses = 1
-            else:
-                n_meses = math.log(C_max / (C_max - P * r)) / math.log(1 + r)
-        return max(1, round(n_meses / 12))
+            n_meses = math.log(C_max / (C_max - P * r)) / math.log(1 + r)
+    return max(1, round(n_meses / 12))
+
+# -------------------------------
+# Versiones vectorizadas (arrays de clientes)
+# -------------------------------
+def diferencial_por_riesgo(ingresos, gastos):
+    """Diferencial sobre el Euribor según la ratio ingresos / gastos (admite arrays)"""
+    ingresos = np.asarray(ingresos, dtype=float)
+    gastos = np.asarray(gastos, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(gastos != 0, ingresos / np.where(gastos != 0, gastos, 1.0), 10.0)
+    return np.select([ratio >= 4, ratio >= 2], [0.5, 1.0], 1.5)
+
+def cuota_maxima(ingresos, gastos):
+    """Cuota máxima asumible: 33% de los ingresos netos disponibles, con un mínimo de 100 €"""
+    disponibles = np.asarray(ingresos, dtype=float) - np.asarray(gastos, dtype=float)
+    return np.maximum(CUOTA_MAXIMA_MINIMA, disponibles * RATIO_ENDEUDAMIENTO)
+
+def cuotas_mensuales(P, annual_rate_percent, years) -> np.ndarray:
+    """Igual que cuota_mensual pero para arrays (se aplica broadcasting entre argumentos)"""
+    P, tasas, anos = np.broadcast_arrays(
+        np.asarray(P, dtype=float), np.asarray(annual_rate_percent, dtype=float), np.asarray(years, dtype=float)
+    )
+    r = tasas / 100.0 / 12.0
+    n = anos * 12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = np.power(1.0 + r, n)
+        cuotas = P * r * factor / (factor - 1.0)
+    return np.where(r == 0, P / n, cuotas)
+
+def calcular_plazos(P, C_max, tasa_anual) -> np.ndarray:
+    """Igual que calcular_plazo pero para arrays; devuelve años enteros"""
+    P, C_max, tasas = np.broadcast_arrays(
+        np.asarray(P, dtype=float), np.asarray(C_max, dtype=float), np.asarray(tasa_anual, dtype=float)
+    )
+    r = tasas / 100 / 12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n_interes = np.log(C_max / (C_max - P * r)) / np.log1p(r)
+        n_meses = np.where(r == 0, P / C_max, np.where(C_max <= P * r, 1.0, n_interes))
+    anos = np.maximum(1.0, np.round(n_meses / 12))
+    return np.where(C_max <= 0, 1, anos).astype(np.int64)
+
+def calculo_hipotecario(conn: sqlite3.Connection = None, tablas_mensuales: bool = False, sesion_id: str = None,
+                        dni_nie: str = None):
+    """
+    Calcula la hipoteca de un cliente de la base de datos: el de `dni_nie`, el guardado
+    por la sesión `sesion_id` o, si no se indica ninguno, el último guardado.
+    Determina automáticamente el plazo según ingresos, gastos, importe a financiar y tipo de interés.
+    Devuelve cuotas variables y fijas, resúmenes anuales y tablas de amortización.
+    Las tablas mensuales se generan al acceder a ellas, salvo que `tablas_mensuales` sea True.
+    Si se pasa `conn` se usa esa conexión en lugar de la del repositorio de clientes.
+    """
 
     # -------------------------------
-    # Leer último cliente añadido
+    # Leer el cliente
     # -------------------------------
-    conn = sqlite3.connect("clientes.db")
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM clientes ORDER BY rowid DESC LIMIT 1")
-    cliente = c.fetchone()
-    conn.close()
+    if conn is None:
+        conn = clientes.conexion()
+    if dni_nie is not None:
+        cliente = buscar_por_dni(conn, dni_nie)
+    elif sesion_id is not None:
+        cliente = buscar_por_sesion(conn, sesion_id)
+    else:
+        cliente = ultimo_cliente(conn)
 
     if not cliente:
         raise ValueError("No hay clientes en la base de datos")
 
+    return simular_hipoteca(cliente, tablas_mensuales)
+
+@metricas.medido("simulacion")
+def simular_hipoteca(cliente, tablas_mensuales: bool = False):
+    """
+    Calcula la hipoteca a partir de los datos de un cliente (fila de la tabla clientes
+    o dict con los slots recogidos). Devuelve lo mismo que calculo_hipotecario.
+    """
+    def campo(nombre):
+        return cliente[nombre] if nombre in cliente.keys() else None
+
     # -------------------------------
     # Extraer datos del cliente
     # -------------------------------
-    precio = parse_float(cliente["precio_vivienda"])
-    entrada = parse_float(cliente["entrada"])
+    precio = parse_float(campo("precio_vivienda"))
+    entrada = parse_float(campo("entrada"))
     # importe_financiar = max(0, precio - entrada)
-    importe_financiar = parse_float(cliente["importe_a_financiar"])
-    ingresos = parse_float(cliente["ingresos_netos_mensuales"])
-    gastos = parse_float(cliente["gastos_mensuales_est"])
+    importe_financiar = parse_float(campo("importe_a_financiar"))
+    ingresos = parse_float(campo("ingresos_netos_mensuales"))
+    gastos = parse_float(campo("gastos_mensuales_est"))
 
     # -------------------------------
     # Determinar riesgo y diferencial
     # -------------------------------
-    ratio = ingresos / gastos if gastos else 10
-    if ratio >= 4:
-        diferencial = 0.5
-    elif ratio >= 2:
-        diferencial = 1.0
-    else:
-        diferencial = 1.5
+    diferencial = float(diferencial_por_riesgo(ingresos, gastos))
 
-    euribor_actual = 2.0
-    tasa_variable = euribor_actual + diferencial
-    tasa_fija = 3.5
+    tasa_variable = EURIBOR_ACTUAL + diferencial
+    tasa_fija = TASA_FIJA
 
     # -------------------------------
     # Calcular cuota máxima asumible
     # -------------------------------
-    cuota_max = max(100, (ingresos - gastos) * 0.33)  # 33% de ingresos netos disponibles
+    cuota_max = float(cuota_maxima(ingresos, gastos))  # 33% de ingresos netos disponibles
 
     # -------------------------------
     # Calcular plazos según cuota máxima
@@ -129,20 +264,21 @@ def calculo_hipotecario():
     plazo_fix = calcular_plazo(importe_financiar, cuota_max, tasa_fija)
 
     # -------------------------------
-    # Calcular cuotas y tablas
+    # Calcular cuotas y resúmenes anuales
     # -------------------------------
     cuota_var = cuota_mensual(importe_financiar, tasa_variable, plazo_var)
     cuota_fix = cuota_mensual(importe_financiar, tasa_fija, plazo_fix)
 
-    tabla_var = generar_tabla_amortizacion(importe_financiar, tasa_variable, plazo_var)
-    tabla_fix = generar_tabla_amortizacion(importe_financiar, tasa_fija, plazo_fix)
+    fecha_inicio = date.today()
+    resumen_var = resumen_anual(importe_financiar, tasa_variable, plazo_var, fecha_inicio)
+    resumen_fix = resumen_anual(importe_financiar, tasa_fija, plazo_fix, fecha_inicio)
 
     # -------------------------------
     # Devolver resultados
     # -------------------------------
-    return {
-        "cliente": cliente["nombre_completo"],
-        "dni_nie": cliente["dni_nie"],
+    resultado = ResultadoHipoteca({
+        "cliente": campo("nombre_completo"),
+        "dni_nie": campo("dni_nie"),
         "importe_financiar": importe_financiar,
         "plazo_variable": plazo_var,
         "plazo_fijo": plazo_fix,
@@ -151,6 +287,11 @@ def calculo_hipotecario():
         "tasa_fija": tasa_fija,
         "cuota_variable": cuota_var,
         "cuota_fija": cuota_fix,
-        "tabla_variable": tabla_var,
-        "tabla_fija": tabla_fix
-    }
\ No newline at end of file
+        "fecha_inicio": fecha_inicio,
+        "resumen_variable": resumen_var,
+        "resumen_fijo": resumen_fix
+    })
+    if tablas_mensuales:
+        resultado["tabla_variable"]
+        resultado["tabla_fija"]
+    return resultado
\ No newline at end of file
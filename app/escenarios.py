@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from calculo_hipoteca import cuotas_mensuales, calcular_plazos, cuota_maxima
+
+# -------------------------------
+# Rejillas por defecto
+# -------------------------------
+EURIBOR_ESTRES = np.round(np.arange(-1.0, 4.0 + 1e-9, 0.25), 2)  # -1% a +4% en pasos de 25 pb
+DIFERENCIALES = np.array([0.5, 1.0, 1.5])
+PLAZOS_ANOS = np.array([10, 15, 20, 25, 30, 35, 40])
+
+
+def simular_escenarios(importes, euribor=None, diferenciales=None, plazos=None,
+                       ingresos=None, gastos=None, tipo_minimo: float = 0.0) -> dict:
+    """
+    Evalúa la hipoteca de uno o varios clientes sobre una rejilla de escenarios
+    (Euribor x diferencial x plazo) con broadcasting de NumPy, sin bucles.
+    El tipo aplicado (Euribor + diferencial) no baja de `tipo_minimo` (None para no limitarlo).
+
+    Devuelve un dict con los ejes y los cubos de resultados, de forma
+    (clientes, euribor, diferencial, plazo):
+    - cuota: cuota mensual
+    - intereses_totales: intereses pagados durante toda la vida del préstamo
+    Si se pasan ingresos y gastos, añade además, de forma (clientes, euribor, diferencial):
+    - cuota_max: cuota máxima asumible
+    - plazo_asumible: plazo en años que da calcular_plazo para esa cuota máxima
+    - cuota_plazo_asumible: cuota mensual con ese plazo
+    """
+    importes = np.atleast_1d(np.asarray(importes, dtype=float))
+    euribor = EURIBOR_ESTRES if euribor is None else np.atleast_1d(np.asarray(euribor, dtype=float))
+    diferenciales = DIFERENCIALES if diferenciales is None else np.atleast_1d(np.asarray(diferenciales, dtype=float))
+    plazos = PLAZOS_ANOS if plazos is None else np.atleast_1d(np.asarray(plazos, dtype=np.int64))
+
+    # Ejes: (clientes, euribor, diferencial, plazo)
+    P = importes[:, None, None, None]
+    tasas = euribor[None, :, None, None] + diferenciales[None, None, :, None]
+    if tipo_minimo is not None:
+        tasas = np.maximum(tasas, tipo_minimo)
+    anos = plazos[None, None, None, :]
+
+    cuota = cuotas_mensuales(P, tasas, anos)
+    cubo = {
+        "importes": importes,
+        "euribor": euribor,
+        "diferenciales": diferenciales,
+        "plazos": plazos,
+        "tipo_minimo": tipo_minimo,
+        "cuota": cuota.astype(np.float32),
+        "intereses_totales": (cuota * anos * 12 - P).astype(np.float32)
+    }
+
+    if ingresos is not None and gastos is not None:
+        c_max = np.broadcast_to(np.atleast_1d(cuota_maxima(ingresos, gastos)), importes.shape)
+        tasas_cd = tasas[..., 0]
+        plazo_asumible = calcular_plazos(P[..., 0], c_max[:, None, None], tasas_cd)
+        cubo["cuota_max"] = c_max.astype(np.float32)
+        cubo["plazo_asumible"] = plazo_asumible.astype(np.int16)
+        cubo["cuota_plazo_asumible"] = cuotas_mensuales(P[..., 0], tasas_cd, plazo_asumible).astype(np.float32)
+
+    return cubo
+
+
+def escenarios_a_dataframe(cubo: dict, cliente: int = 0) -> pd.DataFrame:
+    """Convierte el cubo de un cliente a formato largo (una fila por escenario) para mostrarlo"""
+    e, d, t = np.meshgrid(cubo["euribor"], cubo["diferenciales"], cubo["plazos"], indexing="ij")
+    tasa = e + d if cubo["tipo_minimo"] is None else np.maximum(e + d, cubo["tipo_minimo"])
+    df = pd.DataFrame({
+        "euribor": e.ravel(),
+        "diferencial": d.ravel(),
+        "tasa": tasa.ravel(),
+        "plazo": t.ravel(),
+        "cuota": cubo["cuota"][cliente].ravel(),
+        "intereses_totales": cubo["intereses_totales"][cliente].ravel()
+    })
+    if "plazo_asumible" in cubo:
+        df["plazo_asumible"] = np.repeat(cubo["plazo_asumible"][cliente].ravel(), len(cubo["plazos"]))
+    return df
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "validacion_etiquetada.jsonl")
+
+
+def cargar_casos(ruta: str = DATOS) -> list:
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+def acierta(valor, esperado) -> bool:
+    if esperado is None or isinstance(esperado, bool):
+        return valor is esperado
+    if isinstance(esperado, (int, float)):
+        return isinstance(valor, (int, float)) and not isinstance(valor, bool) and abs(valor - esperado) < 0.01
+    return isinstance(valor, str) and valor.casefold() == str(esperado).casefold()
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def evaluar(ruta: str = DATOS) -> dict:
+    """
+    Pasa el conjunto etiquetado por validar_con_modelo con la precisión de este proceso
+    (MODELO_PRECISION). Sin caché del LLM, para medir siempre el modelo.
+    """
+    from slot_loader import cargar_slots
+    from model_loader import obtener_modelo, TIEMPOS_CARGA, PRECISION, modelo_a_cargar
+    from validadores import validar_determinista, NO_DECIDIDO
+    from validations import validar_con_modelo
+
+    slots = {s["name"]: s for s in cargar_slots()[0]}
+    casos = cargar_casos(ruta)
+    obtener_modelo()
+
+    aciertos = aciertos_llm = casos_llm = 0
+    latencias_llm = []
+    for caso in casos:
+        slot = slots[caso["slot"]]
+        contexto = caso.get("contexto")
+        usa_llm = validar_determinista(slot, caso["respuesta"], contexto) is NO_DECIDIDO
+        t = time.perf_counter()
+        valor = validar_con_modelo(slot, caso["respuesta"], contexto)
+        duracion = time.perf_counter() - t
+        ok = acierta(valor, caso["esperado"])
+        aciertos += ok
+        if usa_llm:
+            casos_llm += 1
+            aciertos_llm += ok
+            latencias_llm.append(duracion)
+
+    latencias = np.array(latencias_llm or [0.0]) * 1000
+    return {
+        "modo": PRECISION,
+        "modelo": modelo_a_cargar(),
+        "casos": len(casos),
+        "precision": aciertos / len(casos) if casos else 0.0,
+        "casos_llm": casos_llm,
+        "precision_llm": aciertos_llm / casos_llm if casos_llm else 0.0,
+        "latencia_p50_ms": float(np.percentile(latencias, 50)),
+        "latencia_p95_ms": float(np.percentile(latencias, 95)),
+        "carga_s": sum(TIEMPOS_CARGA.values()),
+        "rss_mb": rss_mb(),
+        # ru_maxrss está en KB en Linux
+        "rss_pico_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def evaluar_en_subproceso(modo: str, ruta: str = DATOS) -> dict:
+    """Cada modo en su propio proceso: la memoria y el tiempo de carga no se mezclan entre modos"""
+    entorno = dict(os.environ, MODELO_PRECISION=modo, CACHE_LLM="0")
+    salida = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--interno", "--datos", ruta],
+        env=entorno, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if salida.returncode != 0:
+        return {"modo": modo, "error": salida.stderr.strip().splitlines()[-1] if salida.stderr.strip() else "?"}
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precisión de extracción, latencia y memoria por modo de inferencia")
+    parser.add_argument("--modos", default="fp32,bf16,int8", help="Modos separados por comas (auto, fp32, bf16, int8)")
+    parser.add_argument("--datos", default=DATOS, help="JSONL con slot, respuesta, esperado y contexto opcional")
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        print(json.dumps(evaluar(args.datos)))
+        return
+
+    print(f"{'modo':>5} {'acierto':>8} {'acierto LLM':>12} {'p50 (ms)':>9} {'p95 (ms)':>9} {'carga (s)':>10} {'RSS (MB)':>9} {'pico (MB)':>10}")
+    resultados = []
+    for modo in args.modos.split(","):
+        r = evaluar_en_subproceso(modo.strip(), args.datos)
+        if "error" in r:
+            print(f"{r['modo']:>5} error: {r['error']}")
+            continue
+        resultados.append(r)
+        print(f"{r['modo']:>5} {r['precision']:>8.1%} {r['precision_llm']:>12.1%} {r['latencia_p50_ms']:>9.1f} "
+              f"{r['latencia_p95_ms']:>9.1f} {r['carga_s']:>10.2f} {r['rss_mb']:>9.0f} {r['rss_pico_mb']:>10.0f}")
+    if resultados:
+        r = resultados[0]
+        print(f"Modelo: {r['modelo']}; {r['casos']} casos, {r['casos_llm']} resueltos por el LLM")
+
+
+if __name__ == "__main__":
+    main()
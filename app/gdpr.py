@@ -1,19 +1,14 @@
 # gdpr.py
-def solicitar_consentimiento_gdpr():
-    print("Antes de continuar, necesitamos tu consentimiento para el tratamiento de datos (GDPR/LOPD).")
-    while True:
-        respuesta = input("¿Aceptas? (sí/no): ").strip().lower()
-        if respuesta in ["sí", "si", "s", "yes"]:
-            print("Gracias, puedes continuar.\n")
-            return True
-        elif respuesta == "no":
-            print("No podemos continuar sin tu consentimiento. Fin del proceso.")
-            return False
-        else:
-            print("Por favor, responde 'sí' o 'no'.")
+MENSAJE_GDPR = "Antes de continuar, necesitamos tu consentimiento para el tratamiento de datos (GDPR/LOPD)."
+MENSAJE_ACEPTADO = "Gracias, puedes continuar."
+MENSAJE_RECHAZADO = "No podemos continuar sin tu consentimiento. Fin del proceso."
+MENSAJE_REPETIR = "Por favor, responde 'sí' o 'no'."
 
-# if __name__ == "__main__":
-#     if solicitar_consentimiento_gdpr():
-#         print("Usuario aceptó GDPR")
-#     else:
-#         print("Usuario NO aceptó GDPR")
+def interpretar_consentimiento(respuesta):
+    """True si acepta, False si no, None si la respuesta no es clara"""
+    respuesta = respuesta.strip().lower()
+    if respuesta in ["sí", "si", "s", "yes"]:
+        return True
+    elif respuesta == "no":
+        return False
+    return None
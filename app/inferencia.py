@@ -0,0 +1,360 @@
+import copy
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import metricas
+from model_loader import obtener_modelo, id_modelo, opciones_asistidas
+
+# Si está definida (host:puerto), la generación se hace en el servidor de inferencia
+# compartido (servidor_inferencia.py) en lugar de cargar el modelo en este proceso.
+SERVIDOR = os.getenv("INFERENCIA_SERVIDOR")
+
+# KV-cache de prefijos de prompt ya procesados: (modelo, texto del prefijo) -> (ids, past_key_values)
+MAX_PREFIJOS = int(os.getenv("INFERENCIA_MAX_PREFIJOS", "32"))
+
+# Marca que se añade al prefijo para localizarlo en el prompt ya formateado por la plantilla de chat
+MARCA_PREFIJO = "\u2063PREFIJO\u2063"
+
+_cliente = None
+_backend = None
+_prefijos = OrderedDict()
+_lock_prefijos = threading.Lock()
+_mascaras = {}
+
+
+def ids_prompt(tokenizer, mensajes=None, texto=None) -> list:
+    """Tokens del prompt: mensajes de chat (con plantilla) o texto plano"""
+    if mensajes is not None:
+        return list(tokenizer.apply_chat_template(mensajes, add_generation_prompt=True, tokenize=True))
+    return tokenizer(texto)["input_ids"]
+
+
+def pad_token_id(tokenizer) -> int:
+    if tokenizer.pad_token_id is not None:
+        return tokenizer.pad_token_id
+    eos = tokenizer.eos_token_id
+    return eos[0] if isinstance(eos, (list, tuple)) else eos
+
+
+# -------------------------------
+# Decodificación restringida
+# -------------------------------
+# Se usan como StoppingCriteria / LogitsProcessor de transformers (solo necesitan __call__).
+class ParadaValor:
+    """
+    Para la generación de cada fila en el primer salto de línea tras el valor o en cuanto
+    el texto nuevo (desde la posición `inicio`) encaja con el patrón de valor completo.
+    """
+
+    def __init__(self, tokenizer, inicio: int, patron: str = None):
+        self.tokenizer = tokenizer
+        self.inicio = inicio
+        self.patron = re.compile(patron) if patron else None
+
+    def terminado(self, texto: str) -> bool:
+        texto = texto.lstrip()
+        if "\n" in texto:
+            return True
+        return bool(self.patron and self.patron.search(texto))
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        textos = self.tokenizer.batch_decode(input_ids[:, self.inicio:], skip_special_tokens=True)
+        return torch.tensor([self.terminado(t) for t in textos], dtype=torch.bool, device=input_ids.device)
+
+
+class TokensPermitidos:
+    """
+    Solo deja generar tokens formados por los caracteres de `permitidos` (contenido de una
+    clase de regex, p. ej. "0-9/"), espacios y saltos de línea, además del fin de secuencia.
+    La máscara del vocabulario se calcula una vez por modelo y conjunto de caracteres.
+    """
+
+    def __init__(self, tokenizer, permitidos: str):
+        self.tokenizer = tokenizer
+        self.permitidos = permitidos
+
+    def mascara(self, tamano: int, device):
+        import torch
+        clave = (id_modelo(), self.permitidos, tamano)
+        if clave not in _mascaras:
+            forma = re.compile(f"[{self.permitidos} \\n]*")
+            textos = self.tokenizer.batch_decode([[i] for i in range(min(tamano, len(self.tokenizer)))])
+            mascara = torch.zeros(tamano, dtype=torch.bool)
+            for i, texto in enumerate(textos):
+                mascara[i] = bool(texto) and forma.fullmatch(texto) is not None
+            eos = self.tokenizer.eos_token_id
+            mascara[eos if isinstance(eos, (list, tuple)) else [eos]] = True
+            _mascaras[clave] = mascara
+        return _mascaras[clave].to(device)
+
+    def __call__(self, input_ids, scores):
+        return scores.masked_fill(~self.mascara(scores.shape[-1], scores.device), float("-inf"))
+
+
+def opciones_restriccion(tokenizer, inicio: int, parada: str = None, permitidos: str = None) -> dict:
+    """Argumentos de generate para parar al completar el valor y restringir los tokens"""
+    opciones = {"stopping_criteria": [ParadaValor(tokenizer, inicio, parada)]}
+    if permitidos:
+        opciones["logits_processor"] = [TokensPermitidos(tokenizer, permitidos)]
+    return opciones
+
+
+def opciones_borrador(restringida: bool = False) -> dict:
+    """
+    Opciones de generación asistida con el modelo borrador (MODELO_BORRADOR), solo para
+    generaciones greedy de una fila. Con tokenizers distintos no se combina con `permitidos`
+    ni `parada`: la máscara de tokens es del vocabulario del modelo principal.
+    """
+    opciones = opciones_asistidas()
+    if not opciones or (restringida and "assistant_tokenizer" in opciones):
+        return {}
+    metricas.contador("generaciones_asistidas_total")
+    return opciones
+
+
+def recortar_parada(tokenizer, nuevos: list, parada: str = None) -> list:
+    """
+    La generación asistida acepta varios tokens por pasada y puede pasarse del token en el
+    que ParadaValor habría parado; se corta ahí para que la salida sea la misma que sin borrador.
+    """
+    criterio = ParadaValor(tokenizer, 0, parada)
+    for n in range(1, len(nuevos)):
+        if criterio.terminado(tokenizer.decode(nuevos[:n], skip_special_tokens=True)):
+            return nuevos[:n]
+    return nuevos
+
+
+def registrar_generacion(tokens_prompt: int, tokens_generados: int, segundos: float, tokens_reutilizados: int = 0):
+    """Métricas de una pasada de generate: tokens procesados, generados y velocidad"""
+    if not metricas.activas():
+        return
+    metricas.contador("tokens_prompt_total", tokens_prompt)
+    metricas.contador("tokens_generados_total", tokens_generados)
+    if tokens_reutilizados:
+        metricas.contador("tokens_prefijo_reutilizados_total", tokens_reutilizados)
+    metricas.observar("tokens_generados", tokens_generados)
+    if segundos > 0:
+        metricas.observar("tokens_por_segundo", tokens_generados / segundos)
+
+
+# -------------------------------
+# KV-cache de prefijos
+# -------------------------------
+def cache_prefijo(model, tokenizer, texto_prefijo: str):
+    """Ids y past_key_values de un prefijo de prompt; el prefill se hace una vez por modelo y prefijo"""
+    import torch
+    clave = (id_modelo(), texto_prefijo)
+    with _lock_prefijos:
+        entrada = _prefijos.get(clave)
+        if entrada is not None:
+            _prefijos.move_to_end(clave)
+            return entrada
+
+    ids = tokenizer(texto_prefijo, add_special_tokens=False)["input_ids"]
+    with torch.no_grad():
+        salida = model(input_ids=torch.tensor([ids], device=model.device), use_cache=True)
+    entrada = (ids, salida.past_key_values)
+
+    with _lock_prefijos:
+        _prefijos[clave] = entrada
+        while len(_prefijos) > MAX_PREFIJOS:
+            _prefijos.popitem(last=False)
+    return entrada
+
+
+def prefijo_formateado(tokenizer, mensajes: list, prefijo: str):
+    """
+    Texto del prompt de chat hasta el final de `prefijo`, tal como lo deja la plantilla
+    (las de Llama 3 hacen trim del contenido, así que el prefijo no aparece literal).
+    Se formatea el mensaje con el prefijo seguido de una marca y se corta en la marca.
+    None si ningún mensaje empieza por el prefijo.
+    """
+    for i in range(len(mensajes) - 1, -1, -1):
+        if (mensajes[i].get("content") or "").startswith(prefijo):
+            break
+    else:
+        return None
+    marcados = mensajes[:i] + [dict(mensajes[i], content=prefijo + MARCA_PREFIJO)]
+    texto = tokenizer.apply_chat_template(marcados, add_generation_prompt=False, tokenize=False)
+    corte = texto.find(MARCA_PREFIJO)
+    return texto[:corte] if corte > 0 else None
+
+
+def prefijo_en_cache(mensajes: list, prefijo: str) -> bool:
+    """True si el KV-cache del prefijo de esta petición ya está calculado"""
+    _, tokenizer = obtener_modelo()
+    texto_prefijo = prefijo_formateado(tokenizer, mensajes, prefijo) if mensajes and prefijo else None
+    with _lock_prefijos:
+        return texto_prefijo is not None and (id_modelo(), texto_prefijo) in _prefijos
+
+
+def generar_con_prefijo(mensajes: list, prefijo: str, max_new_tokens: int = 50, parada: str = None,
+                        permitidos: str = None) -> str:
+    """
+    Generación greedy de un prompt de chat cuyo contenido empieza por `prefijo`.
+    El KV-cache del prefijo se reutiliza (copiado, porque generate lo amplía) y solo
+    se procesa el resto del prompt. Devuelve solo el texto nuevo.
+    `parada` y `permitidos` restringen la generación como en generar_lote.
+    """
+    import torch
+    model, tokenizer = obtener_modelo()
+    texto = tokenizer.apply_chat_template(mensajes, add_generation_prompt=True, tokenize=False)
+    texto_prefijo = prefijo_formateado(tokenizer, mensajes, prefijo)
+    if texto_prefijo is None or not texto.startswith(texto_prefijo):
+        metricas.contador("prefijo_sin_cache_total", motivo="no_encontrado")
+        return generar_lote([{"mensajes": mensajes}], max_new_tokens, parada=parada, permitidos=permitidos)[0]
+
+    ids_prefijo, past_key_values = cache_prefijo(model, tokenizer, texto_prefijo)
+    ids = tokenizer(texto, add_special_tokens=False)["input_ids"]
+    # Tokens comunes: el último token del prefijo puede unirse al principio de la respuesta,
+    # y al menos un token del prompt tiene que pasar por el modelo
+    comunes = 0
+    limite = min(len(ids_prefijo), len(ids) - 1)
+    while comunes < limite and ids_prefijo[comunes] == ids[comunes]:
+        comunes += 1
+    if comunes == 0:
+        metricas.contador("prefijo_sin_cache_total", motivo="tokens_distintos")
+        return generar_lote([{"mensajes": mensajes}], max_new_tokens, parada=parada, permitidos=permitidos)[0]
+
+    cache = copy.deepcopy(past_key_values)
+    if comunes < len(ids_prefijo):
+        cache.crop(comunes)
+    input_ids = torch.tensor([ids], device=model.device)
+    opciones = opciones_restriccion(tokenizer, len(ids), parada, permitidos)
+    asistida = opciones_borrador(bool(parada or permitidos))
+    t = time.perf_counter()
+    with torch.no_grad():
+        salida = model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids),
+                                past_key_values=cache, max_new_tokens=max_new_tokens, do_sample=False,
+                                pad_token_id=pad_token_id(tokenizer), **opciones, **asistida)
+    nuevos = salida[0, len(ids):].tolist()
+    if asistida:
+        nuevos = recortar_parada(tokenizer, nuevos, parada)
+    registrar_generacion(len(ids) - comunes, len(nuevos), time.perf_counter() - t, comunes)
+    return tokenizer.decode(nuevos, skip_special_tokens=True)
+
+
+def generar_lote(peticiones: list, max_new_tokens: int = 50, do_sample: bool = False,
+                 temperature: float = None, parada: str = None, permitidos: str = None) -> list:
+    """
+    Genera la respuesta de varias peticiones ({'mensajes': [...]} o {'texto': '...'})
+    en una sola pasada del modelo, con padding a la izquierda.
+    Una petición greedy sola con 'prefijo' reutiliza el KV-cache de ese prefijo.
+    Con `parada` (regex de valor completo) cada fila termina en el primer salto de línea
+    o al completar el valor; con `permitidos` solo se generan tokens de esos caracteres.
+    Una petición greedy sola usa el modelo borrador si hay (MODELO_BORRADOR).
+    Devuelve solo el texto nuevo de cada una.
+    """
+    import torch
+    if len(peticiones) == 1 and peticiones[0].get("prefijo") and peticiones[0].get("mensajes") and not do_sample:
+        return [generar_con_prefijo(peticiones[0]["mensajes"], peticiones[0]["prefijo"], max_new_tokens,
+                                    parada, permitidos)]
+    model, tokenizer = obtener_modelo()
+    ids = [ids_prompt(tokenizer, p.get("mensajes"), p.get("texto")) for p in peticiones]
+    pad = pad_token_id(tokenizer)
+    largo = max(len(x) for x in ids)
+    input_ids = torch.tensor([[pad] * (largo - len(x)) + x for x in ids], device=model.device)
+    attention_mask = torch.tensor([[0] * (largo - len(x)) + [1] * len(x) for x in ids], device=model.device)
+
+    opciones = {"max_new_tokens": max_new_tokens, "do_sample": do_sample, "pad_token_id": pad}
+    if do_sample and temperature:
+        opciones["temperature"] = temperature
+    restringida = bool(parada or permitidos)
+    if restringida:
+        opciones.update(opciones_restriccion(tokenizer, largo, parada, permitidos))
+    asistida = opciones_borrador(restringida) if len(peticiones) == 1 and not do_sample else {}
+    t = time.perf_counter()
+    with torch.no_grad():
+        salida = model.generate(input_ids=input_ids, attention_mask=attention_mask, **opciones, **asistida)
+    if asistida and restringida:
+        nuevos = recortar_parada(tokenizer, salida[0, largo:].tolist(), parada)
+        salida = salida[:, :largo + len(nuevos)]
+    if metricas.activas():
+        metricas.observar("tamano_lote", len(peticiones))
+        registrar_generacion(sum(len(x) for x in ids), int((salida[:, largo:] != pad).sum()),
+                             time.perf_counter() - t)
+    return [tokenizer.decode(fila[largo:], skip_special_tokens=True) for fila in salida]
+
+
+def cliente_servidor():
+    """Cliente del servidor de inferencia, o None si se genera en local"""
+    global _cliente
+    if SERVIDOR and _cliente is None:
+        from servidor_inferencia import ClienteInferencia
+        host, _, puerto = SERVIDOR.rpartition(":")
+        _cliente = ClienteInferencia((host or "127.0.0.1", int(puerto)))
+    return _cliente
+
+
+def usar_backend(backend):
+    """
+    Sustituye la generación por `backend(mensajes=..., texto=..., **opciones) -> str`
+    (p. ej. un LLM falso para pruebas de carga). Con None se vuelve al modelo.
+    """
+    global _backend
+    _backend = backend
+
+
+def generar(mensajes=None, texto=None, max_new_tokens: int = 50, do_sample: bool = False,
+            temperature: float = None, prefijo: str = None, parada: str = None, permitidos: str = None) -> str:
+    """
+    Genera la respuesta a un prompt y devuelve solo el texto nuevo, con el backend
+    configurado (usar_backend) o con el modelo.
+    `prefijo` es la parte inicial del mensaje que se repite entre llamadas; su KV-cache se reutiliza.
+    `parada` y `permitidos` restringen la generación (ver generar_lote).
+    """
+    opciones = {"max_new_tokens": max_new_tokens, "do_sample": do_sample, "temperature": temperature,
+                "prefijo": prefijo, "parada": parada, "permitidos": permitidos}
+    metricas.contador("llamadas_llm_total")
+    with metricas.span("llm"):
+        if _backend is not None:
+            return _backend(mensajes=mensajes, texto=texto, **opciones)
+        return generar_modelo(mensajes, texto, **opciones)
+
+
+def generar_modelo(mensajes=None, texto=None, max_new_tokens: int = 50, do_sample: bool = False,
+                   temperature: float = None, prefijo: str = None, parada: str = None,
+                   permitidos: str = None) -> str:
+    """Generación con el modelo: en el servidor compartido si lo hay, si no en este proceso"""
+    cliente = cliente_servidor()
+    if cliente is not None:
+        return cliente.generar(mensajes=mensajes, texto=texto, max_new_tokens=max_new_tokens,
+                               do_sample=do_sample, temperature=temperature, prefijo=prefijo,
+                               parada=parada, permitidos=permitidos)
+    peticion = {"mensajes": mensajes, "texto": texto, "prefijo": prefijo}
+    return generar_lote([peticion], max_new_tokens, do_sample, temperature, parada, permitidos)[0]
+
+
+def generar_stream(mensajes=None, texto=None, max_new_tokens: int = 50, do_sample: bool = False,
+                   temperature: float = None):
+    """
+    Como generar(), pero devuelve los trozos de texto según se generan.
+    Con el servidor de inferencia u otro backend no hay streaming: se devuelve la respuesta entera de una vez.
+    """
+    if _backend is not None or cliente_servidor() is not None:
+        yield generar(mensajes, texto, max_new_tokens, do_sample, temperature)
+        return
+
+    import torch
+    from transformers import TextIteratorStreamer
+    model, tokenizer = obtener_modelo()
+    input_ids = torch.tensor([ids_prompt(tokenizer, mensajes, texto)], device=model.device)
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+    opciones = {"max_new_tokens": max_new_tokens, "do_sample": do_sample, "pad_token_id": pad_token_id(tokenizer)}
+    if do_sample and temperature:
+        opciones["temperature"] = temperature
+    if not do_sample:
+        opciones.update(opciones_borrador())
+
+    def generar_en_hilo():
+        with torch.no_grad():
+            model.generate(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), streamer=streamer,
+                           **opciones)
+
+    hilo = threading.Thread(target=generar_en_hilo, daemon=True)
+    hilo.start()
+    yield from streamer
+    hilo.join()
@@ -1,85 +1,330 @@
-from langchain_groq import ChatGroq
-from langchain.agents import Tool, initialize_agent
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import argparse
 import os
 import re
+import threading
+import time
+from collections import Counter, OrderedDict
+import numpy as np
 from dotenv import load_dotenv
+from calculo_hipoteca import (EURIBOR_ACTUAL, TASA_FIJA, cuota_mensual, simular_hipoteca, diferencial_por_riesgo,
+                              cuota_maxima, calcular_plazo)
+from asequibilidad import precio_maximo
+from validadores import normalizar
+import metricas
+
+load_dotenv()
 
 # ------------------------------------------
-# 1. MODELO GROQ (REMOTO Y GRATIS)
+# 1. CONFIGURACIÓN
 # ------------------------------------------
+# AGENTE_LLM: groq (remoto), local (el modelo de model_loader) o falso (sin red ni modelo)
+BACKENDS = ("groq", "local", "falso")
+BACKEND = os.getenv("AGENTE_LLM", "groq")
+# Similitud TF-IDF mínima para reutilizar la respuesta de una pregunta parecida (0 la desactiva)
+# Por defecto solo se reutilizan respuestas a la misma pregunta normalizada; con un umbral
+# (p. ej. 0.9) también a preguntas muy parecidas con los mismos números y términos clave
+UMBRAL_SIMILITUD = float(os.getenv("AGENTE_CACHE_SIMILITUD", "0"))
+
+# Términos que cambian la respuesta aunque el resto de la pregunta sea igual ("fijo" frente a "variable")
+TERMINOS_CLAVE = {
+    "fijo": "fijo", "fija": "fijo",
+    "variable": "variable",
+    "mixto": "mixto", "mixta": "mixto",
+    "plazo": "plazo", "anos": "plazo", "meses": "plazo",
+    "tipo": "tipo", "interes": "tipo", "tae": "tipo", "tin": "tipo", "euribor": "tipo", "diferencial": "tipo",
+    "cuota": "cuota", "mensualidad": "cuota", "pagaria": "cuota",
+    "entrada": "entrada", "ahorros": "entrada",
+    "ingresos": "ingresos", "cobro": "ingresos", "nomina": "ingresos", "sueldo": "ingresos",
+    "precio": "precio", "vivienda": "precio",
+    "amortizar": "amortizar", "amortizacion": "amortizar",
+    "comision": "comision", "comisiones": "comision"
+}
+
+PREFIJO_AGENTE = "Eres un asistente hipotecario profesional. Usa las herramientas para cualquier cálculo."
+
+# ------------------------------------------
+# 2. TOOLS (motor de calculo_hipoteca con argumentos estructurados)
+# ------------------------------------------
+def calcular_cuota(importe: float, anos: int, tipo: str = "fijo", tasa_anual: float = None) -> str:
+    """Cuota mensual de un préstamo de `importe` euros a `anos` años, a tipo fijo o variable"""
+    if importe <= 0 or anos <= 0:
+        return "El importe y los años deben ser positivos."
+    if tasa_anual is None:
+        # Sin datos del cliente se aplica el diferencial intermedio sobre el Euribor
+        tasa_anual = TASA_FIJA if tipo == "fijo" else EURIBOR_ACTUAL + 1.0
+    cuota = cuota_mensual(importe, tasa_anual, int(anos))
+    return f"La cuota mensual es {cuota:.2f} € ({tipo}, {tasa_anual:.2f}% a {int(anos)} años)."
+
+
+def obtener_tipos_interes() -> str:
+    """Tipos de interés vigentes: fijo y variable (Euribor + diferencial según riesgo)"""
+    return (f"Tipo fijo: {TASA_FIJA:.2f}%. Tipo variable: Euribor ({EURIBOR_ACTUAL:.2f}%) más un diferencial "
+            f"de 0,50 a 1,50 puntos según la ratio ingresos/gastos.")
+
+
+def calcular_plazo_asumible(importe: float, ingresos_netos_mensuales: float, gastos_mensuales_est: float = 0.0) -> str:
+    """Plazo y cuota que el cliente puede asumir (cuota máxima = 33% de ingresos menos gastos)"""
+    cuota_max = float(cuota_maxima(ingresos_netos_mensuales, gastos_mensuales_est))
+    tasa_variable = EURIBOR_ACTUAL + float(diferencial_por_riesgo(ingresos_netos_mensuales, gastos_mensuales_est))
+    partes = [f"Cuota máxima asumible: {cuota_max:.2f} €."]
+    for nombre, tasa in [("variable", tasa_variable), ("fijo", TASA_FIJA)]:
+        plazo = calcular_plazo(importe, cuota_max, tasa)
+        partes.append(f"Tipo {nombre} ({tasa:.2f}%): {plazo} años, cuota {cuota_mensual(importe, tasa, plazo):.2f} €.")
+    return " ".join(partes)
 
-load_dotenv()
 
-prompt = PromptTemplate(
-    input_variables=["input"],
-    template="Eres un asistente hipotecario profesional. {input}"
-)
+def simular(precio_vivienda: float, entrada: float, ingresos_netos_mensuales: float,
+            gastos_mensuales_est: float = 0.0) -> str:
+    """Simulación completa de la hipoteca (la misma que al final de la conversación con el asesor)"""
+    resultado = simular_hipoteca({
+        "precio_vivienda": precio_vivienda, "entrada": entrada, "importe_a_financiar": precio_vivienda - entrada,
+        "ingresos_netos_mensuales": ingresos_netos_mensuales, "gastos_mensuales_est": gastos_mensuales_est
+    })
+    return (f"Importe a financiar {resultado['importe_financiar']:.2f} €. "
+            f"Variable {resultado['tasa_variable']:.2f}%: {resultado['cuota_variable']:.2f} € a "
+            f"{resultado['plazo_variable']} años. Fijo {resultado['tasa_fija']:.2f}%: "
+            f"{resultado['cuota_fija']:.2f} € a {resultado['plazo_fijo']} años.")
+
+
+def precio_maximo_asumible(ingresos_netos_mensuales: float, gastos_mensuales_est: float = 0.0, entrada: float = 0.0,
+                           anos: int = 30) -> str:
+    """Precio máximo de vivienda que puede pagar el cliente a un plazo dado, a tipo variable y fijo"""
+    cuota_max = float(cuota_maxima(ingresos_netos_mensuales, gastos_mensuales_est))
+    tasa_variable = EURIBOR_ACTUAL + float(diferencial_por_riesgo(ingresos_netos_mensuales, gastos_mensuales_est))
+    partes = [f"Con una cuota máxima de {cuota_max:.2f} € a {int(anos)} años:"]
+    for nombre, tasa in [("variable", tasa_variable), ("fijo", TASA_FIJA)]:
+        partes.append(f"tipo {nombre} ({tasa:.2f}%) hasta {float(precio_maximo(cuota_max, tasa, int(anos), entrada)):.0f} €.")
+    return " ".join(partes)
+
+
+HERRAMIENTAS = [calcular_cuota, obtener_tipos_interes, calcular_plazo_asumible, simular, precio_maximo_asumible]
+
+
+def crear_herramientas() -> list:
+    """Tools de LangChain con el esquema de argumentos sacado de la firma de cada función"""
+    from langchain_core.tools import StructuredTool
+    return [StructuredTool.from_function(f, name=f.__name__, description=f.__doc__) for f in HERRAMIENTAS]
 
-llm = ChatGroq(
-    api_key=os.getenv("GROQ_API_TOKEN"),
-    model_name="llama-3.1-8b-instant",
-    temperature=0.2
-)
 
 # ------------------------------------------
-# 2. TOOLS
+# 3. MODELOS (backends intercambiables)
 # ------------------------------------------
+def crear_llm(backend: str = BACKEND):
+    if backend == "groq":
+        from langchain_groq import ChatGroq
+        return ChatGroq(api_key=os.getenv("GROQ_API_TOKEN"), model_name="llama-3.1-8b-instant", temperature=0.2)
+    if backend == "local":
+        return crear_llm_local()
+    if backend == "falso":
+        from langchain_community.llms.fake import FakeListLLM
+        # Formato del agente structured-chat: respuesta final directa, sin herramientas
+        return FakeListLLM(responses=[
+            'Action:\n```\n{"action": "Final Answer", "action_input": "Respuesta de prueba (LLM falso, sin conexión)."}\n```'
+        ])
+    raise ValueError(f"Backend no válido: {backend} (usa {', '.join(BACKENDS)})")
+
+
+def crear_llm_local():
+    """El modelo local de model_loader (o el servidor de inferencia) como LLM de LangChain"""
+    from langchain_core.language_models.llms import LLM
+    import inferencia
+
+    class LLMLocal(LLM):
+        max_new_tokens: int = 256
+
+        @property
+        def _llm_type(self) -> str:
+            return "asesor_local"
+
+        def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+            texto = inferencia.generar([{"role": "user", "content": prompt}], max_new_tokens=self.max_new_tokens)
+            # LangChain espera que el texto se corte en la primera secuencia de parada
+            for parada in stop or []:
+                texto = texto.split(parada)[0]
+            return texto
+
+    return LLMLocal()
 
-def calcular_cuota_texto(texto):
-    numeros = list(map(float, re.findall(r"\d+", texto)))
-    if len(numeros) >= 2:
-        prestamo = numeros[0]
-        anos = numeros[1]
-        interes_anual = 0.03
-        i = interes_anual / 12
-        n = anos * 12
-        cuota = prestamo * (i * (1 + i)**n) / ((1 + i)**n - 1)
-        return f"La cuota mensual aproximada es {round(cuota,2)} €."
-    else:
-        return "Por favor dime el monto del préstamo y los años."
-
-def obtener_tipo_interes(texto):
-    return "El tipo de interés fijo actual aproximado es del 3%."
-
-tools = [
-    Tool(
-        name="calcular_cuota",
-        func=calcular_cuota_texto,
-        description="Calcula la cuota mensual a partir de texto natural."
-    ),
-    Tool(
-        name="obtener_tipo_interes",
-        func=obtener_tipo_interes,
-        description="Devuelve el tipo de interés fijo actual."
+
+def crear_agente(llm):
+    from langchain.agents import AgentType, initialize_agent
+    return initialize_agent(
+        tools=crear_herramientas(),
+        llm=llm,
+        agent=AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION,
+        agent_kwargs={"prefix": PREFIJO_AGENTE},
+        verbose=False,
+        max_iterations=3,
+        handle_parsing_errors=True
     )
-]
+
+
+# ------------------------------------------
+# 4. CACHÉ DE RESPUESTAS
+# ------------------------------------------
+def normalizar_pregunta(pregunta: str) -> str:
+    return normalizar(pregunta, puntuacion=False)
+
+
+def numeros(pregunta_normalizada: str) -> tuple:
+    return tuple(re.findall(r"\d+", pregunta_normalizada))
+
+
+def huella(pregunta_normalizada: str) -> tuple:
+    """Números y términos clave de la pregunta: dos preguntas solo comparten respuesta si coinciden"""
+    terminos = sorted({TERMINOS_CLAVE[p] for p in pregunta_normalizada.split() if p in TERMINOS_CLAVE})
+    return numeros(pregunta_normalizada), tuple(terminos)
+
+
+class CacheRespuestas:
+    """
+    Respuestas del agente por pregunta normalizada (minúsculas, sin tildes ni signos).
+    Con `umbral_similitud` > 0, si no hay coincidencia exacta se busca la pregunta guardada
+    más parecida por similitud coseno TF-IDF; solo vale si supera el umbral y contiene
+    exactamente los mismos números y términos clave (una cuota de 200.000 € no responde a
+    una de 150.000 €, ni el tipo fijo al variable).
+    """
+
+    def __init__(self, umbral_similitud: float = UMBRAL_SIMILITUD, max_entradas: int = 1000):
+        self.umbral = umbral_similitud
+        self.max_entradas = max_entradas
+        self._respuestas = OrderedDict()
+        self._lock = threading.Lock()
+        self._matriz = None  # TF-IDF de las preguntas guardadas; se rehace al cambiar
+        self._claves = []
+        self._vocabulario = {}
+        self._idf = None
+        self.resultados = Counter()
+
+    def obtener(self, pregunta: str):
+        """Devuelve (respuesta, 'exacta' | 'similar') o (None, 'fallo')"""
+        clave = normalizar_pregunta(pregunta)
+        with self._lock:
+            if clave in self._respuestas:
+                self._respuestas.move_to_end(clave)
+                return self._anotar(self._respuestas[clave], "exacta")
+            if self.umbral > 0 and self._respuestas:
+                parecida = self._mas_parecida(clave)
+                if parecida is not None:
+                    return self._anotar(self._respuestas[parecida], "similar")
+        return self._anotar(None, "fallo")
+
+    def guardar(self, pregunta: str, respuesta: str):
+        with self._lock:
+            self._respuestas[normalizar_pregunta(pregunta)] = respuesta
+            self._respuestas.move_to_end(normalizar_pregunta(pregunta))
+            while len(self._respuestas) > self.max_entradas:
+                self._respuestas.popitem(last=False)
+            self._matriz = None
+
+    def _anotar(self, respuesta, resultado: str):
+        self.resultados[resultado] += 1
+        metricas.contador("cache_agente_consultas_total", resultado=resultado)
+        return respuesta, resultado
+
+    # TF-IDF: tf = apariciones / palabras de la pregunta, idf = log((1 + N) / (1 + df)) + 1, filas L2
+    def _indexar(self):
+        self._claves = list(self._respuestas)
+        documentos = [clave.split() for clave in self._claves]
+        self._vocabulario = {t: i for i, t in enumerate(sorted({t for d in documentos for t in d}))}
+        tf = np.zeros((len(documentos), len(self._vocabulario)))
+        for fila, documento in enumerate(documentos):
+            for termino, n in Counter(documento).items():
+                tf[fila, self._vocabulario[termino]] = n / len(documento)
+        df = np.count_nonzero(tf, axis=0)
+        self._idf = np.log((1 + len(documentos)) / (1 + df)) + 1
+        self._matriz = self._normalizar_filas(tf * self._idf)
+
+    @staticmethod
+    def _normalizar_filas(matriz):
+        normas = np.linalg.norm(matriz, axis=-1, keepdims=True)
+        return matriz / np.where(normas == 0, 1.0, normas)
+
+    def _mas_parecida(self, clave: str):
+        if self._matriz is None:
+            self._indexar()
+        terminos = [t for t in clave.split() if t in self._vocabulario]
+        if not terminos:
+            return None
+        vector = np.zeros(len(self._vocabulario))
+        for termino, n in Counter(terminos).items():
+            vector[self._vocabulario[termino]] = n / len(clave.split())
+        similitudes = self._matriz @ self._normalizar_filas(vector * self._idf)
+        for indice in np.argsort(similitudes)[::-1]:
+            if similitudes[indice] < self.umbral:
+                return None
+            if huella(self._claves[indice]) == huella(clave):
+                return self._claves[indice]
+        return None
+
+    def tasa_acierto(self) -> float:
+        total = sum(self.resultados.values())
+        return (self.resultados["exacta"] + self.resultados["similar"]) / total if total else 0.0
+
 
 # ------------------------------------------
-# 3. CREAR AGENTE
+# 5. PREGUNTAS E INFORME
 # ------------------------------------------
+def responder(agente, cache: CacheRespuestas, pregunta: str) -> dict:
+    t = time.perf_counter()
+    respuesta, origen = cache.obtener(pregunta)
+    if respuesta is None:
+        with metricas.span("agente"):
+            respuesta = agente.invoke({"input": pregunta})["output"]
+        cache.guardar(pregunta, respuesta)
+        origen = "llm"
+    return {"pregunta": pregunta, "respuesta": respuesta, "origen": origen, "segundos": time.perf_counter() - t}
+
 
-agente = initialize_agent(
-    tools=tools,
-    llm=llm,
-    agent="zero-shot-react-description",
-    verbose=True,
-    max_iterations=1
-)
+def informe(registros: list, cache: CacheRespuestas) -> str:
+    lineas = [f"{'origen':>8} {'ms':>9}  pregunta"]
+    for r in registros:
+        lineas.append(f"{r['origen']:>8} {r['segundos'] * 1000:>9.2f}  {r['pregunta'][:70]}")
+    if registros:
+        for origen in ("llm", "exacta", "similar"):
+            ms = [r["segundos"] * 1000 for r in registros if r["origen"] == origen]
+            if ms:
+                lineas.append(f"{origen}: {len(ms)} preguntas, p50 {np.percentile(ms, 50):.2f} ms, "
+                              f"p95 {np.percentile(ms, 95):.2f} ms")
+    lineas.append(f"Tasa de acierto de la caché: {cache.tasa_acierto():.1%} ({dict(cache.resultados)})")
+    return "\n".join(lineas)
 
 
 # ------------------------------------------
-# 4. LOOP DE CHAT
+# 6. LOOP DE CHAT
 # ------------------------------------------
-print("Agente hipotecario listo. Escribe 'salir' para cerrar.\n")
+def main():
+    parser = argparse.ArgumentParser(description="Agente hipotecario de LangChain con caché de respuestas")
+    parser.add_argument("--backend", choices=BACKENDS, default=BACKEND, help="LLM del agente")
+    parser.add_argument("--similitud", type=float, default=UMBRAL_SIMILITUD,
+                        help="Similitud TF-IDF mínima para reutilizar respuestas (0 = solo coincidencia exacta)")
+    parser.add_argument("--preguntas", default=None, help="Fichero con una pregunta por línea (sin chat interactivo)")
+    args = parser.parse_args()
+
+    agente = crear_agente(crear_llm(args.backend))
+    cache = CacheRespuestas(args.similitud)
+    registros = []
+
+    if args.preguntas:
+        with open(args.preguntas, "r", encoding="utf-8") as f:
+            for pregunta in (linea.strip() for linea in f):
+                if pregunta:
+                    registros.append(responder(agente, cache, pregunta))
+        print(informe(registros, cache))
+        return
+
+    print("Agente hipotecario listo. Escribe 'salir' para cerrar.\n")
+    while True:
+        pregunta = input("Tú: ")
+        if pregunta.lower() in ["salir", "exit", "quit"]:
+            print("Agente: ¡Hasta luego!")
+            break
+        registro = responder(agente, cache, pregunta)
+        registros.append(registro)
+        print("Agente:", registro["respuesta"])
+        print(f"({registro['origen']}, {registro['segundos'] * 1000:.0f} ms)\n")
+    print(informe(registros, cache))
 
-while True:
-    pregunta = input("Tú: ")
-    if pregunta.lower() in ["salir", "exit", "quit"]:
-        print("Agente: ¡Hasta luego!")
-        break
 
-    respuesta = agente.invoke({"input": pregunta})
-    print("Agente:", respuesta)
-    print()
+if __name__ == "__main__":
+    main()
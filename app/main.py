@@ -1,65 +1,37 @@
-import time
-from saludo_inicial import saludo_inicial
-from gdpr import solicitar_consentimiento_gdpr
-from morosidad import solicitar_consentimiento_morosos
-from slot_filling import iniciar_slot_filling_json
-from calculo_hipoteca import calculo_hipotecario
-import pandas as pd
+import argparse
+import asyncio
+from sesion import MotorSesiones
+from saludo_inicial import SALUDO_EN_VIVO
 
-def main():
-    # Saludo inicial
-    prompts = saludo_inicial()
-    
-    time.sleep(1.5)
 
-    # Solicitar consentimiento GDPR
-    if not solicitar_consentimiento_gdpr():
-        return  # Termina el programa si el usuario no consiente
-    
-    if not solicitar_consentimiento_morosos():
-        return # Termina el programa si el usuario no consiente
+def emitir(trozo):
+    print(trozo, end="", flush=True)
 
-    # Slot filling / preguntas guiadas
-    iniciar_slot_filling_json(prompts)
-    
-    # Calculo de la hipoteca
-    resultado = calculo_hipotecario()
-    
-    # Mostrar resultados principales
-    print("\nResultados de la hipoteca:")
-    print(f"Cliente: {resultado['cliente']} ({resultado['dni_nie']})")
-    print(f"Importe a financiar: {resultado['importe_financiar']:.2f} €")
-    print(f"Cuota mensual tipo variable ({resultado['tasa_variable']:.2f}%): {resultado['cuota_variable']:.2f} €")
-    print(f"Cuota mensual tipo fijo ({resultado['tasa_fija']:.2f}%): {resultado['cuota_fija']:.2f} €")
 
-    # ---------------------------
-    # Mostrar tabla de amortización anual
-    # ---------------------------
-    for tipo, tabla in [("Variable", resultado["tabla_variable"]), ("Fijo", resultado["tabla_fija"])]:
-        print(f"\nTabla de amortización anual ({tipo}):")
-        
-        # Convertir a DataFrame si no lo es
-        if not isinstance(tabla, pd.DataFrame):
-            tabla = pd.DataFrame(tabla)
-        
-        # Asegurarse de que las columnas numéricas sean float
-        for col in ["cuota", "interes", "amortizacion", "saldo"]:
-            tabla[col] = tabla[col].astype(float)
-        
-        # Extraer año
-        tabla["año"] = pd.to_datetime(tabla["fecha"]).dt.year
-        
-        # Agrupar por año
-        resumen_anual = tabla.groupby("año").agg({
-            "cuota": "sum",
-            "interes": "sum",
-            "amortizacion": "sum",
-            "saldo": "last"
-        }).reset_index()
-        
-        # Imprimir
-        print(resumen_anual.to_string(index=False, float_format="{:.2f}".format))
+async def conversar(tablas_mensuales: bool = False, saludo_en_vivo: bool = SALUDO_EN_VIVO):
+    """Adaptador de consola: una sesión del motor, leyendo del teclado sin bloquear el bucle"""
+    motor = MotorSesiones(tablas_mensuales=tablas_mensuales, saludo_en_vivo=saludo_en_vivo)
+    loop = asyncio.get_running_loop()
+
+    sesion_id, mensajes = await motor.abrir(emitir=emitir)
+    while True:
+        for mensaje in mensajes:
+            print(f"Agente: {mensaje}")
+        if motor.terminada(sesion_id):
+            break
+        texto = await loop.run_in_executor(None, input, "Usuario: ")
+        mensajes = await motor.mensaje(sesion_id, texto)
+    motor.cerrar(sesion_id)
+
+
+def main(tablas_mensuales: bool = False, saludo_en_vivo: bool = SALUDO_EN_VIVO):
+    asyncio.run(conversar(tablas_mensuales, saludo_en_vivo))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Asesor hipotecario")
+    parser.add_argument("--tabla-mensual", action="store_true", help="Muestra también la tabla de amortización mensual")
+    parser.add_argument("--saludo-en-vivo", action="store_true", default=SALUDO_EN_VIVO,
+                        help="Genera el saludo con el modelo en el momento (en streaming) en lugar de usar el pool")
+    args = parser.parse_args()
+    main(tablas_mensuales=args.tabla_mensual, saludo_en_vivo=args.saludo_en_vivo)
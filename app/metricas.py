@@ -0,0 +1,198 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from functools import wraps
+
+# Desactivadas por defecto: cada llamada comprueba un booleano y no hace nada más.
+# METRICAS=1 las activa; METRICAS_FICHERO=<ruta> guarda un volcado al salir
+# (JSON si la ruta acaba en .json, formato de texto de Prometheus si no).
+PREFIJO = "asesor_"
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS = {
+    "tokens_por_segundo": (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    "tokens_generados": (1, 2, 4, 8, 16, 32, 64, 128, 256),
+    "tamano_lote": (1, 2, 4, 8, 16, 32)
+}
+
+_activas = os.getenv("METRICAS") == "1"
+_lock = threading.Lock()
+_contadores = {}
+_histogramas = {}
+
+
+def activas() -> bool:
+    return _activas
+
+
+def activar(valor: bool = True):
+    global _activas
+    _activas = valor
+
+
+def reiniciar():
+    with _lock:
+        _contadores.clear()
+        _histogramas.clear()
+
+
+def _clave(nombre: str, etiquetas: dict) -> tuple:
+    return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+# -------------------------------
+# Contadores e histogramas
+# -------------------------------
+def contador(nombre: str, valor: float = 1, **etiquetas):
+    """Suma `valor` al contador `nombre` con esas etiquetas"""
+    if not _activas:
+        return
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def observar(nombre: str, valor: float, **etiquetas):
+    """Añade una observación al histograma `nombre` (buckets de BUCKETS o de segundos)"""
+    if not _activas:
+        return
+    clave = _clave(nombre, etiquetas)
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            limites = BUCKETS.get(nombre, BUCKETS_SEGUNDOS)
+            histograma = _histogramas[clave] = {"limites": limites, "cuentas": [0] * (len(limites) + 1),
+                                                "suma": 0.0, "n": 0}
+        histograma["cuentas"][bisect.bisect_left(histograma["limites"], valor)] += 1
+        histograma["suma"] += valor
+        histograma["n"] += 1
+
+
+# -------------------------------
+# Spans
+# -------------------------------
+class _Span:
+    __slots__ = ("nombre", "etiquetas", "inicio")
+
+    def __init__(self, nombre, etiquetas):
+        self.nombre = nombre
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        observar("duracion_segundos", time.perf_counter() - self.inicio, span=self.nombre, **self.etiquetas)
+        if tipo is not None:
+            contador("errores_total", span=self.nombre)
+        return False
+
+
+class _SpanNulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        return False
+
+
+_SPAN_NULO = _SpanNulo()
+
+
+def span(nombre: str, **etiquetas):
+    """
+    Mide la duración de un bloque en el histograma duracion_segundos{span=nombre}:
+        with span("guardado"):
+            ...
+    """
+    if not _activas:
+        return _SPAN_NULO
+    return _Span(nombre, etiquetas)
+
+
+def medido(nombre: str = None, **etiquetas):
+    """Decorador: mide cada llamada de la función como un span (por defecto con su nombre)"""
+    def decorador(funcion):
+        nombre_span = nombre or funcion.__name__
+
+        @wraps(funcion)
+        def envoltorio(*args, **kwargs):
+            if not _activas:
+                return funcion(*args, **kwargs)
+            with _Span(nombre_span, etiquetas):
+                return funcion(*args, **kwargs)
+        return envoltorio
+    return decorador
+
+
+# -------------------------------
+# Exportación
+# -------------------------------
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas_texto(etiquetas, extra=()) -> str:
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def exportar_prometheus() -> str:
+    """Volcado en formato de texto de Prometheus (p. ej. para el textfile collector de node_exporter)"""
+    with _lock:
+        contadores = dict(_contadores)
+        histogramas = {k: dict(v, cuentas=list(v["cuentas"])) for k, v in _histogramas.items()}
+    lineas = []
+    for nombre in sorted({k[0] for k in contadores}):
+        lineas.append(f"# TYPE {PREFIJO}{nombre} counter")
+        for (n, etiquetas), valor in sorted(contadores.items()):
+            if n == nombre:
+                lineas.append(f"{PREFIJO}{nombre}{_etiquetas_texto(etiquetas)} {valor}")
+    for nombre in sorted({k[0] for k in histogramas}):
+        lineas.append(f"# TYPE {PREFIJO}{nombre} histogram")
+        for (n, etiquetas), h in sorted(histogramas.items()):
+            if n != nombre:
+                continue
+            acumulado = 0
+            for limite, cuenta in zip(list(h["limites"]) + ["+Inf"], h["cuentas"]):
+                acumulado += cuenta
+                lineas.append(f"{PREFIJO}{nombre}_bucket{_etiquetas_texto(etiquetas, [('le', limite)])} {acumulado}")
+            lineas.append(f"{PREFIJO}{nombre}_sum{_etiquetas_texto(etiquetas)} {h['suma']}")
+            lineas.append(f"{PREFIJO}{nombre}_count{_etiquetas_texto(etiquetas)} {h['n']}")
+    return "\n".join(lineas) + "\n"
+
+
+def exportar_json() -> dict:
+    with _lock:
+        return {
+            "contadores": [
+                {"nombre": n, "etiquetas": dict(e), "valor": v} for (n, e), v in sorted(_contadores.items())
+            ],
+            "histogramas": [
+                {"nombre": n, "etiquetas": dict(e), "n": h["n"], "suma": h["suma"],
+                 "media": h["suma"] / h["n"] if h["n"] else 0.0,
+                 "buckets": dict(zip([str(x) for x in h["limites"]] + ["+Inf"], h["cuentas"]))}
+                for (n, e), h in sorted(_histogramas.items())
+            ]
+        }
+
+
+def guardar(ruta: str):
+    """Escribe el volcado (JSON si la ruta acaba en .json, Prometheus si no) de forma atómica"""
+    contenido = json.dumps(exportar_json(), ensure_ascii=False, indent=2) if ruta.endswith(".json") \
+        else exportar_prometheus()
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+if os.getenv("METRICAS_FICHERO"):
+    atexit.register(lambda: _activas and guardar(os.getenv("METRICAS_FICHERO")))
@@ -1,10 +1,9 @@
 from dotenv import load_dotenv
 import os
 import logging
+import threading
+import time
 import warnings
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from huggingface_hub import login
 
 # --- Silenciar Warnings ---
 warnings.filterwarnings("ignore")
@@ -13,22 +12,200 @@ logging.getLogger("transformers").setLevel(logging.ERROR)
 
 
 # --- Modelo ---
+# El modelo y el tokenizer se cargan la primera vez que se piden (obtener_modelo),
+# no al importar este módulo: quien solo usa el cálculo hipotecario no paga la carga.
 load_dotenv()
-hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
-
-login(token=hf_token)
 
 # model_name = "Qwen/Qwen2.5-0.5B-Instruct"
-model_name = "meta-llama/Llama-3.2-1B-Instruct"
-
-# tokenizer = AutoTokenizer.from_pretrained(model_name, token=hf_token)
-tokenizer = AutoTokenizer.from_pretrained(model_name, use_auth_token=hf_token)
-model = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    # token=hf_token,
-    device_map="auto",
-    offload_folder="offload",
-    torch_dtype="auto"
-)
+model_name = os.getenv("MODELO_LLM", "meta-llama/Llama-3.2-1B-Instruct")
+
+# Modelo pequeño de respaldo (p. ej. para tests o máquinas sin acceso al modelo principal):
+# se usa si el principal no está descargado y no se puede descargar, o si falla su carga.
+MODELO_RESPALDO = os.getenv("MODELO_LLM_RESPALDO")
+
+# Decodificación especulativa (opcional): un modelo mucho más pequeño, a ser posible con el mismo
+# tokenizer (p. ej. Qwen2.5-0.5B con un Qwen2.5 mayor), propone tokens que el principal verifica.
+# En greedy la salida es idéntica a la del modelo principal solo; sin MODELO_BORRADOR no se usa.
+MODELO_BORRADOR = os.getenv("MODELO_BORRADOR")
+
+# Precisión de inferencia en CPU: auto (la del checkpoint), fp32, bf16 o int8
+# (cuantización dinámica de las capas Linear).
+PRECISIONES = ("auto", "fp32", "bf16", "int8")
+PRECISION = os.getenv("MODELO_PRECISION", "auto").lower()
+if PRECISION not in PRECISIONES:
+    raise ValueError(f"MODELO_PRECISION debe ser uno de {PRECISIONES}, no {PRECISION!r}")
+
+# Segundos por fase de la última carga (imports, login, tokenizer, modelo)
+TIEMPOS_CARGA = {}
+
+_model = None
+_tokenizer = None
+_nombre = None
+_lock = threading.Lock()
+_borrador = None
+_tokenizer_borrador = None
+_opciones_borrador = {}  # argumentos de generate() para el borrador, calculados al cargarlo
+
+
+def modo_offline() -> bool:
+    return os.getenv("HF_HUB_OFFLINE") == "1" or os.getenv("TRANSFORMERS_OFFLINE") == "1"
+
+
+def en_cache_local(nombre: str = model_name) -> bool:
+    """True si los ficheros del modelo ya están descargados (no hace falta red ni login)"""
+    if os.path.isdir(nombre):
+        return True
+    from huggingface_hub import try_to_load_from_cache
+    return isinstance(try_to_load_from_cache(nombre, "config.json"), str)
+
+
+def modelo_a_cargar() -> str:
+    """Nombre del modelo que se va a usar: el principal o, si no está disponible, el de respaldo"""
+    global _nombre
+    if _nombre is None:
+        _nombre = model_name
+        if MODELO_RESPALDO:
+            sin_descarga = modo_offline() or not os.getenv("HUGGINGFACEHUB_API_TOKEN")
+            if sin_descarga and not en_cache_local(model_name):
+                _nombre = MODELO_RESPALDO
+    return _nombre
+
+
+def id_modelo() -> str:
+    """Identifica modelo y precisión (para claves de caché que dependen de las respuestas del modelo)"""
+    nombre = modelo_a_cargar()
+    return nombre if PRECISION == "auto" else f"{nombre}@{PRECISION}"
+
+
+def opciones_precision() -> dict:
+    import torch
+    if PRECISION == "bf16":
+        return {"dtype": torch.bfloat16}
+    if PRECISION in ("fp32", "int8"):
+        return {"dtype": torch.float32}
+    return {"dtype": "auto"}
+
+
+def _cargar():
+    global _nombre
+    try:
+        _cargar_modelo(modelo_a_cargar())
+    except Exception:
+        if not MODELO_RESPALDO or _nombre == MODELO_RESPALDO:
+            raise
+        _nombre = MODELO_RESPALDO
+        _cargar_modelo(_nombre)
+
+
+def _cargar_modelo(nombre: str):
+    global _model, _tokenizer
+    TIEMPOS_CARGA.clear()
+    t = time.perf_counter()
+
+    def fase(nombre):
+        nonlocal t
+        ahora = time.perf_counter()
+        TIEMPOS_CARGA[nombre] = ahora - t
+        t = ahora
+
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from huggingface_hub import login
+    fase("imports")
+
+    hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+    local = modo_offline() or en_cache_local(nombre)
+    if not local and hf_token:
+        login(token=hf_token)
+    fase("login")
+
+    tokenizer = AutoTokenizer.from_pretrained(nombre, token=hf_token, local_files_only=local)
+    fase("tokenizer")
+
+    # Con low_cpu_mem_usage los pesos safetensors se leen por mmap, sin copia intermedia.
+    # MODELO_OFFLOAD=<carpeta> reparte el modelo con device_map="auto" (solo si no cabe en memoria).
+    opciones = {"low_cpu_mem_usage": True, **opciones_precision()}
+    offload = os.getenv("MODELO_OFFLOAD")
+    if offload and PRECISION != "int8":
+        opciones.update(device_map="auto", offload_folder=offload)
+    model = AutoModelForCausalLM.from_pretrained(nombre, token=hf_token, local_files_only=local, **opciones)
+    model.eval()
+    fase("modelo")
+
+    if PRECISION == "int8":
+        import torch
+        from torch.ao.quantization import quantize_dynamic
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        fase("cuantizacion")
+
+    _model, _tokenizer = model, tokenizer
+
+
+def obtener_modelo():
+    """Devuelve (model, tokenizer), cargándolos en la primera llamada"""
+    if _model is None:
+        with _lock:
+            if _model is None:
+                _cargar()
+    return _model, _tokenizer
+
+
+def modelo_cargado() -> bool:
+    return _model is not None
+
+
+def obtener_borrador():
+    """
+    Devuelve (modelo, tokenizer) del borrador de MODELO_BORRADOR, cargándolos en la primera
+    llamada, o (None, None) si no hay borrador configurado.
+    """
+    global _borrador, _tokenizer_borrador, _opciones_borrador
+    if not MODELO_BORRADOR:
+        return None, None
+    if _borrador is None:
+        obtener_modelo()
+        with _lock:
+            if _borrador is None:
+                from transformers import AutoTokenizer, AutoModelForCausalLM
+                hf_token = os.getenv("HUGGINGFACEHUB_API_TOKEN")
+                local = modo_offline() or en_cache_local(MODELO_BORRADOR)
+                t = time.perf_counter()
+                tokenizer = AutoTokenizer.from_pretrained(MODELO_BORRADOR, token=hf_token, local_files_only=local)
+                model = AutoModelForCausalLM.from_pretrained(MODELO_BORRADOR, token=hf_token, local_files_only=local,
+                                                             low_cpu_mem_usage=True, **opciones_precision())
+                model.eval()
+                TIEMPOS_CARGA["borrador"] = time.perf_counter() - t
+                # Si los tokenizers no coinciden, transformers traduce los candidatos entre
+                # vocabularios (más lento que con el mismo tokenizer). Se compara una sola vez:
+                # get_vocab() construye un dict con todo el vocabulario
+                if tokenizer.get_vocab() == _tokenizer.get_vocab():
+                    _opciones_borrador = {"assistant_model": model}
+                else:
+                    _opciones_borrador = {"assistant_model": model, "tokenizer": _tokenizer,
+                                          "assistant_tokenizer": tokenizer}
+                _tokenizer_borrador, _borrador = tokenizer, model
+    return _borrador, _tokenizer_borrador
+
+
+def opciones_asistidas() -> dict:
+    """Argumentos de generate() para la generación asistida con el borrador ({} si no hay)"""
+    obtener_borrador()
+    return _opciones_borrador
+
+
+def informe_carga() -> str:
+    total = sum(TIEMPOS_CARGA.values())
+    fases = ", ".join(f"{k}={v:.2f}s" for k, v in TIEMPOS_CARGA.items())
+    borrador = f", borrador {MODELO_BORRADOR}" if MODELO_BORRADOR else ""
+    return f"Carga de {modelo_a_cargar()} ({PRECISION}{borrador}): {total:.2f}s ({fases})"
+
+
+def __getattr__(nombre):
+    # Compatibilidad con `from model_loader import model, tokenizer` (carga al acceder)
+    if nombre == "model":
+        return obtener_modelo()[0]
+    if nombre == "tokenizer":
+        return obtener_modelo()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
 
 # print("Modelo cargado correctamente.")
@@ -0,0 +1,184 @@
+import os
+import sqlite3
+import threading
+import time
+from slot_loader import cargar_slots, tipo_sql
+import metricas
+
+# Base de datos de clientes: junto a este módulo salvo que se indique otra con CLIENTES_DB
+RUTA_CLIENTES = os.getenv("CLIENTES_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "clientes.db"))
+
+# Columnas propias del repositorio (además de una por slot)
+COLUMNAS_CONTROL = [("sesion_id", "TEXT"), ("actualizado", "REAL")]
+
+
+def tipo_columna(slot) -> str:
+    # Según el 'type' del slot: number -> REAL, boolean -> INTEGER (0/1), resto TEXT
+    return tipo_sql(slot)
+
+
+def valor_sql(valor):
+    # Convertir booleanos a 0/1
+    return 1 if valor is True else 0 if valor is False else valor
+
+
+# -------------------------------
+# Migraciones
+# -------------------------------
+# Cada migración se aplica una sola vez y deja PRAGMA user_version en su número.
+# Las columnas de los slots no van aquí: se añaden (nunca se borran) al abrir la base de datos.
+def _migracion_indices(conn):
+    # Un registro por DNI. Los duplicados anteriores no se borran: hay que resolverlos a mano
+    # (la migración falla sin cambiar nada y se vuelve a intentar al abrir la base de datos)
+    duplicados = [fila[0] for fila in conn.execute(
+        "SELECT dni_nie FROM clientes WHERE dni_nie IS NOT NULL GROUP BY dni_nie HAVING COUNT(*) > 1")]
+    if duplicados:
+        raise sqlite3.IntegrityError(
+            f"{len(duplicados)} DNI con varios registros en clientes (p. ej. {', '.join(duplicados[:5])}); "
+            "hay que fusionarlos antes de crear el índice único sobre dni_nie")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clientes_dni_nie ON clientes (dni_nie)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clientes_sesion ON clientes (sesion_id)")
+
+
+MIGRACIONES = [_migracion_indices]
+
+
+def migrar(conn: sqlite3.Connection, slots: list):
+    """Crea la tabla clientes si no existe, añade las columnas que falten y aplica las migraciones pendientes"""
+    columnas = [(s["name"], tipo_columna(s)) for s in slots] + COLUMNAS_CONTROL
+    with conn:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS clientes ({', '.join(f'{n} {t}' for n, t in columnas)})")
+        existentes = {fila[1] for fila in conn.execute("PRAGMA table_info(clientes)")}
+        for nombre, tipo in columnas:
+            if nombre not in existentes:
+                conn.execute(f"ALTER TABLE clientes ADD COLUMN {nombre} {tipo}")
+
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for numero, migracion in enumerate(MIGRACIONES[version:], start=version + 1):
+            migracion(conn)
+            conn.execute(f"PRAGMA user_version = {numero}")
+
+
+# -------------------------------
+# Consultas
+# -------------------------------
+@metricas.medido("sqlite_consulta")
+def buscar_por_dni(conn: sqlite3.Connection, dni_nie: str):
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    return c.execute("SELECT rowid, * FROM clientes WHERE dni_nie = ?", (dni_nie,)).fetchone()
+
+
+@metricas.medido("sqlite_consulta")
+def buscar_por_sesion(conn: sqlite3.Connection, sesion_id: str):
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    return c.execute(
+        "SELECT rowid, * FROM clientes WHERE sesion_id = ? ORDER BY actualizado DESC LIMIT 1", (sesion_id,)
+    ).fetchone()
+
+
+@metricas.medido("sqlite_consulta")
+def ultimo_cliente(conn: sqlite3.Connection):
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    return c.execute("SELECT rowid, * FROM clientes ORDER BY actualizado DESC, rowid DESC LIMIT 1").fetchone()
+
+
+class RepositorioClientes:
+    """
+    Acceso a la tabla clientes desde varias sesiones a la vez.
+    Cada hilo reutiliza su propia conexión (WAL: las lecturas no bloquean a la escritura).
+    El esquema se genera una vez a partir de los slots y se migra en lugar de recrearse;
+    los clientes se guardan con upsert sobre dni_nie.
+    """
+
+    def __init__(self, ruta: str = RUTA_CLIENTES, slots: list = None):
+        self.ruta = ruta
+        self._slots = slots
+        self._columnas = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def slots(self) -> list:
+        if self._slots is None:
+            self._slots, _ = cargar_slots()
+        return self._slots
+
+    def _asegurar_esquema(self):
+        """
+        Activa WAL y migra el esquema una sola vez, con una conexión propia y bajo el lock,
+        antes de que ningún hilo abra la suya (si no, un hilo puede preparar el upsert
+        mientras otro todavía está creando el índice único de dni_nie).
+        """
+        if self._columnas is not None:
+            return
+        with self._lock:
+            if self._columnas is None:
+                conn = sqlite3.connect(self.ruta, timeout=30)
+                try:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    migrar(conn, self.slots)
+                finally:
+                    conn.close()
+                self._columnas = [s["name"] for s in self.slots] + [n for n, _ in COLUMNAS_CONTROL]
+
+    def conexion(self) -> sqlite3.Connection:
+        """Conexión del hilo actual; la primera de todas migra antes el esquema"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self._asegurar_esquema()
+            conn = sqlite3.connect(self.ruta, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sql_upsert(self) -> str:
+        columnas = self._columnas
+        # En una actualización los slots que no vienen (NULL) conservan el valor guardado
+        actualizar = ", ".join(f"{c} = COALESCE(excluded.{c}, clientes.{c})" for c in columnas if c != "dni_nie")
+        return (f"INSERT INTO clientes ({', '.join(columnas)}) VALUES ({', '.join(['?'] * len(columnas))}) "
+                f"ON CONFLICT(dni_nie) DO UPDATE SET {actualizar}")
+
+    def _fila(self, form_data: dict, sesion_id: str, ahora: float) -> tuple:
+        control = {"sesion_id": sesion_id, "actualizado": ahora}
+        return tuple(valor_sql(form_data.get(c, control.get(c))) for c in self._columnas)
+
+    # -------------------------------
+    # Escritura
+    # -------------------------------
+    def guardar(self, form_data: dict, sesion_id: str = None):
+        """Inserta el cliente o actualiza el existente con el mismo dni_nie"""
+        self.guardar_lote([form_data], [sesion_id])
+
+    def guardar_lote(self, clientes: list, sesiones: list = None):
+        """Guarda varios clientes en una sola transacción"""
+        conn = self.conexion()
+        ahora = time.time()
+        sesiones = sesiones or [None] * len(clientes)
+        filas = [self._fila(f, s, ahora) for f, s in zip(clientes, sesiones)]
+        with metricas.span("sqlite_guardar"), conn:
+            conn.executemany(self._sql_upsert(), filas)
+        metricas.contador("clientes_guardados_total", len(filas))
+
+    # -------------------------------
+    # Lectura
+    # -------------------------------
+    def por_dni(self, dni_nie: str):
+        return buscar_por_dni(self.conexion(), dni_nie)
+
+    def por_sesion(self, sesion_id: str):
+        return buscar_por_sesion(self.conexion(), sesion_id)
+
+    def ultimo(self):
+        return ultimo_cliente(self.conexion())
+
+    def cerrar(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+clientes = RepositorioClientes()
@@ -0,0 +1,222 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict, Counter
+from functools import partial
+import numpy as np
+import inferencia
+from cache_llm import cache_llm
+from saludo_inicial import pool_saludos
+from repositorio import RepositorioClientes
+from banca_core import BancaCore
+from sesion import MotorSesiones
+
+DATOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "conversaciones_ejemplo.jsonl")
+
+# Etapa de cada trabajo que la sesión delega en el pool de hilos
+ETAPAS = {
+    "validar_con_modelo": "validacion",
+    "extraer_slots": "extraccion",
+    "guardar": "guardado",
+    "buscar": "banca_core",
+    "resultado": "simulacion"
+}
+
+# Sesión a la que se atribuyen las llamadas al LLM (se propaga a los hilos con el contexto)
+_sesion_actual = contextvars.ContextVar("sesion_actual", default=None)
+
+
+def cargar_conversaciones(ruta: str = DATOS) -> list:
+    """
+    Conversaciones grabadas: {"id": ..., "turnos": {pregunta: respuesta o [respuestas]}}.
+    La pregunta es un slot, 'texto_libre' o un paso del flujo (consentimientos); una lista
+    son respuestas sucesivas si la sesión vuelve a preguntar.
+    """
+    with open(ruta, "r", encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+# -------------------------------
+# Backends del LLM
+# -------------------------------
+class ContadorLLM:
+    """Envuelve un backend contando llamadas por sesión y su latencia"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.llamadas = Counter()
+        self.latencias = []
+        self._lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        t = time.perf_counter()
+        try:
+            return self.backend(**kwargs)
+        finally:
+            duracion = time.perf_counter() - t
+            with self._lock:
+                self.llamadas[_sesion_actual.get()] += 1
+                self.latencias.append(duracion)
+
+
+class LLMFalso:
+    """
+    LLM de pruebas sin modelo: en la validación de un slot devuelve la respuesta del cliente
+    tal cual, en la extracción múltiple un JSON vacío y en el resto un texto fijo.
+    `latencia` (segundos) simula el tiempo de generación.
+    """
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+
+    def __call__(self, mensajes=None, texto=None, **opciones):
+        if self.latencia:
+            time.sleep(self.latencia)
+        prompt = mensajes[-1]["content"] if mensajes else texto or ""
+        if "Mensaje del cliente:" in prompt:
+            return "{}"
+        respuesta = re.search(r"Respuesta del cliente:(.*)", prompt)
+        if respuesta:
+            return respuesta.group(1).strip()
+        return "Hola, soy tu asesor hipotecario."
+
+
+# -------------------------------
+# Motor instrumentado
+# -------------------------------
+class MotorMedido(MotorSesiones):
+    """MotorSesiones que mide cada trabajo delegado y cada turno, por etapa"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tiempos = defaultdict(list)
+
+    def medir(self, etapa: str, segundos: float):
+        self.tiempos[etapa].append(segundos)
+
+    async def ejecutar(self, funcion, *args):
+        loop = asyncio.get_running_loop()
+        contexto = contextvars.copy_context()
+        t = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, contexto.run, partial(funcion, *args))
+        finally:
+            nombre = getattr(funcion, "__name__", "otros")
+            self.medir(ETAPAS.get(nombre, nombre), time.perf_counter() - t)
+
+
+async def reproducir(motor: MotorMedido, conversacion: dict, sesion_id: str) -> dict:
+    """Reproduce una conversación hasta que la sesión termina o se queda sin respuestas"""
+    _sesion_actual.set(sesion_id)
+    pendientes = {k: list(v) if isinstance(v, list) else [v] for k, v in conversacion["turnos"].items()}
+    t_sesion = time.perf_counter()
+
+    t = time.perf_counter()
+    sesion_id, _ = await motor.abrir(sesion_id)
+    motor.medir("inicio", time.perf_counter() - t)
+    turnos = 0
+    while not motor.terminada(sesion_id):
+        pregunta = motor.esperando(sesion_id)
+        respuestas = pendientes.get(pregunta)
+        texto = respuestas.pop(0) if respuestas else "salir"
+        t = time.perf_counter()
+        await motor.mensaje(sesion_id, texto)
+        duracion = time.perf_counter() - t
+        motor.medir("turno", duracion)
+        etapa = pregunta if pregunta in ("consentimiento_tratamiento_datos", "request_consent_for_credit_checks",
+                                         "texto_libre") else "turno_slot"
+        motor.medir(f"turno:{etapa}", duracion)
+        turnos += 1
+
+    sesion = motor.cerrar(sesion_id)
+    motor.medir("sesion", time.perf_counter() - t_sesion)
+    return {"id": sesion_id, "conversacion": conversacion.get("id"), "turnos": turnos,
+            "completada": sesion.resultado is not None}
+
+
+async def prueba_carga(conversaciones: list, sesiones: int, concurrencia: int, motor: MotorMedido) -> list:
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una(i):
+        async with semaforo:
+            conversacion = conversaciones[i % len(conversaciones)]
+            return await reproducir(motor, conversacion, f"{conversacion.get('id', 'conv')}-{i}")
+
+    return await asyncio.gather(*[una(i) for i in range(sesiones)])
+
+
+def percentiles(valores) -> tuple:
+    ms = np.array(valores) * 1000
+    return tuple(float(np.percentile(ms, p)) for p in (50, 95, 99))
+
+
+def informe(resultados: list, motor: MotorMedido, contador: ContadorLLM, duracion: float) -> str:
+    lineas = [f"{'etapa':<44} {'n':>7} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}"]
+    tiempos = dict(motor.tiempos, llm=contador.latencias)
+    for etapa in sorted(tiempos):
+        if tiempos[etapa]:
+            p50, p95, p99 = percentiles(tiempos[etapa])
+            lineas.append(f"{etapa:<44} {len(tiempos[etapa]):>7} {p50:>10.2f} {p95:>10.2f} {p99:>10.2f}")
+
+    llamadas = np.array([contador.llamadas.get(r["id"], 0) for r in resultados])
+    completadas = sum(r["completada"] for r in resultados)
+    lineas += [
+        "",
+        f"Sesiones: {len(resultados)} ({completadas} completadas) en {duracion:.2f} s "
+        f"-> {len(resultados) / duracion if duracion else 0:.1f} sesiones/s",
+        f"Turnos por sesión: {np.mean([r['turnos'] for r in resultados]):.1f}",
+        f"Llamadas al LLM por sesión: media {llamadas.mean():.2f}, máx {llamadas.max()} "
+        f"(+{contador.llamadas.get(None, 0)} fuera de sesión)",
+        f"Caché LLM: {cache_llm.estadisticas()}"
+    ]
+    return "\n".join(lineas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce conversaciones grabadas sin teclado y mide la carga")
+    parser.add_argument("--datos", default=DATOS, help="JSONL de conversaciones")
+    parser.add_argument("--sesiones", type=int, default=None, help="Sesiones a lanzar (por defecto, una por conversación)")
+    parser.add_argument("--concurrencia", type=int, default=16, help="Sesiones simultáneas")
+    parser.add_argument("--hilos", type=int, default=8, help="Hilos para el trabajo bloqueante")
+    parser.add_argument("--backend", choices=["falso", "real"], default="falso",
+                        help="LLM falso (sin modelo) o el real (local o INFERENCIA_SERVIDOR)")
+    parser.add_argument("--latencia-llm", type=float, default=0.0, help="Milisegundos por llamada del LLM falso")
+    parser.add_argument("--sin-cache", action="store_true", help="Desactiva la caché de respuestas del LLM")
+    parser.add_argument("--db", default=None, help="Base de datos de clientes (por defecto, una temporal)")
+    args = parser.parse_args()
+
+    conversaciones = cargar_conversaciones(args.datos)
+    backend = LLMFalso(args.latencia_llm / 1000) if args.backend == "falso" else inferencia.generar_modelo
+    contador = ContadorLLM(backend)
+    inferencia.usar_backend(contador)
+    if args.sin_cache:
+        cache_llm.activa = False
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        if args.backend == "falso":
+            # Las respuestas falsas no deben acabar en la caché del LLM ni en el pool de saludos reales
+            cache_llm.ruta = os.path.join(carpeta, "cache_llm.db")
+            pool_saludos.ruta = os.path.join(carpeta, "saludos.json")
+        repositorio = RepositorioClientes(args.db or os.path.join(carpeta, "clientes.db"))
+        # Core bancario con las fichas de ejemplo, para que los clientes conocidos se pre-rellenen
+        banca = BancaCore(os.path.join(carpeta, "banca_core.db"))
+        motor = MotorMedido(max_hilos=args.hilos, repositorio=repositorio, banca=banca, saludo_en_vivo=False)
+        t = time.perf_counter()
+        resultados = asyncio.run(prueba_carga(conversaciones, args.sesiones or len(conversaciones),
+                                              args.concurrencia, motor))
+        duracion = time.perf_counter() - t
+        motor.executor.shutdown()
+        pool_saludos.esperar()
+        repositorio.cerrar()
+        banca.cerrar()
+    print(informe(resultados, motor, contador, duracion))
+
+
+if __name__ == "__main__":
+    main()
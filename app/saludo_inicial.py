@@ -1,29 +1,134 @@
-from model_loader import model, tokenizer
-import torch
-
-def saludo_inicial():
-    prompts = [
-        {"role": "system", "content": """
-            Trabajas en un banco y eres un asesor hipotecario experto.
-            Saluda al cliente y dile que quieres ayudarle a conseguir su hipoteca.
-            Dile que primero se han de hacer unas comprobaciones.
-            """},
-        {"role": "user", "content": "Hola, me gustaría comprar una casa pero necesito una hipoteca"}
-    ]
+import hashlib
+import json
+import os
+import random
+import threading
+from inferencia import generar, generar_stream
+from model_loader import id_modelo
+import metricas
 
+PROMPTS_SALUDO = [
+    {"role": "system", "content": """
+        Trabajas en un banco y eres un asesor hipotecario experto.
+        Saluda al cliente y dile que quieres ayudarle a conseguir su hipoteca.
+        Dile que primero se han de hacer unas comprobaciones.
+        """},
+    {"role": "user", "content": "Hola, me gustaría comprar una casa pero necesito una hipoteca"}
+]
+
+# Se usa mientras el pool está vacío (primera ejecución, modelo aún sin cargar)
+SALUDO_POR_DEFECTO = ("¡Hola! Soy tu asesor hipotecario y estaré encantado de ayudarte a conseguir tu hipoteca. "
+                      "Antes de empezar, tenemos que hacer unas comprobaciones.")
+
+# SALUDO_EN_VIVO=1 genera el saludo de cada sesión en el momento (en streaming) en lugar de usar el pool
+SALUDO_EN_VIVO = os.getenv("SALUDO_EN_VIVO") == "1"
+
+OPCIONES_SALUDO = {
+    "max_new_tokens": 50,
+    "do_sample": True,       # más rápido que greedy
+    "temperature": 0.3       # respuestas menos variadas
+}
+
+def texto_saludo():
     # Convertir prompts a texto simple para CPU
-    input_text = "\n".join([f"{p['role']}: {p['content']}" for p in prompts])
-    inputs = tokenizer(input_text, return_tensors="pt").to("cpu")  # fuerza CPU
+    return "\n".join([f"{p['role']}: {p['content']}" for p in PROMPTS_SALUDO])
+
+@metricas.medido("generar_saludo")
+def generar_saludo():
+    """Genera el texto del saludo inicial del agente"""
+    generated_text = generar(texto=texto_saludo(), **OPCIONES_SALUDO)
+    return generated_text.strip()
+
+def generar_saludo_stream():
+    """Genera el saludo devolviendo los trozos de texto según salen del modelo"""
+    return generar_stream(texto=texto_saludo(), **OPCIONES_SALUDO)
+
+
+class PoolSaludos:
+    """
+    Saludos ya generados y guardados en disco, para que una sesión nueva tenga el suyo al instante.
+    Si faltan saludos, o cada `refresco` usos, se genera uno nuevo en segundo plano que sustituye
+    al más antiguo: el pool se renueva sin que ninguna sesión espere al modelo.
+    Al cambiar el prompt o el modelo los saludos guardados se descartan.
+    """
+
+    def __init__(self, ruta: str = "saludos.json", tamano: int = 8, refresco: int = 4):
+        self.ruta = ruta
+        self.tamano = tamano
+        self.refresco = refresco
+        self._saludos = None
+        self._usos = 0
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def huella() -> str:
+        datos = json.dumps([id_modelo(), PROMPTS_SALUDO, OPCIONES_SALUDO], ensure_ascii=False)
+        return hashlib.sha256(datos.encode("utf-8")).hexdigest()[:16]
+
+    def _lista(self) -> list:
+        if self._saludos is None:
+            self._saludos = []
+            try:
+                with open(self.ruta, "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+                if datos.get("huella") == self.huella():
+                    self._saludos = list(datos.get("saludos", []))[-self.tamano:]
+            except (OSError, ValueError):
+                pass
+        return self._saludos
+
+    def _guardar(self):
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"huella": self.huella(), "saludos": self._saludos}, f, ensure_ascii=False, indent=2)
+        os.replace(temporal, self.ruta)
+
+    def obtener(self) -> str:
+        """Un saludo del pool (o el de por defecto si está vacío); nunca espera al modelo"""
+        with self._lock:
+            saludos = self._lista()
+            self._usos += 1
+            saludo = random.choice(saludos) if saludos else SALUDO_POR_DEFECTO
+            renovar = len(saludos) < self.tamano or self._usos % self.refresco == 0
+        metricas.contador("saludos_total", origen="pool" if saludos else "defecto")
+        if renovar:
+            self.rellenar_en_segundo_plano()
+        return saludo
+
+    def rellenar(self, cantidad: int = None):
+        """Genera `cantidad` saludos (por defecto los que falten, o uno si está lleno) y los guarda"""
+        with self._lock:
+            cantidad = cantidad or max(1, self.tamano - len(self._lista()))
+        for _ in range(cantidad):
+            saludo = generar_saludo()
+            if not saludo:
+                continue
+            with self._lock:
+                self._saludos.append(saludo)
+                del self._saludos[:-self.tamano]
+                self._guardar()
+
+    def rellenar_en_segundo_plano(self):
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._rellenar_seguro, daemon=True)
+            self._hilo.start()
+
+    def esperar(self, timeout: float = None):
+        """Espera a que termine la generación en segundo plano, si hay una en curso"""
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join(timeout)
 
-    with torch.no_grad():  # evita cálculos de gradiente, ahorra memoria
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=50,
-            do_sample=True,       # más rápido que greedy
-            temperature=0.3       # respuestas menos variadas
-        )
+    def _rellenar_seguro(self):
+        try:
+            self.rellenar()
+        except Exception as e:
+            print(f"Error al generar saludos: {e}")
 
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    print("Respuesta del agente:", generated_text)
 
-    return prompts
+pool_saludos = PoolSaludos(
+    ruta=os.getenv("SALUDOS_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "saludos.json"))
+)
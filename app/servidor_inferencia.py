@@ -0,0 +1,176 @@
+import argparse
+import os
+import queue
+import secrets
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from model_loader import obtener_modelo, informe_carga
+from inferencia import generar_lote, prefijo_en_cache
+
+# Las conexiones intercambian objetos pickle: quien conozca la clave puede ejecutar código en el
+# servidor. Sin INFERENCIA_CLAVE el servidor genera una aleatoria y la deja en RUTA_CLAVE (solo
+# legible por el usuario) para los clientes de la misma máquina; fuera de localhost es obligatoria.
+RUTA_CLAVE = os.getenv("INFERENCIA_CLAVE_FICHERO",
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), ".inferencia_clave"))
+HOSTS_LOCALES = ("127.0.0.1", "localhost", "::1")
+PARAMETROS = ("max_new_tokens", "do_sample", "temperature", "parada", "permitidos")
+
+
+def clave_servidor(host: str) -> bytes:
+    """Clave de INFERENCIA_CLAVE o, solo escuchando en localhost, una aleatoria guardada en RUTA_CLAVE"""
+    clave = os.getenv("INFERENCIA_CLAVE")
+    if clave:
+        return clave.encode("utf-8")
+    if host not in HOSTS_LOCALES:
+        raise ValueError(f"Para escuchar en {host} hay que definir INFERENCIA_CLAVE")
+    clave = secrets.token_hex(32)
+    fd = os.open(RUTA_CLAVE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(clave)
+    return clave.encode("utf-8")
+
+
+def clave_cliente() -> bytes:
+    """Clave de INFERENCIA_CLAVE o la que dejó en RUTA_CLAVE un servidor local"""
+    clave = os.getenv("INFERENCIA_CLAVE")
+    if clave:
+        return clave.encode("utf-8")
+    try:
+        with open(RUTA_CLAVE, "r") as f:
+            return f.read().strip().encode("utf-8")
+    except FileNotFoundError:
+        raise RuntimeError(f"Sin INFERENCIA_CLAVE ni clave de un servidor local en {RUTA_CLAVE}") from None
+
+
+class ServidorInferencia:
+    """
+    Proceso que carga el modelo una sola vez y atiende peticiones de generación
+    de varias sesiones por un socket local. Las peticiones que llegan a la vez se
+    agrupan en lotes (hasta `max_lote`, esperando como mucho `espera_max` segundos
+    desde la primera) y se generan en una sola pasada del modelo.
+    """
+
+    def __init__(self, direccion=("127.0.0.1", 6010), clave: bytes = None, max_lote: int = 8,
+                 espera_max: float = 0.02):
+        self.direccion = direccion
+        self.clave = clave or clave_servidor(direccion[0])
+        self.max_lote = max_lote
+        self.espera_max = espera_max
+        self._cola = queue.Queue()
+        self.lotes = 0
+        self.peticiones = 0
+
+    def iniciar(self):
+        obtener_modelo()
+        print(informe_carga())
+        threading.Thread(target=self._bucle_lotes, daemon=True).start()
+        with Listener(self.direccion, backlog=64, authkey=self.clave) as listener:
+            print(f"Servidor de inferencia escuchando en {self.direccion[0]}:{self.direccion[1]}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (EOFError, OSError, ConnectionError, AuthenticationError) as e:
+                    # Cliente que se desconecta o falla la autenticación: no debe tumbar el servidor
+                    print(f"Conexión rechazada: {e!r}")
+                    continue
+                threading.Thread(target=self._atender, args=(conn,), daemon=True).start()
+
+    def _atender(self, conn):
+        """Lee las peticiones de una conexión y las deja en la cola de lotes"""
+        lock_envio = threading.Lock()
+        try:
+            while True:
+                peticion = conn.recv()
+                self._cola.put((peticion, conn, lock_envio))
+        except (EOFError, OSError):
+            conn.close()
+
+    def _siguiente_lote(self) -> list:
+        lote = [self._cola.get()]
+        limite = time.monotonic() + self.espera_max
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle_lotes(self):
+        while True:
+            lote = self._siguiente_lote()
+            # Solo comparten pasada las peticiones con los mismos parámetros de generación.
+            # Las que traen un prefijo con el KV-cache ya calculado van solas (solo procesan la
+            # respuesta); el resto, con prefijo o sin él, se agrupan en lotes.
+            grupos = {}
+            for i, item in enumerate(lote):
+                parametros = tuple(item[0].get(p) for p in PARAMETROS)
+                aislada = item[0].get("prefijo") and prefijo_en_cache(item[0].get("mensajes"), item[0]["prefijo"])
+                grupos.setdefault(parametros + ((i,) if aislada else ()), []).append(item)
+            for parametros, items in grupos.items():
+                try:
+                    textos = generar_lote([item[0] for item in items], **dict(zip(PARAMETROS, parametros)))
+                    respuestas = [{"id": item[0].get("id"), "texto": t} for item, t in zip(items, textos)]
+                except Exception as e:
+                    respuestas = [{"id": item[0].get("id"), "error": str(e)} for item in items]
+                for (_, conn, lock_envio), respuesta in zip(items, respuestas):
+                    try:
+                        with lock_envio:
+                            conn.send(respuesta)
+                    except OSError:
+                        pass
+                self.lotes += 1
+                self.peticiones += len(items)
+
+
+class ClienteInferencia:
+    """Cliente ligero del servidor de inferencia; cada hilo usa su propia conexión"""
+
+    def __init__(self, direccion=("127.0.0.1", 6010), clave: bytes = None):
+        self.direccion = direccion
+        self.clave = clave or clave_cliente()
+        self._local = threading.local()
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.direccion, authkey=self.clave)
+        return conn
+
+    def generar(self, mensajes=None, texto=None, max_new_tokens: int = 50, do_sample: bool = False,
+                temperature: float = None, prefijo: str = None, parada: str = None, permitidos: str = None) -> str:
+        conn = self._conexion()
+        conn.send({
+            "id": threading.get_ident(),
+            "mensajes": mensajes,
+            "texto": texto,
+            "max_new_tokens": max_new_tokens,
+            "do_sample": do_sample,
+            "temperature": temperature,
+            "prefijo": prefijo,
+            "parada": parada,
+            "permitidos": permitidos
+        })
+        respuesta = conn.recv()
+        if "error" in respuesta:
+            raise RuntimeError(respuesta["error"])
+        return respuesta["texto"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de inferencia con lotes dinámicos")
+    parser.add_argument("--host", default="127.0.0.1", help="Fuera de localhost exige INFERENCIA_CLAVE")
+    parser.add_argument("--puerto", type=int, default=6010)
+    parser.add_argument("--max-lote", type=int, default=8, help="Peticiones máximas por pasada del modelo")
+    parser.add_argument("--espera-ms", type=float, default=20, help="Espera máxima para completar un lote")
+    args = parser.parse_args()
+    ServidorInferencia((args.host, args.puerto), max_lote=args.max_lote, espera_max=args.espera_ms / 1000).iniciar()
+
+
+if __name__ == "__main__":
+    main()
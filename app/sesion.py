@@ -0,0 +1,439 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from slot_loader import cargar_esquema
+from gdpr import interpretar_consentimiento, MENSAJE_GDPR, MENSAJE_ACEPTADO, MENSAJE_RECHAZADO, MENSAJE_REPETIR
+from morosidad import MENSAJE_MOROSOS
+from saludo_inicial import PROMPTS_SALUDO, SALUDO_EN_VIVO, pool_saludos, generar_saludo_stream
+from repositorio import clientes
+from banca_core import banca_core
+from validations import validar_con_modelo, extraer_slots
+from simulacion_incremental import SimulacionIncremental, interpretar_cambio
+import metricas
+
+PALABRAS_SALIR = ["salir", "exit", "quit"]
+PREGUNTA_CONSENTIMIENTO = "¿Aceptas? (sí/no)"
+PREGUNTA_DNI_CLIENTE = "Como ya eres cliente, con tu DNI/NIE puedo recuperar los datos que tenemos de ti."
+PREGUNTA_IDENTIDAD = "Antes de usar esos datos necesito comprobar que eres tú."
+MENSAJE_NO_VERIFICADO = "No he podido comprobar tu identidad, así que te pediré los datos."
+PREGUNTA_CONFIRMAR = "¿Son correctos? (sí/no)"
+PROMPT_INICIAL = ("Cuéntame lo que quieras sobre ti y la vivienda que buscas "
+                  "(nombre, DNI, precio, entrada, ingresos...). Después te pregunto lo que falte.")
+OPCIONES_RESULTADOS = ("Si quieres cambiar algún dato, dímelo (p. ej. '¿y si pongo 10.000 € más de entrada?' "
+                       "o 'ingresos 3500') y lo recalculo. Escribe 'salir' para terminar.")
+
+# Pasos previos al flujo del JSON: saludo y consentimiento para tratar los datos (GDPR)
+PASOS_PREVIOS = ["saludo", "consentimiento_tratamiento_datos"]
+# Dato que se pide para comprobar la identidad antes de leer la ficha del cliente
+SLOT_VERIFICACION = "fecha_nacimiento"
+
+
+@metricas.medido("formatear_resultados")
+def formatear_resultados(resultado, tablas_mensuales: bool = False) -> str:
+    """Texto con los resultados principales y las tablas de amortización anuales"""
+    lineas = [
+        "Resultados de la hipoteca:",
+        f"Cliente: {resultado['cliente']} ({resultado['dni_nie']})",
+        f"Importe a financiar: {resultado['importe_financiar']:.2f} €",
+        f"Cuota mensual tipo variable ({resultado['tasa_variable']:.2f}%): {resultado['cuota_variable']:.2f} €",
+        f"Cuota mensual tipo fijo ({resultado['tasa_fija']:.2f}%): {resultado['cuota_fija']:.2f} €"
+    ]
+    for tipo, resumen in [("Variable", resultado["resumen_variable"]), ("Fijo", resultado["resumen_fijo"])]:
+        lineas.append(f"\nTabla de amortización anual ({tipo}):")
+        lineas.append(resumen.to_string(index=False, float_format="{:.2f}".format))
+    if tablas_mensuales:
+        for tipo, clave in [("Variable", "tabla_variable"), ("Fijo", "tabla_fija")]:
+            lineas.append(f"\nTabla de amortización mensual ({tipo}):")
+            lineas.append(resultado[clave].to_string(index=False, float_format="{:.2f}".format))
+    return "\n".join(lineas)
+
+
+def formatear_cambio(slot: str, valor, resultado) -> str:
+    """Resumen corto tras un cambio: sin tablas, para responder al momento"""
+    return (f"Con {slot} = {valor:.2f}: importe a financiar {resultado['importe_financiar']:.2f} €, "
+            f"cuota variable {resultado['cuota_variable']:.2f} € a {resultado['plazo_variable']} años, "
+            f"cuota fija {resultado['cuota_fija']:.2f} € a {resultado['plazo_fijo']} años.")
+
+
+def enmascarar(valor) -> str:
+    """
+    Versión parcial de un dato personal para confirmarlo sin mostrarlo:
+    '***@gmail.com', '6** *** *78', 'A** G**** R***'; importes y fechas, '***'.
+    """
+    texto = str(valor)
+    if "@" in texto:
+        return "***@" + texto.rsplit("@", 1)[1]
+    if not isinstance(valor, str) or not any(c.isalpha() for c in texto):
+        digitos = "".join(c for c in texto if c.isdigit())
+        if isinstance(valor, str) and len(digitos) >= 9:
+            oculto = digitos[0] + "*" * (len(digitos) - 3) + digitos[-2:]
+            return " ".join(oculto[i:i + 3] for i in range(0, len(oculto), 3))
+        return "***"
+    return " ".join(p[0] + "*" * (len(p) - 1) for p in texto.split())
+
+
+class SesionHipoteca:
+    """
+    Una conversación con un cliente como máquina de estados.
+    Sigue los pasos de flows.default.steps de slots_basicos.json (precedidos del saludo
+    y del consentimiento GDPR). Cada paso o bien termina solo, o bien deja una pregunta
+    y espera el siguiente mensaje del cliente.
+    Las llamadas bloqueantes (LLM, SQLite) se delegan en `ejecutar`; los datos se guardan
+    en `repositorio` asociados al id de la sesión.
+    A los clientes del banco se les rellenan los slots con pre_fill_if_client_data desde
+    `banca` (buscando por DNI, después de comprobar su fecha de nacimiento) y los slots
+    con auto_compute se calculan en vez de preguntarse, así que al LLM solo llegan los
+    datos que faltan.
+    El saludo sale del pool de saludos pregenerados; con `saludo_en_vivo` se genera en el
+    momento y se envía por trozos a `emitir` (callable que recibe cada trozo de texto).
+    """
+
+    def __init__(self, sesion_id: str, slots: list, pasos: list, ejecutar, extraccion_multiple: bool = True,
+                 tablas_mensuales: bool = False, repositorio=clientes, saludo_en_vivo: bool = SALUDO_EN_VIVO,
+                 emitir=None, banca=banca_core, esquema=None):
+        self.id = sesion_id
+        self.slots = slots
+        self.esquema = esquema or cargar_esquema()
+        self.pasos = PASOS_PREVIOS + list(pasos)
+        self.ejecutar = ejecutar
+        self.extraccion_multiple = extraccion_multiple
+        self.tablas_mensuales = tablas_mensuales
+        self.repositorio = repositorio
+        self.banca = banca
+        self.saludo_en_vivo = saludo_en_vivo
+        self.emitir = emitir
+
+        self.indice = 0
+        self.form_data = {}
+        self.prompts = [dict(p) for p in PROMPTS_SALUDO]
+        self.pre_rellenados = {}
+        self.resultado = None
+        self.simulacion = None
+        self.terminada = False
+        self.aceptada = None
+        self._slot_actual = None
+        self._texto_libre_pedido = False
+        self._dni_pedido = False
+        self._identidad_pedida = False
+        self._tarea_saludo = None
+        self._resultados_mostrados = False
+
+    @property
+    def paso(self):
+        return self.pasos[self.indice] if self.indice < len(self.pasos) else None
+
+    def esperando(self):
+        """Qué se le ha preguntado al cliente: un slot, 'texto_libre' o el nombre del paso (None si terminó)"""
+        if self.terminada:
+            return None
+        if self.paso in ("cliente_es_cliente_banco", "pre_fill_client_data_if_any", "collect_missing_slots_in_order"):
+            return self._slot_actual["name"] if self._slot_actual else "texto_libre"
+        return self.paso
+
+    # -------------------------------
+    # API de mensajes
+    # -------------------------------
+    async def iniciar(self) -> list:
+        salida = []
+        await self._avanzar(salida)
+        return salida
+
+    async def recibir(self, texto: str) -> list:
+        """Procesa un mensaje del cliente y devuelve los mensajes del agente"""
+        if self.terminada:
+            return []
+        if texto.strip().lower() in PALABRAS_SALIR:
+            self.terminada = True
+            return ["¡Hasta pronto!"]
+        salida = []
+        responder = getattr(self, f"_responder_{self.paso}")
+        if await responder(texto, salida):
+            self.indice += 1
+        await self._avanzar(salida)
+        return salida
+
+    async def _avanzar(self, salida: list):
+        """Ejecuta pasos hasta que uno necesita una respuesta del cliente o se acaba el flujo"""
+        while not self.terminada and self.paso is not None:
+            paso = getattr(self, f"_paso_{self.paso}", None)
+            if paso is not None and await paso(salida):
+                return
+            self.indice += 1
+        self.terminada = True
+
+    # -------------------------------
+    # Pasos
+    # -------------------------------
+    async def _paso_saludo(self, salida):
+        if self.saludo_en_vivo and self.emitir is not None:
+            # El saludo se va emitiendo mientras se piden los consentimientos, sin bloquearlos
+            self._tarea_saludo = asyncio.ensure_future(self._saludo_en_vivo())
+        else:
+            salida.append(pool_saludos.obtener())
+        return False
+
+    async def _saludo_en_vivo(self):
+        loop = asyncio.get_running_loop()
+
+        def emitir_trozos():
+            for trozo in generar_saludo_stream():
+                loop.call_soon_threadsafe(self.emitir, trozo)
+            loop.call_soon_threadsafe(self.emitir, "\n")
+
+        try:
+            await self.ejecutar(emitir_trozos)
+        except Exception as e:
+            print(f"Error al generar el saludo: {e}")
+
+    async def _paso_consentimiento_tratamiento_datos(self, salida):
+        salida.extend([MENSAJE_GDPR, PREGUNTA_CONSENTIMIENTO])
+        return True
+
+    async def _responder_consentimiento_tratamiento_datos(self, texto, salida):
+        return self._consentimiento(texto, salida)
+
+    async def _paso_cliente_es_cliente_banco(self, salida):
+        self._slot_actual = self._slot("cliente_es_cliente_banco")
+        salida.append(self._slot_actual["prompt"])
+        return True
+
+    async def _responder_cliente_es_cliente_banco(self, texto, salida):
+        return await self._rellenar_slot(texto, salida)
+
+    async def _paso_pre_fill_client_data_if_any(self, salida):
+        if self.form_data.get("cliente_es_cliente_banco") is not True or self.banca is None:
+            return False
+        if "dni_nie" not in self.form_data:
+            # La ficha del cliente se busca por DNI: se pide antes que el resto de datos
+            self._slot_actual = self._slot("dni_nie")
+            # En un reintento _rellenar_slot ya ha repetido la pregunta
+            if not self._dni_pedido:
+                self._dni_pedido = True
+                salida.extend([PREGUNTA_DNI_CLIENTE, self._slot_actual["prompt"]])
+            return True
+        if SLOT_VERIFICACION not in self.form_data:
+            # Sin comprobar la identidad no se usa nada de la ficha: se pide el dato aunque
+            # el DNI no sea de un cliente, para no revelar qué DNI están en el banco
+            self._slot_actual = self._slot(SLOT_VERIFICACION)
+            if not self._identidad_pedida:
+                self._identidad_pedida = True
+                salida.extend([PREGUNTA_IDENTIDAD, self._slot_actual["prompt"]])
+            return True
+        self._slot_actual = None
+        ficha = await self.ejecutar(self.banca.buscar, self.form_data["dni_nie"])
+        ficha = self.esquema.pre_rellenar(ficha) if ficha is not None else {}
+        verificado = ficha.get(SLOT_VERIFICACION) == self.form_data[SLOT_VERIFICACION]
+        metricas.contador("verificaciones_identidad_total", resultado="ok" if verificado else "fallo")
+        if not verificado:
+            # Un solo intento: sin límite se podría adivinar la fecha de cualquier DNI
+            salida.append(MENSAJE_NO_VERIFICADO)
+            return False
+        for nombre, valor in ficha.items():
+            if nombre not in self.form_data:
+                self._anotar(nombre, valor)
+                self.pre_rellenados[nombre] = valor
+        metricas.contador("slots_pre_rellenados_total", len(self.pre_rellenados))
+        return False
+
+    async def _responder_pre_fill_client_data_if_any(self, texto, salida):
+        # Con el DNI y el dato de verificación anotados el paso se repite y hace la búsqueda
+        await self._rellenar_slot(texto, salida)
+        return False
+
+    async def _paso_confirm_pre_filled_items(self, salida):
+        if not self.pre_rellenados:
+            return False
+        # Los datos de la ficha no se leen en claro: solo se enseñan enmascarados
+        salida.append("Tengo estos datos tuyos: " + ", ".join(f"{k} = {enmascarar(v)}"
+                                                               for k, v in self.pre_rellenados.items()))
+        salida.append(PREGUNTA_CONFIRMAR)
+        return True
+
+    async def _responder_confirm_pre_filled_items(self, texto, salida):
+        respuesta = interpretar_consentimiento(texto)
+        if respuesta is None:
+            salida.append(PREGUNTA_CONFIRMAR)
+            return False
+        if respuesta is False:
+            # Se descartan y se preguntan como al resto de clientes
+            for nombre in self.pre_rellenados:
+                self.form_data.pop(nombre, None)
+            self.pre_rellenados = {}
+            salida.append("De acuerdo, te pediré esos datos.")
+        return True
+
+    async def _paso_collect_missing_slots_in_order(self, salida):
+        if self.extraccion_multiple and not self._texto_libre_pedido and self._pendientes_extraccion():
+            self._texto_libre_pedido = True
+            self._slot_actual = None
+            salida.append(PROMPT_INICIAL)
+            return True
+        pendientes = self.esquema.pendientes(self.form_data, self.slots)
+        if not pendientes:
+            return False
+        self._slot_actual = pendientes[0]
+        salida.append(self._slot_actual["prompt"])
+        return True
+
+    async def _responder_collect_missing_slots_in_order(self, texto, salida):
+        if self._slot_actual is None:
+            extraidos = await self.ejecutar(extraer_slots, self._pendientes_extraccion(), texto, self.form_data)
+            for nombre, valor in extraidos.items():
+                self._anotar(nombre, valor)
+            if extraidos:
+                salida.append("Perfecto, he anotado: " + ", ".join(f"{k} = {v}" for k, v in extraidos.items()))
+        else:
+            await self._rellenar_slot(texto, salida)
+        # El paso se repite hasta que no queden slots por preguntar
+        return False
+
+    async def _paso_validate_slots(self, salida):
+        faltan = [s["name"] for s in self.slots if s.get("required") and s["name"] not in self.form_data]
+        if faltan:
+            salida.append("Faltan datos obligatorios: " + ", ".join(faltan))
+            self.terminada = True
+        return False
+
+    async def _paso_request_consent_for_credit_checks(self, salida):
+        salida.extend([MENSAJE_MOROSOS, PREGUNTA_CONSENTIMIENTO])
+        return True
+
+    async def _responder_request_consent_for_credit_checks(self, texto, salida):
+        return self._consentimiento(texto, salida)
+
+    async def _paso_invoke_credit_checks_and_kcy(self, salida):
+        # Sin integración con CIRBE/ASNEF ni KYC en este entorno
+        return False
+
+    async def _paso_compute_simulation(self, salida):
+        await self.ejecutar(self.repositorio.guardar, dict(self.form_data), self.id)
+        salida.append("Datos guardados correctamente en la base de datos.")
+        # Se conserva el grafo de la simulación: los cambios posteriores solo recalculan lo afectado
+        self.simulacion = SimulacionIncremental(self.form_data, self.esquema)
+        self.resultado = await self.ejecutar(self.simulacion.resultado, self.tablas_mensuales)
+        return False
+
+    async def _paso_show_results_and_options(self, salida):
+        # El paso se repite tras cada cambio, pero los resultados completos solo se muestran una vez
+        if not self._resultados_mostrados:
+            self._resultados_mostrados = True
+            salida.append(formatear_resultados(self.resultado, self.tablas_mensuales))
+            salida.append(OPCIONES_RESULTADOS)
+        return True
+
+    async def _responder_show_results_and_options(self, texto, salida):
+        cambio = interpretar_cambio(texto, self.form_data)
+        if cambio is None:
+            salida.append(OPCIONES_RESULTADOS)
+            return False
+        nombre, valor = cambio
+        valor_limpio = self.esquema.validador(self._slot(nombre))(str(valor), self.form_data)
+        if valor_limpio is None or not isinstance(valor_limpio, float):
+            salida.append(f"Ese valor no es válido para {nombre}.")
+            return False
+        self.form_data[nombre] = valor_limpio
+        cambios = {nombre: valor_limpio}
+        cambios.update(self.esquema.calcular(self.form_data, sobrescribir=True))
+        self.form_data.update(cambios)
+        self.simulacion.cambiar(**{k: v for k, v in cambios.items() if k in self.simulacion.entradas})
+        self.resultado = self.simulacion.resultado(self.tablas_mensuales)
+        metricas.contador("cambios_simulacion_total", slot=nombre)
+        salida.append(formatear_cambio(nombre, valor_limpio, self.resultado))
+        # Solo se actualizan los campos cambiados (el upsert conserva el resto)
+        await self.ejecutar(self.repositorio.guardar, dict(cambios, dni_nie=self.form_data.get("dni_nie")), self.id)
+        return False
+
+    # -------------------------------
+    # Auxiliares
+    # -------------------------------
+    def _slot(self, nombre):
+        return next(s for s in self.slots if s["name"] == nombre)
+
+    def _pendientes_extraccion(self) -> list:
+        # Al texto libre solo se le piden los datos que faltan y no se pueden calcular
+        return [s for s in self.esquema.pendientes(self.form_data, self.slots)
+                if s["name"] not in self.esquema.calculados]
+
+    def _anotar(self, nombre, valor):
+        self.form_data[nombre] = valor
+        self.prompts.append({"role": "user", "content": f"{nombre}: {valor}"})
+        # Los slots con auto_compute se calculan en cuanto están sus dependencias
+        for calculado, valor_calculado in self.esquema.calcular(self.form_data).items():
+            self.form_data[calculado] = valor_calculado
+            self.prompts.append({"role": "user", "content": f"{calculado}: {valor_calculado}"})
+            metricas.contador("slots_calculados_total", slot=calculado)
+
+    async def _rellenar_slot(self, texto, salida):
+        slot = self._slot_actual
+        valor_limpio = await self.ejecutar(validar_con_modelo, slot, texto, dict(self.form_data))
+        if valor_limpio is None:
+            metricas.contador("reintentos_slot_total", slot=slot["name"])
+            salida.append(f"No entendí tu respuesta para {slot['name']}, inténtalo de nuevo.")
+            salida.append(slot["prompt"])
+            return False
+        self._anotar(slot["name"], valor_limpio)
+        return True
+
+    def _consentimiento(self, texto, salida):
+        respuesta = interpretar_consentimiento(texto)
+        if respuesta is True:
+            salida.append(MENSAJE_ACEPTADO)
+            return True
+        if respuesta is False:
+            salida.append(MENSAJE_RECHAZADO)
+            self.aceptada = False
+            self.terminada = True
+            return False
+        salida.extend([MENSAJE_REPETIR, PREGUNTA_CONSENTIMIENTO])
+        return False
+
+
+class MotorSesiones:
+    """
+    Gestiona muchas sesiones en un mismo bucle asyncio con una API mensaje-entrada /
+    mensajes-salida. El trabajo bloqueante (LLM, SQLite, cálculo) va a un pool de hilos,
+    o al servidor de inferencia si INFERENCIA_SERVIDOR está definido.
+    """
+
+    def __init__(self, executor=None, max_hilos: int = 4, **opciones_sesion):
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_hilos, thread_name_prefix="sesion")
+        self.opciones_sesion = opciones_sesion
+        self.sesiones = {}
+        self._locks = {}
+
+    async def ejecutar(self, funcion, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(funcion, *args))
+
+    async def abrir(self, sesion_id: str = None, emitir=None):
+        """
+        Crea una sesión y devuelve (sesion_id, mensajes iniciales del agente).
+        `emitir` recibe el texto que se genera en streaming (saludo en vivo).
+        """
+        sesion_id = sesion_id or uuid.uuid4().hex
+        # Esquema compilado y compartido: abrir una sesión no vuelve a leer el JSON
+        esquema = cargar_esquema()
+        sesion = SesionHipoteca(sesion_id, esquema.slots, esquema.flujo(), self.ejecutar, emitir=emitir, esquema=esquema,
+                                **self.opciones_sesion)
+        self.sesiones[sesion_id] = sesion
+        self._locks[sesion_id] = asyncio.Lock()
+        async with self._locks[sesion_id]:
+            return sesion_id, await sesion.iniciar()
+
+    async def mensaje(self, sesion_id: str, texto: str) -> list:
+        """Entrega un mensaje del cliente a su sesión; los mensajes de una sesión se procesan en orden"""
+        async with self._locks[sesion_id]:
+            with metricas.span("turno"):
+                return await self.sesiones[sesion_id].recibir(texto)
+
+    def terminada(self, sesion_id: str) -> bool:
+        return self.sesiones[sesion_id].terminada
+
+    def esperando(self, sesion_id: str):
+        return self.sesiones[sesion_id].esperando()
+
+    def cerrar(self, sesion_id: str):
+        self._locks.pop(sesion_id, None)
+        return self.sesiones.pop(sesion_id, None)
+
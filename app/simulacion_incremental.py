@@ -0,0 +1,240 @@
+import re
+import time
+from collections import Counter
+from datetime import date
+from calculo_hipoteca import (EURIBOR_ACTUAL, TASA_FIJA, ResultadoHipoteca, parse_float, cuota_mensual, calcular_plazo,
+                              diferencial_por_riesgo, cuota_maxima, resumen_anual, generar_tabla_amortizacion,
+                              simular_hipoteca)
+from slot_loader import cargar_esquema
+from validadores import normalizar, parsear_numero_es, NO_DECIDIDO
+import metricas
+
+# Palabras con las que el cliente se refiere a cada dato al corregirlo ("¿y si pongo 10k más de entrada?")
+PALABRAS_CAMBIO = {
+    "entrada": ("entrada", "aportacion", "ahorros"),
+    "precio_vivienda": ("precio", "vivienda", "casa", "piso"),
+    "ingresos_netos_mensuales": ("ingresos", "nomina", "sueldo", "salario", "cobro", "gano"),
+    "gastos_mensuales_est": ("gastos", "deudas", "prestamos")
+}
+
+
+def _iguales(a, b) -> bool:
+    # Los escalares se comparan por valor (si no cambian, sus dependientes no se recalculan);
+    # los objetos (DataFrames) siempre cuentan como cambiados
+    if isinstance(a, (int, float, str, date, type(None))) and type(a) is type(b):
+        return a == b
+    return a is b
+
+
+class SimulacionIncremental:
+    """
+    Simulación de hipoteca como grafo de dependencias: los slots del cliente son las entradas
+    y cada magnitud derivada (importe, diferencial, cuota máxima, plazos, cuotas, resúmenes y
+    tablas) un nodo que se calcula al pedirlo y se guarda.
+    Al cambiar una entrada solo se recalculan los nodos que dependen de ella, y de esos solo
+    los que ven cambiar alguna dependencia (si la cuota máxima cambia pero el plazo no, las
+    tablas del plazo se reutilizan). Las tablas y resúmenes no se calculan hasta que se piden.
+    """
+
+    def __init__(self, datos: dict, esquema=None, fecha_inicio: date = None):
+        self.esquema = esquema or cargar_esquema()
+        self._nodos = {}       # nombre -> (funcion, dependencias)
+        self._valores = {}
+        self._versiones = {}   # sube cada vez que el valor de un nodo o entrada cambia
+        self._vistas = {}      # versiones de las dependencias con las que se calculó cada nodo
+        self._revisado = {}    # época en la que se comprobó por última vez cada nodo
+        self._epoca = 0
+        self.recalculos = Counter()
+
+        self.entradas = {s["name"] for s in self.esquema.slots if s["name"] not in self.esquema.calculados}
+        self.entradas.add("fecha_inicio")
+        for nombre in self.entradas:
+            self._valores[nombre] = datos.get(nombre) if nombre in datos.keys() else None
+            self._versiones[nombre] = 0
+        self._valores["fecha_inicio"] = fecha_inicio or date.today()
+
+        # Slots con auto_compute (importe_a_financiar = precio_vivienda - entrada)
+        for nombre in self.esquema.orden_calculo:
+            self._definir(nombre, self._calculado(nombre), self.esquema.calculados[nombre].dependencias)
+
+        self._definir("importe_financiar", parse_float, ["importe_a_financiar"])
+        self._definir("ingresos", parse_float, ["ingresos_netos_mensuales"])
+        self._definir("gastos", parse_float, ["gastos_mensuales_est"])
+        self._definir("diferencial", lambda i, g: float(diferencial_por_riesgo(i, g)), ["ingresos", "gastos"])
+        self._definir("tasa_variable", lambda d: EURIBOR_ACTUAL + d, ["diferencial"])
+        self._definir("tasa_fija", lambda: TASA_FIJA, [])
+        self._definir("cuota_max", lambda i, g: float(cuota_maxima(i, g)), ["ingresos", "gastos"])
+        for tipo, tasa in [("variable", "tasa_variable"), ("fijo", "tasa_fija")]:
+            plazo = f"plazo_{tipo}"
+            cuota = "cuota_variable" if tipo == "variable" else "cuota_fija"
+            tabla = "tabla_variable" if tipo == "variable" else "tabla_fija"
+            self._definir(plazo, calcular_plazo, ["importe_financiar", "cuota_max", tasa])
+            self._definir(cuota, cuota_mensual, ["importe_financiar", tasa, plazo])
+            self._definir(f"resumen_{tipo}", resumen_anual, ["importe_financiar", tasa, plazo, "fecha_inicio"])
+            self._definir(tabla, generar_tabla_amortizacion, ["importe_financiar", tasa, plazo, "fecha_inicio"])
+
+    def _definir(self, nombre: str, funcion, dependencias: list):
+        self._nodos[nombre] = (funcion, tuple(dependencias))
+
+    def _calculado(self, nombre: str):
+        expresion = self.esquema.calculados[nombre]
+
+        def calcular(*valores):
+            datos = dict(zip(expresion.dependencias, valores))
+            if any(v is None for v in valores):
+                return None
+            try:
+                return expresion(datos)
+            except (TypeError, ValueError, ZeroDivisionError):
+                return None
+        return calcular
+
+    # -------------------------------
+    # Grafo
+    # -------------------------------
+    def obtener(self, nombre: str):
+        """Valor de una entrada o de un nodo; solo se recalcula si alguna dependencia ha cambiado"""
+        if nombre in self.entradas:
+            return self._valores[nombre]
+        if self._revisado.get(nombre) == self._epoca:
+            return self._valores[nombre]
+        funcion, dependencias = self._nodos[nombre]
+        valores = [self.obtener(d) for d in dependencias]
+        vistas = tuple(self._versiones[d] for d in dependencias)
+        if self._vistas.get(nombre) != vistas:
+            valor = funcion(*valores)
+            self.recalculos[nombre] += 1
+            if nombre not in self._valores or not _iguales(valor, self._valores[nombre]):
+                self._versiones[nombre] = self._versiones.get(nombre, 0) + 1
+                self._valores[nombre] = valor
+            self._vistas[nombre] = vistas
+        self._revisado[nombre] = self._epoca
+        return self._valores[nombre]
+
+    def cambiar(self, **valores):
+        """Cambia una o varias entradas (slots); los nodos afectados se recalculan al pedirlos"""
+        for nombre, valor in valores.items():
+            if nombre not in self.entradas:
+                raise KeyError(f"{nombre} no es un dato de entrada de la simulación")
+            if not _iguales(valor, self._valores[nombre]):
+                self._valores[nombre] = valor
+                self._versiones[nombre] += 1
+                self._epoca += 1
+
+    def dependientes(self, nombre: str) -> list:
+        """Nodos afectados (directa o indirectamente) por un cambio en `nombre`"""
+        afectados = {nombre}
+        cambiado = True
+        while cambiado:
+            cambiado = False
+            for nodo, (_, dependencias) in self._nodos.items():
+                if nodo not in afectados and afectados.intersection(dependencias):
+                    afectados.add(nodo)
+                    cambiado = True
+        return sorted(afectados - {nombre})
+
+    # -------------------------------
+    # Resultado
+    # -------------------------------
+    @metricas.medido("simulacion_incremental")
+    def resultado(self, tablas_mensuales: bool = False):
+        """
+        Lo mismo que simular_hipoteca, sacado del grafo. Los resúmenes y las tablas se
+        calculan al acceder a ellos (o ya, con tablas_mensuales=True).
+        """
+        resultado = ResultadoIncremental(self, {
+            "cliente": self.obtener("nombre_completo"),
+            "dni_nie": self.obtener("dni_nie"),
+            "importe_financiar": self.obtener("importe_financiar"),
+            "plazo_variable": self.obtener("plazo_variable"),
+            "plazo_fijo": self.obtener("plazo_fijo"),
+            "diferencial": self.obtener("diferencial"),
+            "tasa_variable": self.obtener("tasa_variable"),
+            "tasa_fija": self.obtener("tasa_fija"),
+            "cuota_variable": self.obtener("cuota_variable"),
+            "cuota_fija": self.obtener("cuota_fija"),
+            "fecha_inicio": self.obtener("fecha_inicio")
+        })
+        if tablas_mensuales:
+            resultado["tabla_variable"]
+            resultado["tabla_fija"]
+        return resultado
+
+
+class ResultadoIncremental(ResultadoHipoteca):
+    """
+    ResultadoHipoteca cuyas tablas y resúmenes salen del grafo mientras la simulación no
+    cambie (así se reutilizan entre consultas); si ya ha cambiado, se calculan como siempre.
+    """
+
+    def __init__(self, simulacion: SimulacionIncremental, valores: dict):
+        super().__init__(valores)
+        self._simulacion = simulacion
+        self._epoca = simulacion._epoca
+
+    def __missing__(self, clave):
+        if clave in self._PEREZOSOS and self._simulacion._epoca == self._epoca:
+            valor = self[clave] = self._simulacion.obtener(clave)
+            return valor
+        return super().__missing__(clave)
+
+
+# -------------------------------
+# Cambios pedidos por el cliente
+# -------------------------------
+def interpretar_cambio(texto: str, actuales: dict):
+    """
+    Interpreta una corrección o un "¿y si...?" del cliente: 'entrada 60000',
+    'pon 10k más de entrada', '¿y si gano 200 menos?'. Devuelve (slot, nuevo valor) o None.
+    """
+    palabras = normalizar(texto, puntuacion=False)
+    encontrados = []
+    for slot, claves in PALABRAS_CAMBIO.items():
+        for clave in claves:
+            m = re.search(rf"\b{clave}\b", palabras)
+            if m:
+                encontrados.append((m.start(), slot))
+    numero = parsear_numero_es(texto)
+    if not encontrados or numero is NO_DECIDIDO:
+        return None
+    slot = min(encontrados)[1]
+    if re.search(r"\bmas\b", palabras):
+        return slot, parse_float(actuales.get(slot)) + numero
+    if re.search(r"\bmenos\b", palabras):
+        return slot, parse_float(actuales.get(slot)) - numero
+    return slot, numero
+
+
+def main(repeticiones: int = 1000):
+    datos = {"nombre_completo": "Ana Gómez Ruiz", "dni_nie": "44153821P", "precio_vivienda": 250000.0,
+             "entrada": 50000.0, "importe_a_financiar": 200000.0, "ingresos_netos_mensuales": 3200.0,
+             "gastos_mensuales_est": 900.0}
+
+    t = time.perf_counter()
+    for _ in range(20):
+        completo = simular_hipoteca(datos)
+    completo_ms = (time.perf_counter() - t) / 20 * 1000
+
+    simulacion = SimulacionIncremental(datos)
+    simulacion.resultado()["resumen_variable"]
+    t = time.perf_counter()
+    for i in range(repeticiones):
+        simulacion.cambiar(entrada=50000.0 + 10000 * (i % 2 + 1))
+        resultado = simulacion.resultado()
+    incremental_ms = (time.perf_counter() - t) / repeticiones * 1000
+
+    referencia = simular_hipoteca(dict(datos, entrada=60000.0, importe_a_financiar=190000.0))
+    simulacion.cambiar(entrada=60000.0)
+    resultado = simulacion.resultado()
+    for clave in ("importe_financiar", "plazo_variable", "plazo_fijo", "cuota_variable", "cuota_fija"):
+        assert abs(resultado[clave] - referencia[clave]) < 1e-9, clave
+    assert resultado["resumen_variable"].equals(referencia["resumen_variable"])
+
+    print(f"simular_hipoteca completo:           {completo_ms:8.3f} ms")
+    print(f"'¿y si pongo 10k más de entrada?':   {incremental_ms:8.3f} ms")
+    print(f"Afectados por 'entrada': {', '.join(simulacion.dependientes('entrada'))}")
+    print(f"Recalculos por nodo: {dict(simulacion.recalculos)}")
+
+
+if __name__ == "__main__":
+    main()
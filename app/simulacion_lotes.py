@@ -0,0 +1,181 @@
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, date
+import numpy as np
+from calculo_hipoteca import (
+    EURIBOR_ACTUAL, TASA_FIJA, parse_float, diferencial_por_riesgo, cuota_maxima,
+    cuotas_mensuales, calcular_plazos, calcular_amortizacion
+)
+from almacen_amortizacion import AlmacenAmortizacion
+from repositorio import RUTA_CLIENTES
+
+COLUMNAS_CLIENTE = [
+    "nombre_completo", "dni_nie", "importe_a_financiar",
+    "ingresos_netos_mensuales", "gastos_mensuales_est"
+]
+
+COLUMNAS_RESULTADO = [
+    ("cliente_rowid", "INTEGER PRIMARY KEY"),
+    ("nombre_completo", "TEXT"),
+    ("dni_nie", "TEXT"),
+    ("importe_financiar", "REAL"),
+    ("diferencial", "REAL"),
+    ("tasa_variable", "REAL"),
+    ("tasa_fija", "REAL"),
+    ("cuota_max", "REAL"),
+    ("plazo_variable", "INTEGER"),
+    ("plazo_fijo", "INTEGER"),
+    ("cuota_variable", "REAL"),
+    ("cuota_fija", "REAL"),
+    ("total_pagado_variable", "REAL"),
+    ("total_pagado_fijo", "REAL"),
+    ("intereses_variable", "REAL"),
+    ("intereses_fijo", "REAL"),
+    ("fecha_calculo", "TEXT")
+]
+
+
+def simular_bloque(filas, euribor: float = EURIBOR_ACTUAL, tasa_fija: float = TASA_FIJA) -> list:
+    """
+    Simula la hipoteca de un bloque de clientes de una vez.
+    `filas` son tuplas (rowid, *COLUMNAS_CLIENTE) tal y como salen de la tabla clientes.
+    Devuelve tuplas en el orden de COLUMNAS_RESULTADO.
+    """
+    if not filas:
+        return []
+    rowids, nombres, dnis, importes, ingresos, gastos = zip(*filas)
+    importes = np.array([parse_float(v) for v in importes])
+    ingresos = np.array([parse_float(v) for v in ingresos])
+    gastos = np.array([parse_float(v) for v in gastos])
+
+    # Riesgo, tasas y cuota máxima para todo el bloque
+    diferencial = diferencial_por_riesgo(ingresos, gastos)
+    tasa_variable = euribor + diferencial
+    cuota_max = cuota_maxima(ingresos, gastos)
+
+    # Plazos y cuotas
+    plazo_var = calcular_plazos(importes, cuota_max, tasa_variable)
+    plazo_fix = calcular_plazos(importes, cuota_max, tasa_fija)
+    cuota_var = cuotas_mensuales(importes, tasa_variable, plazo_var)
+    cuota_fix = cuotas_mensuales(importes, tasa_fija, plazo_fix)
+
+    # Resumen de amortización: total pagado e intereses
+    total_var = cuota_var * plazo_var * 12
+    total_fix = cuota_fix * plazo_fix * 12
+    intereses_var = total_var - importes
+    intereses_fix = total_fix - importes
+
+    fecha = datetime.now().isoformat(timespec="seconds")
+    columnas = zip(
+        rowids, nombres, dnis, importes.tolist(), diferencial.tolist(), tasa_variable.tolist(),
+        [tasa_fija] * len(rowids), cuota_max.tolist(), plazo_var.tolist(), plazo_fix.tolist(),
+        cuota_var.tolist(), cuota_fix.tolist(), total_var.tolist(), total_fix.tolist(),
+        intereses_var.tolist(), intereses_fix.tolist(), [fecha] * len(rowids)
+    )
+    return list(columnas)
+
+
+def simular_bloque_con_cuadros(filas, euribor: float = EURIBOR_ACTUAL, tasa_fija: float = TASA_FIJA) -> tuple:
+    """
+    simular_bloque más los cuadros de amortización completos de cada cliente,
+    como tuplas (cliente, tipo, tasa, importe, columnas) para AlmacenAmortizacion.guardar_lote
+    """
+    resultados = simular_bloque(filas, euribor, tasa_fija)
+    indices = {nombre: i for i, (nombre, _) in enumerate(COLUMNAS_RESULTADO)}
+    hoy = date.today()
+    cuadros = []
+    for r in resultados:
+        for tipo, tasa, plazo in [("variable", "tasa_variable", "plazo_variable"), ("fijo", "tasa_fija", "plazo_fijo")]:
+            importe, tasa, plazo = r[indices["importe_financiar"]], r[indices[tasa]], r[indices[plazo]]
+            cuadros.append((r[0], tipo, tasa, importe, calcular_amortizacion(importe, tasa, plazo, hoy)))
+    return resultados, cuadros
+
+
+def leer_clientes_por_bloques(conn: sqlite3.Connection, tamano_bloque: int):
+    """Recorre la tabla clientes en bloques de `tamano_bloque` filas sin cargarla entera"""
+    c = conn.cursor()
+    c.execute(f"SELECT rowid, {', '.join(COLUMNAS_CLIENTE)} FROM clientes ORDER BY rowid")
+    while True:
+        filas = c.fetchmany(tamano_bloque)
+        if not filas:
+            break
+        yield filas
+
+
+def crear_tabla_resultados(conn: sqlite3.Connection, tabla: str = "resultados_hipoteca"):
+    cols_def = ", ".join(f"{nombre} {tipo}" for nombre, tipo in COLUMNAS_RESULTADO)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {tabla} ({cols_def})")
+    conn.commit()
+
+
+def guardar_resultados(conn: sqlite3.Connection, resultados: list, tabla: str = "resultados_hipoteca"):
+    """Escribe un bloque de resultados de una sola vez (upsert por cliente_rowid)"""
+    placeholders = ", ".join(["?"] * len(COLUMNAS_RESULTADO))
+    conn.executemany(f"INSERT OR REPLACE INTO {tabla} VALUES ({placeholders})", resultados)
+    conn.commit()
+
+
+def simular_todos(db_path: str = RUTA_CLIENTES, tamano_bloque: int = 5000, procesos: int = None,
+                  euribor: float = EURIBOR_ACTUAL, tasa_fija: float = TASA_FIJA,
+                  tabla: str = "resultados_hipoteca", almacen: AlmacenAmortizacion = None) -> int:
+    """
+    Simula la hipoteca de todos los clientes de la base de datos.
+    Los bloques se reparten entre un pool de procesos; como mucho hay dos bloques
+    por proceso en vuelo para no cargar la tabla entera en memoria.
+    Con `almacen`, los cuadros de amortización completos se añaden también a ese almacén.
+    Devuelve el número de clientes simulados.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    conn = sqlite3.connect(db_path)
+    crear_tabla_resultados(conn, tabla)
+    simular = simular_bloque if almacen is None else simular_bloque_con_cuadros
+    total = 0
+
+    def guardar(futuro):
+        resultados = futuro.result()
+        if almacen is not None:
+            resultados, cuadros = resultados
+            almacen.guardar_lote(cuadros)
+        guardar_resultados(conn, resultados, tabla)
+        return len(resultados)
+
+    try:
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            pendientes = set()
+            for filas in leer_clientes_por_bloques(conn, tamano_bloque):
+                pendientes.add(pool.submit(simular, filas, euribor, tasa_fija))
+                if len(pendientes) >= 2 * procesos:
+                    hechos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        total += guardar(futuro)
+            for futuro in pendientes:
+                total += guardar(futuro)
+    finally:
+        conn.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación hipotecaria de todos los clientes de la base de datos")
+    parser.add_argument("--db", default=RUTA_CLIENTES, help="Ruta de la base de datos SQLite")
+    parser.add_argument("--bloque", type=int, default=5000, help="Clientes por bloque")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos del pool (por defecto, núcleos disponibles)")
+    parser.add_argument("--euribor", type=float, default=EURIBOR_ACTUAL)
+    parser.add_argument("--tasa-fija", type=float, default=TASA_FIJA)
+    parser.add_argument("--tabla", default="resultados_hipoteca", help="Tabla de resultados")
+    parser.add_argument("--cuadros", default=None, metavar="CARPETA",
+                        help="Guarda también los cuadros de amortización completos en ese almacén columnar")
+    args = parser.parse_args()
+
+    almacen = AlmacenAmortizacion(args.cuadros) if args.cuadros else None
+    inicio = time.perf_counter()
+    total = simular_todos(args.db, args.bloque, args.procesos, args.euribor, args.tasa_fija, args.tabla, almacen)
+    duracion = time.perf_counter() - inicio
+    print(f"{total} clientes simulados en {duracion:.2f} s ({total / duracion if duracion else 0:.0f} clientes/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,212 @@
+import ast
 import json
+import os
+import threading
+import time
+from validadores import compilar_validacion, NO_DECIDIDO
 
-def cargar_slots(json_file="../data/slots_basicos.json"):
-    with open(json_file, "r", encoding="utf-8") as f:
-        slot_json = json.load(f)
-    slots = slot_json["slots"]
-    validation_functions = slot_json.get("validation_functions", {})
-    return slots, validation_functions
\ No newline at end of file
+# Definición de slots y flujos: relativa a este módulo, no al directorio de trabajo
+RUTA_SLOTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "slots_basicos.json")
+
+# Tipo SQL de cada tipo de slot; el resto se guarda como TEXT
+TIPOS_SQL = {"number": "REAL", "boolean": "INTEGER"}  # 0/1 para booleanos
+
+# Segundos entre comprobaciones de la fecha de modificación del JSON
+INTERVALO_RECARGA = float(os.getenv("SLOTS_INTERVALO_RECARGA", "1.0"))
+
+# Funciones que se admiten en las expresiones de auto_compute
+FUNCIONES = {"min": min, "max": max, "abs": abs, "round": round}
+NODOS_PERMITIDOS = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load, ast.Constant, ast.Call,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd)
+
+
+def tipo_sql(slot) -> str:
+    return TIPOS_SQL.get(slot.get("type"), "TEXT")
+
+
+# -------------------------------
+# Slots calculados (auto_compute)
+# -------------------------------
+class ExpresionCalculada:
+    """Expresión aritmética de auto_compute (p. ej. 'precio_vivienda - entrada') compilada una sola vez"""
+
+    def __init__(self, slot: str, expresion: str):
+        self.slot = slot
+        self.expresion = expresion
+        arbol = ast.parse(expresion, mode="eval")
+        for nodo in ast.walk(arbol):
+            if not isinstance(nodo, NODOS_PERMITIDOS):
+                raise ValueError(f"auto_compute de {slot} no admitido: {expresion!r}")
+            if isinstance(nodo, ast.Constant) and not isinstance(nodo.value, (int, float)):
+                raise ValueError(f"auto_compute de {slot}: constante no numérica en {expresion!r}")
+            if isinstance(nodo, ast.Call) and (not isinstance(nodo.func, ast.Name) or nodo.func.id not in FUNCIONES):
+                raise ValueError(f"auto_compute de {slot}: función no admitida en {expresion!r}")
+        funciones = {n.func.id for n in ast.walk(arbol) if isinstance(n, ast.Call)}
+        self.dependencias = sorted({n.id for n in ast.walk(arbol) if isinstance(n, ast.Name)} - funciones)
+        self._codigo = compile(arbol, f"<auto_compute {slot}>", "eval")
+
+    def __call__(self, datos: dict) -> float:
+        variables = {d: float(datos[d]) for d in self.dependencias}
+        return eval(self._codigo, {"__builtins__": {}, **FUNCIONES}, variables)
+
+
+# -------------------------------
+# Esquema compilado
+# -------------------------------
+class EsquemaSlots:
+    """
+    Slots y flujos del JSON ya interpretados: validaciones como funciones, auto_compute
+    como grafo de dependencias y tipos SQL de cada columna. Se comparte entre sesiones,
+    así que no debe modificarse.
+    """
+
+    def __init__(self, datos: dict, ruta: str = None, mtime: int = None):
+        self.ruta = ruta
+        self.mtime = mtime
+        self.slots = datos["slots"]
+        self.validation_functions = datos.get("validation_functions", {})
+        self.flujos = {nombre: flujo.get("steps", []) for nombre, flujo in datos.get("flows", {}).items()}
+        self.por_nombre = {s["name"]: s for s in self.slots}
+        self.validadores = {s["name"]: compilar_validacion(s) for s in self.slots}
+        self.columnas = [(s["name"], tipo_sql(s)) for s in self.slots]
+        self.pre_rellenables = {s["name"]: s["pre_fill_if_client_data"]
+                                for s in self.slots if s.get("pre_fill_if_client_data")}
+        self.calculados = {s["name"]: ExpresionCalculada(s["name"], s["auto_compute"])
+                           for s in self.slots if s.get("auto_compute")}
+        self.orden_calculo = self._ordenar_calculados()
+
+    def _ordenar_calculados(self) -> list:
+        """Orden topológico de los slots calculados (un calculado puede depender de otro)"""
+        for expresion in self.calculados.values():
+            desconocidas = [d for d in expresion.dependencias if d not in self.por_nombre]
+            if desconocidas:
+                raise ValueError(f"auto_compute de {expresion.slot} usa slots inexistentes: {desconocidas}")
+        orden, visitados, en_curso = [], set(), set()
+
+        def visitar(nombre):
+            if nombre in visitados:
+                return
+            if nombre in en_curso:
+                raise ValueError(f"Dependencia circular en auto_compute: {nombre}")
+            en_curso.add(nombre)
+            for dependencia in self.calculados[nombre].dependencias:
+                if dependencia in self.calculados:
+                    visitar(dependencia)
+            en_curso.discard(nombre)
+            visitados.add(nombre)
+            orden.append(nombre)
+
+        for nombre in self.calculados:
+            visitar(nombre)
+        return orden
+
+    def flujo(self, nombre: str = "default") -> list:
+        return self.flujos.get(nombre, [])
+
+    def validador(self, slot):
+        """Validación compilada del slot; si no es un slot de este esquema se compila al vuelo"""
+        if self.por_nombre.get(slot["name"]) is slot:
+            return self.validadores[slot["name"]]
+        return compilar_validacion(slot)
+
+    def dependientes(self, nombre: str) -> list:
+        """Slots calculados que dependen (directa o indirectamente) de `nombre`, en orden de cálculo"""
+        afectados = {nombre}
+        for calculado in self.orden_calculo:
+            if afectados.intersection(self.calculados[calculado].dependencias):
+                afectados.add(calculado)
+        return [c for c in self.orden_calculo if c in afectados and c != nombre]
+
+    def pendientes(self, datos: dict, slots: list = None) -> list:
+        """
+        Slots que aún hay que preguntar: los que no están en `datos`, sin los calculados
+        que todavía esperan a sus dependencias (se calcularán, no se preguntan).
+        """
+        pendientes = []
+        for slot in self.slots if slots is None else slots:
+            nombre = slot["name"]
+            if nombre in datos:
+                continue
+            expresion = self.calculados.get(nombre)
+            if expresion is not None and any(datos.get(d) is None for d in expresion.dependencias):
+                continue
+            pendientes.append(slot)
+        return pendientes
+
+    def pre_rellenar(self, registro: dict) -> dict:
+        """
+        Valores de los slots con pre_fill_if_client_data a partir de la ficha del cliente.
+        Cada dato pasa por la validación del slot; si la ficha trae varios candidatos
+        (p. ej. 'contact': [teléfono, email]) se queda el primero que el slot acepta.
+        """
+        valores = {}
+        for nombre, clave in self.pre_rellenables.items():
+            candidatos = registro.get(clave)
+            if not isinstance(candidatos, (list, tuple)):
+                candidatos = [candidatos]
+            for candidato in candidatos:
+                if candidato is None or candidato == "":
+                    continue
+                valor = self.validadores[nombre](str(candidato))
+                if valor is not None and valor is not NO_DECIDIDO:
+                    valores[nombre] = valor
+                    break
+        return valores
+
+    def calcular(self, datos: dict, sobrescribir: bool = False) -> dict:
+        """
+        Valores de los slots calculados cuyas dependencias ya están en `datos`.
+        Los que ya tienen valor solo se recalculan con sobrescribir=True.
+        """
+        datos = dict(datos)
+        calculados = {}
+        for nombre in self.orden_calculo:
+            expresion = self.calculados[nombre]
+            if datos.get(nombre) is not None and not sobrescribir:
+                continue
+            if any(datos.get(d) is None for d in expresion.dependencias):
+                continue
+            try:
+                datos[nombre] = calculados[nombre] = expresion(datos)
+            except (TypeError, ValueError, ZeroDivisionError):
+                continue
+        return calculados
+
+
+# -------------------------------
+# Carga con caché por proceso
+# -------------------------------
+_esquemas = {}  # ruta -> (mtime_ns, comprobado, EsquemaSlots)
+_lock = threading.Lock()
+
+
+def cargar_esquema(json_file: str = RUTA_SLOTS) -> EsquemaSlots:
+    """
+    Esquema compilado del JSON, compartido por todo el proceso.
+    Solo se vuelve a leer si cambia la fecha de modificación del fichero
+    (comprobada como mucho cada INTERVALO_RECARGA segundos).
+    """
+    ruta = os.path.abspath(json_file)
+    entrada = _esquemas.get(ruta)
+    ahora = time.monotonic()
+    if entrada is not None and ahora - entrada[1] < INTERVALO_RECARGA:
+        return entrada[2]
+    with _lock:
+        entrada = _esquemas.get(ruta)
+        mtime = os.stat(ruta).st_mtime_ns
+        if entrada is not None and entrada[0] == mtime:
+            _esquemas[ruta] = (mtime, ahora, entrada[2])
+            return entrada[2]
+        with open(ruta, "r", encoding="utf-8") as f:
+            esquema = EsquemaSlots(json.load(f), ruta, mtime)
+        _esquemas[ruta] = (mtime, ahora, esquema)
+        return esquema
+
+
+def cargar_slots(json_file=RUTA_SLOTS):
+    esquema = cargar_esquema(json_file)
+    return esquema.slots, esquema.validation_functions
+
+
+def cargar_flujo(json_file=RUTA_SLOTS, flujo="default"):
+    return cargar_esquema(json_file).flujo(flujo)
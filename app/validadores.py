@@ -0,0 +1,301 @@
+import re
+import unicodedata
+from datetime import date
+
+# Resultado de un validador que no puede decidir por sí solo (hay que preguntar al LLM)
+NO_DECIDIDO = object()
+
+LETRAS_DNI = "TRWAGMYFPDXBNJZSQVHLCKE"
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12
+}
+
+RESPUESTAS_SI = {"si", "s", "yes", "y", "claro", "vale", "correcto", "afirmativo", "efectivamente", "por supuesto", "desde luego"}
+RESPUESTAS_NO = {"no", "n", "nop", "negativo", "para nada", "en absoluto"}
+RESPUESTAS_DUDA = {"no se", "tal vez", "quizas", "quiza", "puede", "a lo mejor", "depende", "ni idea"}
+
+PREFIJOS_NOMBRE = ("mi nombre completo es", "mi nombre es", "me llamo", "soy")
+
+
+def normalizar(texto: str, puntuacion: bool = True) -> str:
+    """Minúsculas, sin tildes y con espacios simples; con puntuacion=False quita también los signos"""
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    texto = "".join(ch for ch in texto if not unicodedata.combining(ch))
+    if not puntuacion:
+        texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def parsear_spec(spec: str):
+    """'adult_min_age:18' -> ('adult_min_age', '18'); 'is_bool' -> ('is_bool', None)"""
+    nombre, _, argumento = spec.partition(":")
+    return nombre.strip(), (argumento.strip() or None)
+
+
+# -------------------------------
+# Booleanos
+# -------------------------------
+def validar_bool(texto, argumento=None, slot=None, contexto=None):
+    t = normalizar(texto, puntuacion=False)
+    if t in RESPUESTAS_DUDA or any(t.startswith(d + " ") for d in RESPUESTAS_DUDA):
+        return None
+    if t in RESPUESTAS_SI:
+        return True
+    if t in RESPUESTAS_NO:
+        return False
+    palabras = t.split()
+    if not palabras:
+        return NO_DECIDIDO
+    # 'sí, soy cliente' / 'no, no lo soy'
+    if palabras[0] in RESPUESTAS_SI and "no" not in palabras[1:]:
+        return True
+    if palabras[0] in RESPUESTAS_NO:
+        return False
+    return NO_DECIDIDO
+
+
+# -------------------------------
+# DNI / NIE
+# -------------------------------
+def letra_dni(numero: int) -> str:
+    return LETRAS_DNI[numero % 23]
+
+
+def dni_valido(valor: str) -> bool:
+    """Comprueba formato y letra de control de un DNI (12345678Z) o NIE (X1234567L)"""
+    valor = valor.upper()
+    m = re.fullmatch(r"([XYZ]?)(\d{7,8})([A-Z])", valor)
+    if not m:
+        return False
+    prefijo, digitos, letra = m.groups()
+    if prefijo:
+        if len(digitos) != 7:
+            return False
+        digitos = str("XYZ".index(prefijo)) + digitos
+    elif len(digitos) != 8:
+        return False
+    return letra_dni(int(digitos)) == letra
+
+
+# DNI/NIE dentro de una frase, con separadores opcionales entre las cifras y antes de la
+# letra: '44.153.821-P', 'X 1234567 L'. Solo se quitan del documento encontrado, no de la frase
+PATRON_DNI = re.compile(r"\b([XYZxyz][\s.-]?)?(\d(?:[\s.-]?\d){6,7})(?:[\s.-]?([A-Za-z]))?\b")
+
+
+def validar_dni(texto, argumento=None, slot=None, contexto=None):
+    m = PATRON_DNI.search(str(texto).strip())
+    if not m:
+        return NO_DECIDIDO
+    prefijo, digitos, letra = m.groups()
+    if not letra:
+        return None  # falta la letra
+    valor = ((prefijo or "").strip(" .-") + re.sub(r"[\s.-]", "", digitos) + letra).upper()
+    return valor if dni_valido(valor) else None
+
+
+# -------------------------------
+# Fechas
+# -------------------------------
+def parsear_fecha(texto):
+    """Devuelve un date, None si la fecha no existe, o NO_DECIDIDO si no hay una fecha reconocible"""
+    t = normalizar(texto)
+    m = re.search(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b", t)
+    if m:
+        dia, mes, ano = (int(g) for g in m.groups())
+    else:
+        m = re.search(r"\b(\d{1,2}) de (\w+) (?:de|del) (\d{4})\b", t)
+        if not m or m.group(2) not in MESES:
+            return NO_DECIDIDO
+        dia, mes, ano = int(m.group(1)), MESES[m.group(2)], int(m.group(3))
+    try:
+        return date(ano, mes, dia)
+    except ValueError:
+        return None
+
+
+def edad(nacimiento: date, hoy: date = None) -> int:
+    hoy = hoy or date.today()
+    return hoy.year - nacimiento.year - ((hoy.month, hoy.day) < (nacimiento.month, nacimiento.day))
+
+
+def validar_edad_minima(texto, argumento="18", slot=None, contexto=None):
+    fecha = parsear_fecha(texto)
+    if fecha is NO_DECIDIDO or fecha is None:
+        return fecha
+    if edad(fecha) < int(argumento or 18):
+        return None
+    return fecha.strftime("%d/%m/%Y")
+
+
+# -------------------------------
+# Contacto
+# -------------------------------
+def validar_telefono(texto):
+    t = re.sub(r"[\s().-]", "", str(texto))
+    m = re.search(r"\+?\d+", t)
+    if not m:
+        return NO_DECIDIDO
+    numero = re.sub(r"^(\+34|0034)", "", m.group(0))
+    return numero if re.fullmatch(r"[679]\d{8}", numero) else None
+
+
+def validar_email(texto):
+    t = str(texto).strip()
+    if "@" not in t:
+        return NO_DECIDIDO
+    m = re.search(r"[\w.+-]+@[\w-]+(\.[\w-]+)*\.[A-Za-z]{2,}", t)
+    if not m or t.count("@") != 1:
+        return None
+    return m.group(0).lower()
+
+
+def validar_contacto(texto, argumento=None, slot=None, contexto=None):
+    if slot and slot.get("name") == "email":
+        return validar_email(texto)
+    return validar_telefono(texto)
+
+
+# -------------------------------
+# Números (formato español)
+# -------------------------------
+# Cantidades en palabras que parsear_numero_es no interpreta: si quedan en el texto no se decide
+PALABRAS_NUMERO = {
+    "dos", "tres", "cuatro", "cinco", "seis", "siete", "ocho", "nueve", "diez", "once", "doce", "trece",
+    "catorce", "quince", "veinte", "treinta", "cuarenta", "cincuenta", "sesenta", "setenta", "ochenta",
+    "noventa", "cien", "ciento", "doscientos", "trescientos", "cuatrocientos", "quinientos", "seiscientos",
+    "setecientos", "ochocientos", "novecientos", "mil", "millon", "millones", "pico"
+}
+FRACCIONES = {"medio": 0.5, "media": 0.5, "cuarto": 0.25}
+
+# Unidades que pueden ir pegadas al número (normalizar ya convierte 'm²' en 'm2')
+UNIDADES = r"(?<![a-z])(?:m2|mts2|metros cuadrados|metros|euros|eur)\b"
+
+
+def parsear_numero_es(texto):
+    """
+    Interpreta importes escritos en español: '250.000 €', '1.500,50', '1,5k', '300 mil',
+    '1,2 millones', '2 millones y medio'. Devuelve el número, o NO_DECIDIDO si no hay
+    exactamente uno o quedan cantidades en palabras sin interpretar ('y pico', 'dos mil').
+    """
+    # Las unidades se quitan antes de buscar el número: en '10m2' el valor es 10, no el 2 del exponente
+    t = re.sub(UNIDADES, " ", normalizar(texto).replace("€", " "))
+    patron = (r"(?<![\d.,])(\d{1,3}(?:[.\s]\d{3})+(?:,\d+)?|\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?)"
+              r"(?:\s*(k|mil|millon(?:es)?)(?:\s+y\s+(\w+))?)?(?!\w|[.,]\d)")
+    encontrados = list(re.finditer(patron, t))
+    if len(encontrados) != 1:
+        return NO_DECIDIDO
+    numero, sufijo, fraccion = encontrados[0].groups()
+    resto = (t[:encontrados[0].start()] + " " + t[encontrados[0].end():]).split()
+    if any(palabra in PALABRAS_NUMERO for palabra in resto):
+        return NO_DECIDIDO
+
+    if re.fullmatch(r"\d{1,3}(?:[.\s]\d{3})+(?:,\d+)?", numero):
+        # Miles con punto (o espacio) y decimales con coma
+        valor = float(re.sub(r"[.\s]", "", numero).replace(",", "."))
+    elif re.fullmatch(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?", numero) and not sufijo:
+        # '250,000': coma como separador de miles
+        valor = float(numero.replace(",", ""))
+    else:
+        valor = float(numero.replace(",", "."))
+
+    if fraccion:
+        # '2 millones y medio'; 'y pico' no es una cantidad exacta
+        if fraccion not in FRACCIONES:
+            return NO_DECIDIDO
+        valor += FRACCIONES[fraccion]
+    multiplicador = {"k": 1e3, "mil": 1e3}.get(sufijo, 1e6 if sufijo and sufijo.startswith("millon") else 1)
+    return valor * multiplicador
+
+
+def _validar_numero(texto, condicion):
+    valor = parsear_numero_es(texto)
+    if valor is NO_DECIDIDO:
+        return NO_DECIDIDO
+    return valor if condicion(valor) else None
+
+
+def validar_positivo(texto, argumento=None, slot=None, contexto=None):
+    return _validar_numero(texto, lambda v: v > 0)
+
+
+def validar_no_negativo(texto, argumento=None, slot=None, contexto=None):
+    return _validar_numero(texto, lambda v: v >= 0)
+
+
+def validar_entrada(texto, argumento=None, slot=None, contexto=None):
+    precio = (contexto or {}).get("precio_vivienda")
+    if isinstance(precio, (int, float)):
+        return _validar_numero(texto, lambda v: 0 <= v < precio)
+    return _validar_numero(texto, lambda v: v >= 0)
+
+
+# -------------------------------
+# Textos
+# -------------------------------
+def validar_longitud_minima(texto, argumento="1", slot=None, contexto=None):
+    if len(str(texto).strip()) < int(argumento or 1):
+        return None
+    return NO_DECIDIDO
+
+
+def validar_nombre_completo(texto):
+    """Nombre y dos apellidos; con más palabras (nombres compuestos, 'de la') decide el LLM"""
+    t = " ".join(str(texto).split()).strip(" .")
+    for prefijo in PREFIJOS_NOMBRE:
+        if normalizar(t).startswith(prefijo + " "):
+            t = t[len(prefijo) + 1:].strip()
+            break
+    if t.islower():
+        t = t.title()
+    palabras = t.split()
+    if not palabras or not all(re.fullmatch(r"[^\W\d_]+(?:[-'][^\W\d_]+)*", p) for p in palabras):
+        return NO_DECIDIDO
+    if len(palabras) < 3:
+        return None
+    if len(palabras) == 3:
+        return " ".join(palabras)
+    return NO_DECIDIDO
+
+
+VALIDADORES = {
+    "is_bool": validar_bool,
+    "min_length": validar_longitud_minima,
+    "dni_format": validar_dni,
+    "adult_min_age": validar_edad_minima,
+    "phone_or_email": validar_contacto,
+    "positive_number": validar_positivo,
+    "non_negative": validar_no_negativo,
+    "non_negative_and_less_than_price": validar_entrada
+}
+
+
+def compilar_validacion(slot):
+    """
+    Convierte el campo 'validation' del slot (p. ej. 'min_length:3') en una función
+    (texto, contexto=None) con la especificación ya interpretada.
+    """
+    spec = slot.get("validation")
+    nombre, argumento = parsear_spec(spec) if spec else (None, None)
+    validador = VALIDADORES.get(nombre)
+    es_nombre = slot["name"] == "nombre_completo"
+
+    def validar(texto, contexto=None):
+        if es_nombre:
+            valor = validar_nombre_completo(texto)
+            if valor is not NO_DECIDIDO:
+                return valor
+        if validador is None:
+            return NO_DECIDIDO
+        return validador(texto, argumento, slot, contexto)
+    return validar
+
+
+def validar_determinista(slot, texto, contexto=None):
+    """
+    Valida la respuesta con reglas fijas según el campo 'validation' del slot.
+    Devuelve el valor limpio, None si la respuesta no es válida, o NO_DECIDIDO
+    si las reglas no bastan y hay que preguntar al LLM.
+    """
+    return compilar_validacion(slot)(texto, contexto)
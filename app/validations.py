@@ -1,18 +1,64 @@
-from model_loader import model, tokenizer
+from model_loader import id_modelo
+from inferencia import generar
+import hashlib
+import json
+import os
 import re
-from datetime import datetime
+from validadores import NO_DECIDIDO, validar_dni
+from slot_loader import cargar_esquema
+from cache_llm import cache_llm, normalizar_entrada
+import metricas
 
-def validar_con_modelo(slot, user_input):
+# Subir al cambiar el formato del prompt o el post-procesado de la respuesta
+PROMPT_VERSION = "3"
+
+# Generación por tipo de slot: tokens máximos, patrón de valor completo (se para al
+# encajar) y caracteres permitidos (solo con VALIDACION_RESTRINGIDA=1).
+# En todos los casos la generación para también en el primer salto de línea.
+GENERACION_POR_TIPO = {
+    "boolean": {"max_new_tokens": 4, "parada": r"^'?(sí|si|no|INCOMPLETO)\b",
+                "permitidos": "síinoSINOCMPLET'"},
+    "date": {"max_new_tokens": 12, "parada": r"^'?(\d{1,2}/\d{1,2}/\d{4}|INCOMPLETO)",
+             "permitidos": "0-9/INCOMPLETO'"},
+    "number": {"max_new_tokens": 12, "parada": r"^'?INCOMPLETO", "permitidos": "0-9.,€INCOMPLETO'"},
+    "contact": {"max_new_tokens": 24, "parada": r"^'?INCOMPLETO"},
+    "string": {"max_new_tokens": 20, "parada": r"^'?INCOMPLETO"}
+}
+GENERACION_POR_SLOT = {
+    "dni_nie": {"max_new_tokens": 10, "parada": r"^'?([0-9]{8}[A-Za-z]|[XYZxyz][0-9]{7}[A-Za-z]|INCOMPLETO)",
+                "permitidos": "0-9A-Za-z'"}
+}
+RESTRINGIR_TOKENS = os.getenv("VALIDACION_RESTRINGIDA") == "1"
+
+# Tipos cuyo valor solo se acepta si las reglas deterministas lo reconocen en la respuesta del LLM
+TIPOS_ESTRICTOS = ("number", "date", "contact")
+
+def opciones_generacion(slot):
+    """Argumentos de generar() para el slot: presupuesto de tokens y condiciones de parada"""
+    opciones = dict(GENERACION_POR_SLOT.get(slot["name"]) or GENERACION_POR_TIPO.get(slot["type"]) or {"max_new_tokens": 50})
+    if not RESTRINGIR_TOKENS:
+        opciones.pop("permitidos", None)
+    return opciones
+
+def primera_linea(respuesta):
+    """Primera línea no vacía de la respuesta, sin comillas alrededor"""
+    for linea in respuesta.splitlines():
+        linea = linea.strip().strip("'\"").strip()
+        if linea:
+            return linea
+    return ""
+
+def prefijo_prompt(slot):
     """
-    Extrae y limpia la respuesta del usuario usando el LLM.
-    Devuelve un valor limpio o None si no cumple los requisitos.
+    Parte fija del prompt de extracción de un slot (instrucciones y reglas).
+    La respuesta del cliente va al final para que este prefijo sea común a todas
+    las validaciones del slot y su KV-cache se pueda reutilizar.
     """
     prompt = f"""
     Eres un asistente que extrae información precisa de un cliente.
     Solo devuelve el valor solicitado, sin explicaciones adicionales.
 
     Pregunta: {slot['prompt']}
-    Respuesta del cliente: {user_input}
 
     Reglas estrictas:
     """
@@ -83,17 +129,44 @@ def validar_con_modelo(slot, user_input):
     #     - Si no cumple o es ambiguo, devuelve 'INCOMPLETO'.
     #     """
     # prompt += "\nDevuelve solo el valor limpio o 'INCOMPLETO'."
+    prompt += "\n    Respuesta del cliente:"
+    return prompt
+
+def construir_prompt(slot, user_input):
+    """Prompt de extracción para un slot y la respuesta del cliente"""
+    return prefijo_prompt(slot) + f" {user_input}\n"
+
+def huella_prompt(slot):
+    """Versión del prompt de un slot: cambia si cambian las reglas o PROMPT_VERSION"""
+    plantilla = construir_prompt(slot, "{respuesta}")
+    return PROMPT_VERSION + ":" + hashlib.sha256(plantilla.encode("utf-8")).hexdigest()[:16]
+
+@metricas.medido("validacion")
+def validar_con_modelo(slot, user_input, contexto=None):
+    """
+    Extrae y limpia la respuesta del usuario usando el LLM.
+    Antes se prueban las reglas deterministas del slot ('validation' en el JSON);
+    el LLM solo se llama si esas reglas no pueden decidir y la respuesta no está en caché.
+    `contexto` son los datos ya recogidos (p. ej. precio_vivienda para validar la entrada).
+    Devuelve un valor limpio o None si no cumple los requisitos.
+    """
+    validar_determinista = cargar_esquema().validador(slot)
+    valor = validar_determinista(user_input, contexto)
+    if valor is not NO_DECIDIDO:
+        metricas.contador("validaciones_total", slot=slot["name"], via="determinista")
+        return valor
 
     try:
-        inputs = tokenizer.apply_chat_template(
-            [{"role": "user", "content": prompt}],
-            add_generation_prompt=True,
-            return_tensors="pt",
-            return_dict=True
-        ).to(model.device)
-        output = model.generate(**inputs, max_new_tokens=50)
-        raw_response = tokenizer.decode(output[0], skip_special_tokens=True).strip()
-        last_response = raw_response.split("\n")[-1].strip()
+        # Se guarda la respuesta en bruto del LLM; el post-procesado depende del contexto
+        version = huella_prompt(slot)
+        clave = cache_llm.clave(slot["name"], normalizar_entrada(slot, user_input), id_modelo(), version)
+        last_response = cache_llm.obtener(clave)
+        metricas.contador("validaciones_total", slot=slot["name"], via="cache" if last_response is not None else "llm")
+        if last_response is None:
+            raw_response = generar([{"role": "user", "content": construir_prompt(slot, user_input)}],
+                                   prefijo=prefijo_prompt(slot), **opciones_generacion(slot))
+            last_response = primera_linea(raw_response)
+            cache_llm.guardar(clave, last_response, slot["name"], version)
 
         # Validación estricta para nombre completo
         if slot["name"] == "nombre_completo":
@@ -103,23 +176,24 @@ def validar_con_modelo(slot, user_input):
             return " ".join(palabras[:3])  # Nombre + 2 apellidos
 
         if slot["name"] == "dni_nie":
-            if last_response.upper() == "INCOMPLETO":
-                return None
-            # Validar formato con regex
-            if not re.match(r'^([0-9]{8}[A-Za-z]|[XYZxyz][0-9]{7}[A-Za-z])$', last_response):
-                return None
-            return last_response
+            # Formato y letra de control, igual que con lo que escribe el cliente
+            valor = validar_dni(last_response)
+            return None if valor is NO_DECIDIDO else valor
         
         # Validación para otros slots
         if last_response.upper() == "INCOMPLETO":
             return None
 
-        if slot["type"] == "date":
-            try:
-                datetime.strptime(last_response, "%d/%m/%Y")
-            except ValueError:
-                return None
-        elif slot["type"] == "boolean":
+        # Normalizar la respuesta del LLM con las mismas reglas (números, fechas, teléfonos...)
+        valor = validar_determinista(last_response, contexto)
+        if valor is not NO_DECIDIDO:
+            return valor
+
+        # Si las reglas no entienden lo que devuelve el LLM para un número, una fecha o un
+        # contacto, no se guarda el texto tal cual: se vuelve a preguntar
+        if slot["type"] in TIPOS_ESTRICTOS:
+            return None
+        if slot["type"] == "boolean":
             v_lower = last_response.lower()
             if v_lower in ["sí", "si", "s", "yes"]:
                 return True
@@ -131,4 +205,59 @@ def validar_con_modelo(slot, user_input):
         return last_response or None
     except Exception as e:
         print(f"Error al generar respuesta: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def construir_prompt_extraccion(slots, user_input):
+    """Prompt para extraer de una sola vez todos los slots que aparezcan en un texto libre"""
+    campos = "\n".join(f"    - {s['name']} ({s['type']}): {s['prompt']}" for s in slots)
+    return f"""
+    Eres un asistente que extrae información precisa de un cliente.
+    Del mensaje del cliente, extrae SOLO los datos que aparezcan de forma explícita.
+
+    Campos posibles:
+{campos}
+
+    Mensaje del cliente: {user_input}
+
+    Reglas estrictas:
+        - Devuelve ÚNICAMENTE un objeto JSON en una sola línea, sin explicaciones.
+        - Usa como claves los nombres de los campos; omite los que no aparezcan. No inventes datos.
+        - Números sin separadores de miles ni símbolos (ej. 300000), booleanos como true/false,
+          fechas en formato DD/MM/YYYY.
+        - Ejemplo: {{"nombre_completo": "Juan Pérez García", "precio_vivienda": 300000}}
+    """
+
+@metricas.medido("extraccion")
+def extraer_slots(slots, user_input, contexto=None):
+    """
+    Extrae en una sola generación todos los slots que el cliente haya mencionado.
+    Cada valor se valida después por separado (reglas deterministas y, si no bastan, el LLM).
+    Devuelve un dict slot -> valor limpio solo con los slots válidos.
+    """
+    contexto = dict(contexto or {})
+    try:
+        # Solo los tokens nuevos: el prompt también contiene un JSON de ejemplo
+        respuesta = generar(
+            [{"role": "user", "content": construir_prompt_extraccion(slots, user_input)}],
+            max_new_tokens=40 + 25 * len(slots)
+        )
+        match = re.search(r"\{.*?\}", respuesta, re.DOTALL)
+        extraidos = json.loads(match.group(0)) if match else {}
+    except Exception as e:
+        print(f"Error al extraer datos: {e}")
+        return {}
+    if not isinstance(extraidos, dict):
+        return {}
+
+    resultado = {}
+    for slot in slots:
+        valor = extraidos.get(slot["name"])
+        if valor is None or valor == "" or slot["name"] in contexto:
+            continue
+        if isinstance(valor, bool):
+            valor = "sí" if valor else "no"
+        valor_limpio = validar_con_modelo(slot, str(valor), contexto)
+        if valor_limpio is not None:
+            resultado[slot["name"]] = valor_limpio
+            contexto[slot["name"]] = valor_limpio
+    return resultado